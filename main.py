@@ -9,19 +9,94 @@
 """
 import os
 import subprocess
+import threading
 
-from utils.init_setting import Path, setup_logger, get_env_data
-from utils.file_io import read_csv
+from utils.init_setting import Path, setup_logger, get_env_data, get_pipeline_setting, get_analysis_setting
+from utils.file_io import iter_csv
 from utils.cut_segmentation_mod import cut_segmentation
+from utils.duplicate_detection_mod import find_duplicates, write_duplicate_report, seed_duplicate_cuts, propagate_duplicate_labels
 from utils.cut_img_generate_mod import cut_img_generate
+from utils.frame_share_mod import SharedFrameStore
 from utils.label_shaping_mod import label_shaping
-from utils.scene_integration_mod import scene_integration
+from utils.label_vocab_mod import get_label_vocab
+from utils.scene_integration_mod import scene_integration, OnlineSceneIntegrator, LabelingFollower
 from utils.analysis_mod import favo_analysis
 
+def get_detection_cmd(path, pipeline_setting, resume=False):
+    """物体検出の実行コマンドを返す関数
+
+    Parameters
+    ----------
+    path : utils.init_setting.Path
+        パス設定
+
+    pipeline_setting : dict
+        パイプラインの動作設定
+
+    resume : bool, default False
+        ラベル付け済みのカットを読み飛ばして再開するかどうか
+
+    Returns
+    -------
+    cmd : str
+        実行コマンド
+    """
+    # 環境データの取得
+    object_detection_env, config_file, checkpoint_file, classes_file, backend, onnx_file, artifact_file = get_env_data('OBJECT_DET_ENV')
+
+    cmd = f'conda run -n {object_detection_env} python utils/object_detection_mod.py '\
+        f'{config_file} {checkpoint_file} {classes_file} {path.cut_img_dir} {path.noun_label_path} --backend {backend}'
+    if backend == 'onnx':
+        cmd += f' --onnx-file {onnx_file}'
+    if artifact_file:
+        cmd += f' --artifact {artifact_file}'
+    if pipeline_setting['frame_handoff'] == 'shared_memory':
+        cmd += f' --shm-manifest {pipeline_setting["frame_manifest_path"]}'
+    if resume:
+        cmd += ' --resume'
+
+    return cmd
+
+def get_recognition_cmd(path, pipeline_setting, resume=False):
+    """動作認識の実行コマンドを返す関数
+
+    Parameters
+    ----------
+    path : utils.init_setting.Path
+        パス設定
+
+    pipeline_setting : dict
+        パイプラインの動作設定
+
+    resume : bool, default False
+        ラベル付け済みのカットを読み飛ばして再開するかどうか
+
+    Returns
+    -------
+    cmd : str
+        実行コマンド
+    """
+    # 環境データの取得
+    action_recognition_env, config_file, checkpoint_file, classes_file, artifact_file = get_env_data("ACTION_REC_ENV")
+
+    cmd = f'conda run -n {action_recognition_env} python utils/action_recognition_mod.py '\
+        f'{config_file} {checkpoint_file} {classes_file} {path.cut_dir} {path.verb_label_path}'
+    if artifact_file:
+        cmd += f' --artifact {artifact_file}'
+    if pipeline_setting['frame_handoff'] == 'shared_memory':
+        cmd += f' --shm-manifest {pipeline_setting["frame_manifest_path"]}'
+    elif pipeline_setting['clip_source'] == 'source_video':
+        cmd += f' --video-dir {path.video_dir} --cut-point {path.cut_point_path}'
+    if resume:
+        cmd += ' --resume'
+
+    return cmd
+
 if __name__ == '__main__':
     # --------------------------------------------------
     # 処理開始
     # --------------------------------------------------
+    frame_store = None  # フレームデータを公開する共有メモリ（frame_handoff = shared_memory の場合）
     try:   
         # --------------------------------------------------
         # 各種設定
@@ -35,6 +110,14 @@ if __name__ == '__main__':
         # パス設定
         path = Path()
 
+        # パイプラインの動作設定
+        pipeline_setting = get_pipeline_setting()
+        analysis_setting = get_analysis_setting() or {}   # 好感度分析のランキングの設定（[ANALYSIS] セクションが無い場合は既定値）
+        use_shared_memory = pipeline_setting['frame_handoff'] == 'shared_memory'
+        save_cut_files = pipeline_setting['save_cut_files']
+        dedup = pipeline_setting['dedup']
+        online_integration = pipeline_setting['scene_integration'] == 'online'
+
         # ルートディレクトリではないとき作業ディレクトリを変更
         if os.getcwd() == path.root_path:
             os.chdir(path.root_path)
@@ -62,17 +145,9 @@ if __name__ == '__main__':
          'CM好感度sec14', 'CM好感度sec15', 'CM好感度sec16', 'CM好感度sec17', 'CM好感度sec18', 'CM好感度sec19', 'CM好感度sec20', 'CM好感度sec21', 
          'CM好感度sec22', 'CM好感度sec23', 'CM好感度sec24', 'CM好感度sec25', 'CM好感度sec26', 'CM好感度sec27', 'CM好感度sec28', 'CM好感度sec29', 'CM好感度sec30']
         """
-        # 上位データ
-        header, *data_row = read_csv(path.cmData_top_path)
-        cm_data_top = [dict(zip(header, item)) for item in data_row]    # 辞書型のリストに整形
-        
-        # 下位データ
-        header, *data_row = read_csv(path.cmData_btm_path)
-        cm_data_btm = [dict(zip(header, item)) for item in data_row]
-        
-        # 動画IDリストを作成
-        video_id_list_top = [cm_data_top[i]['映像コード'] for i in range(len(cm_data_top))]  # 上位       
-        video_id_list_btm = [cm_data_btm[i]['映像コード'] for i in range(len(cm_data_btm))]  # 下位
+        # 動画IDリストを作成（映像コードの列のみ読み込む）
+        video_id_list_top = [row[0] for row in iter_csv(path.cmData_top_path, usecols=['映像コード'])]  # 上位       
+        video_id_list_btm = [row[0] for row in iter_csv(path.cmData_btm_path, usecols=['映像コード'])]  # 下位
         video_id_list = video_id_list_top + video_id_list_btm                               # 全て
 
         logger.debug('CMデータを読み込みました。')
@@ -80,84 +155,217 @@ if __name__ == '__main__':
         logger.debug('入力元 : ' + path.cmData_btm_path)
         logger.debug('-' * 90)
 
+        # --------------------------------------------------
+        # 重複CMの検出
+        # --------------------------------------------------
+        process_id_list = video_id_list     # カット分割の対象の動画IDリスト
+        if dedup:
+            logger.debug('重複CMの検出を開始します。')
+
+            duplicates = find_duplicates(video_id_list, path.video_dir)
+            write_duplicate_report(duplicates, pipeline_setting['dedup_report_path'])
+
+            # 同一の動画はカット分割を行わない（参照動画のカット点を使用する）
+            exact_ids = {d['video_id'] for d in duplicates if d['kind'] == 'exact'}
+            process_id_list = [video_id for video_id in video_id_list if video_id not in exact_ids]
+
+            logger.debug('重複CMの検出が終了しました。')
+            logger.debug('保存先 : ' + pipeline_setting['dedup_report_path'])
+            logger.debug('-' * 90)
+
+        # 逐次シーン統合では、ラベル付け結果・シーンデータへの追記を読み込むため、前回の結果を削除しておく
+        if online_integration:
+            for file_path in (path.noun_label_path, path.verb_label_path, path.scene_data_path, pipeline_setting['scene_edl_path']):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+
         # --------------------------------------------------
         # カット分割
         # --------------------------------------------------
         logger.debug('カット分割を開始します。')
 
-        cut_segmentation(video_id_list, path.video_dir, path.cut_dir, path.cut_point_path)   # カット分割
+        # 共有メモリで受け渡す場合は、物体検出・動作認識をカット分割と同時に実行し、フレームデータを1動画ずつ公開する
+        # （参照側が処理を終えた動画から解放するため、共有メモリの使用量は動画 shm_max_videos 本分に収まる）
+        if use_shared_memory:
+            frame_store = SharedFrameStore(pipeline_setting['frame_manifest_path'], max_live=pipeline_setting['shm_max_videos'])
+            labeling_processes = [subprocess.Popen(cmd, shell=True)
+                                  for cmd in (get_detection_cmd(path, pipeline_setting), get_recognition_cmd(path, pipeline_setting))]
+            frame_store.watch(labeling_processes)
+
+            logger.debug('物体検出・動作認識によるラベル付けをカット分割と同時に開始しました。')
+            logger.debug('マニフェスト : ' + pipeline_setting['frame_manifest_path'])
+
+        cut_segmentation(process_id_list, path.video_dir, path.cut_dir, path.cut_point_path, frame_store, save_cut_files,
+                         path.video_info_path)   # カット分割
+
+        if use_shared_memory:
+            frame_store.finish()
         
         logger.debug('全動画のカット分割が終了しました。')
         logger.debug('-' * 90)
+
+        # 重複CMのカット点を追加し、再利用するカットのラベル付けを読み飛ばすための仮の行を書き込む
+        # （共有メモリで受け渡す場合は、ラベル付けの実行中のため、ラベル付けの終了後に行う）
+        if dedup and not use_shared_memory:
+            reuse_map = seed_duplicate_cuts(video_id_list, duplicates, path.cut_point_path, path.noun_label_path, path.verb_label_path)
         
         # --------------------------------------------------
         # カット画像の作成
         # --------------------------------------------------
-        logger.debug('カット画像生成を開始します。')
+        # 統合実行の場合は元動画から直接読み込むため、カット画像を使用しない
+        if save_cut_files and pipeline_setting['labeling'] == 'separate':
+            logger.debug('カット画像生成を開始します。')
 
-        cut_img_generate(path.video_dir, path.cut_img_dir, path.cut_point_path)
+            # 同一の重複CMは全カットのラベル付けを省略するため、カット画像を作成しない
+            cut_img_generate(path.video_dir, path.cut_img_dir, path.cut_point_path, exact_ids if dedup else None)
 
-        logger.debug('全カットのカット画像生成が終了しました。')
-        logger.debug('-' * 90)
+            logger.debug('全カットのカット画像生成が終了しました。')
+            logger.debug('-' * 90)
         
         # --------------------------------------------------
-        # 物体検出によるラベル付け
+        # 逐次シーン統合の開始（ラベル付けと同時に実行）
         # --------------------------------------------------
-        logger.debug('物体検出によるラベル付けを開始します。')
-        
-        # 環境データの取得
-        object_detection_env, config_file, checkpoint_file, classes_file  = get_env_data('OBJECT_DET_ENV')
+        if online_integration:
+            integrator = OnlineSceneIntegrator(path.cut_point_path, path.scene_data_path, edl_path=pipeline_setting['scene_edl_path'],
+                                               video_dir=path.video_dir, cut_dir=path.cut_dir if save_cut_files else None)
+            if dedup and use_shared_memory:
+                # 再利用するカットはラベル付けの後に決まるため、部分一致の動画は保留する
+                follower = LabelingFollower(integrator, path.noun_label_path, path.verb_label_path,
+                                            get_label_vocab(path.label_data_dir, path.label_vocab_path),
+                                            deferred_videos={d['video_id'] for d in duplicates if d['kind'] != 'exact'})
+            else:
+                follower = LabelingFollower(integrator, path.noun_label_path, path.verb_label_path,
+                                            get_label_vocab(path.label_data_dir, path.label_vocab_path), reuse_map if dedup else None)
+            follower_stop = threading.Event()
+            follower_thread = threading.Thread(target=follower.run, args=(follower_stop,), daemon=True)
+            follower_thread.start()
 
-        # 物体検出
-        cmd = f'conda run -n {object_detection_env} python utils/object_detection_mod.py '\
-            f'{config_file} {checkpoint_file} {classes_file} {path.cut_img_dir} {path.noun_label_path}'
-        subprocess.call(cmd, shell=True)
-        
-        logger.debug('物体検出によるラベル付けが終了しました。')
-        logger.debug('-' * 90)
+            logger.debug('逐次シーン統合を開始しました。')
 
         # --------------------------------------------------
-        # 動作認識によるラベル付け
+        # 物体検出・動作認識によるラベル付け（統合実行）
         # --------------------------------------------------
-        logger.debug('動作認識によるラベル付けを開始します。')
+        if pipeline_setting['labeling'] == 'unified':
+            logger.debug('物体検出・動作認識によるラベル付けを開始します。')
+
+            # 環境データの取得
+            labeling_env, = get_env_data('LABELING_ENV')
+            _, det_config_file, det_checkpoint_file, det_classes_file, backend, onnx_file, det_artifact_file = get_env_data('OBJECT_DET_ENV')
+            _, rec_config_file, rec_checkpoint_file, rec_classes_file, rec_artifact_file = get_env_data('ACTION_REC_ENV')
+
+            # 物体検出・動作認識（元動画を1回だけデコード）
+            cmd = f'conda run -n {labeling_env} python utils/labeling_runner_mod.py '\
+                f'{det_config_file} {det_checkpoint_file} {det_classes_file} {rec_config_file} {rec_checkpoint_file} {rec_classes_file} '\
+                f'{path.video_dir} {path.cut_point_path} {path.noun_label_path} {path.verb_label_path} --backend {backend}'
+            if backend == 'onnx':
+                cmd += f' --onnx-file {onnx_file}'
+            if det_artifact_file:
+                cmd += f' --det-artifact {det_artifact_file}'
+            if rec_artifact_file:
+                cmd += f' --rec-artifact {rec_artifact_file}'
+            if dedup:
+                cmd += ' --resume'
+            subprocess.call(cmd, shell=True)
+
+            logger.debug('物体検出・動作認識によるラベル付けが終了しました。')
+            logger.debug('-' * 90)
+
+        # --------------------------------------------------
+        # 物体検出・動作認識によるラベル付け（共有メモリで受け渡す場合は、カット分割と同時に実行中）
+        # --------------------------------------------------
+        elif use_shared_memory:
+            for process in labeling_processes:
+                process.wait()
+
+            logger.debug('物体検出・動作認識によるラベル付けが終了しました。')
+            logger.debug('-' * 90)
+
+        else:
+            # --------------------------------------------------
+            # 物体検出によるラベル付け
+            # --------------------------------------------------
+            logger.debug('物体検出によるラベル付けを開始します。')
+
+            subprocess.call(get_detection_cmd(path, pipeline_setting, resume=dedup), shell=True)
         
-        # 環境データの取得
-        action_recognition_env, config_file, checkpoint_file, classes_file  = get_env_data("ACTION_REC_ENV")
+            logger.debug('物体検出によるラベル付けが終了しました。')
+            logger.debug('-' * 90)
+
+            # --------------------------------------------------
+            # 動作認識によるラベル付け
+            # --------------------------------------------------
+            logger.debug('動作認識によるラベル付けを開始します。')
 
-        # 動作認識
-        cmd = f'conda run -n {action_recognition_env} python utils/action_recognition_mod.py '\
-            f'{config_file} {checkpoint_file} {classes_file} {path.cut_dir} {path.verb_label_path}'
-        subprocess.call(cmd, shell=True)
+            subprocess.call(get_recognition_cmd(path, pipeline_setting, resume=dedup), shell=True)
         
-        logger.debug('動作認識によるラベル付けが終了しました。')
-        logger.debug('-' * 90)
+            logger.debug('動作認識によるラベル付けが終了しました。')
+            logger.debug('-' * 90)
+
+        # 共有メモリの解放（ラベル付け以降は使用しない）
+        if frame_store is not None:
+            frame_store.close()
+            frame_store = None
+
+        # 逐次シーン統合は、ラベル付け結果を全て読み込んだ時点で終了
+        if online_integration:
+            follower_stop.set()
+            follower_thread.join()
+
+        # 共有メモリで受け渡した場合は、ラベル付けの終了後に重複CMのカット点を追加（仮の行は書き込まない）
+        if dedup and use_shared_memory:
+            reuse_map = seed_duplicate_cuts(video_id_list, duplicates, path.cut_point_path, path.noun_label_path, path.verb_label_path,
+                                            seed_labels=False)
+            if online_integration:
+                follower.set_reuse_map(reuse_map)
+
+        # 全カットのラベルが揃わなかった動画のシーンも確定
+        if online_integration:
+            follower.flush()
+
+            logger.debug('逐次シーン統合が終了しました。')
+            logger.debug('保存先 : ' + path.scene_data_path)
+            logger.debug('-' * 90)
+
+        # 重複CMの仮の行を参照動画のラベルで置き換え
+        if dedup:
+            propagate_duplicate_labels(reuse_map, path.noun_label_path)
+            propagate_duplicate_labels(reuse_map, path.verb_label_path)
         
         # --------------------------------------------------
         # ラベルデータの整形（翻訳，スクリーニング，結合）
         # --------------------------------------------------      
         logger.debug('ラベルデータの整形を開始します。')
 
-        label_shaping(path.noun_label_path, path.verb_label_path, path.label_path)
+        # ラベルの語彙（翻訳・スクリーニング結果のラベルID）の取得
+        vocab = get_label_vocab(path.label_data_dir, path.label_vocab_path)
+
+        label_shaping(path.noun_label_path, path.verb_label_path, path.label_path, vocab)
 
         logger.debug('ラベルデータの整形が終了しました。')
         logger.debug('-' * 90)
         
         # --------------------------------------------------
-        # シーン統合
+        # シーン統合（逐次シーン統合の場合は確定済み）
         # --------------------------------------------------
-        logger.debug('シーンの統合・保存を開始します。')
+        if not online_integration:
+            logger.debug('シーンの統合・保存を開始します。')
 
-        scene_integration(path.cut_point_path, path.label_path, path.video_dir, path.scene_dir, path.scene_data_path)
+            # カット動画を保存している場合は、カット動画を連結してシーンを保存する
+            cut_dir = path.cut_dir if save_cut_files else None
+            # scene_render = on_demand の場合は編集リストのみ保存（シーンの動画は scene_render_mod で要求時に作成）
+            scene_integration(path.cut_point_path, path.label_path, path.video_dir, path.scene_dir, path.scene_data_path, cut_dir,
+                              pipeline_setting['scene_edl_path'], pipeline_setting['scene_render'] == 'eager')
 
-        logger.debug('シーンの統合・保存が終了しました。')
-        logger.debug('-' * 90)
+            logger.debug('シーンの統合・保存が終了しました。')
+            logger.debug('-' * 90)
 
         # --------------------------------------------------
         # 好感度とのマッチング・分析
         # --------------------------------------------------
         logger.debug('好感度とのマッチング・分析を開始します。')
 
-        favo_analysis(path.cmData_top_path, path.cmData_btm_path, path.scene_data_path, path.favo_dir)
+        favo_analysis(path.cmData_top_path, path.cmData_btm_path, path.scene_data_path, path.favo_dir, vocab,
+                      path.video_info_path, path.video_dir, **analysis_setting)
 
         logger.debug('好感度とのマッチング・分析が終了しました。')
         logger.debug('-' * 90)
@@ -170,4 +378,8 @@ if __name__ == '__main__':
         print('Error: ', sys.exc_info()[0])
         print(sys.exc_info()[1])
         import traceback
-        print(traceback.format_tb(sys.exc_info[2]))
\ No newline at end of file
+        print(traceback.format_tb(sys.exc_info[2]))
+    finally:
+        # 異常終了時も共有メモリを解放
+        if frame_store is not None:
+            frame_store.close()
\ No newline at end of file
@@ -0,0 +1,56 @@
+import importlib
+
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+
+@pytest.fixture
+def favo_stats(tmp_path, monkeypatch):
+    """設定ファイルを置いた作業フォルダで favo_stats_mod を読み込む（読み込み時にログ設定を行うため）"""
+    pytest.importorskip('cv2')
+    (tmp_path / 'config').mkdir()
+    (tmp_path / 'config' / 'settings.ini').write_text(f'[PATH]\nroot_path = {tmp_path}\n[LOG]\nlog_file_path = log/test.log\n', encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+
+    return importlib.import_module('utils.favo_stats_mod')
+
+def make_presence(num_scenes):
+    """ラベル0 : 全シーンにあり、ラベル1 : どのシーンにもなし、ラベル2 : 偶数番目のシーンにあり"""
+    presence = np.zeros((num_scenes, 3), dtype=np.int64)
+    presence[:, 0] = 1
+    presence[::2, 2] = 1
+
+    return csr_matrix(presence)
+
+def test_labels_in_all_or_no_scenes_are_not_tested(favo_stats):
+    rng = np.random.default_rng(0)
+    favo = rng.normal(50, 10, 400)
+    presence = make_presence(len(favo))
+
+    stats = favo_stats.label_significance(presence, favo, num_resamples=50, max_workers=1)
+
+    assert stats['count'].tolist() == [400, 0, 200]
+    for key in ['effect', 'p_value', 'q_value', 'ci_low', 'ci_high']:
+        assert np.isnan(stats[key][:2]).all(), key
+        assert np.isfinite(stats[key][2]), key
+    assert np.isnan(stats['mean_without'][0]) and np.isnan(stats['mean_with'][1])
+
+    # q 値は差を定義できるラベルのみで補正する（ラベルが1つの場合は p 値と同じ）
+    assert stats['q_value'][2] == stats['p_value'][2]
+
+def test_resampled_effects_are_nan_when_a_group_is_empty(favo_stats):
+    rng = np.random.default_rng(0)
+    favo = rng.normal(50, 10, 400)
+    presence = make_presence(len(favo))
+
+    # 1行目 : 全シーンを1回ずつ、2行目 : 偶数番目のシーンのみを2回ずつ抽出（ラベル2のなしの群が空）
+    weights = np.vstack([np.ones(len(favo)), np.tile([2.0, 0.0], len(favo) // 2)])
+    effects = favo_stats.calc_effects(presence, favo, weights)
+
+    assert np.isnan(effects[:, :2]).all()
+    assert effects[0, 2] == pytest.approx(favo[::2].mean() - favo[1::2].mean())
+    assert np.isnan(effects[1, 2])
+
+    # 観測値（重みなし）も同様
+    effects = favo_stats.calc_effects(presence, favo)
+    assert np.isnan(effects[:2]).all() and np.isfinite(effects[2])
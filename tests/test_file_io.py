@@ -0,0 +1,46 @@
+from utils.file_io import iter_csv, read_labeled_cuts, open_label_writer
+
+def write_partial(file_path, last_row):
+    """ラベル付け結果ファイルを、最終行が書き込み途中の状態で作成する"""
+    with open(file_path, 'w', encoding='utf-8', newline='') as f:
+        f.write('video_id,cut_no,labels\r\n')
+        f.write('v1,11,"[[\'person\', 0.9]]"\r\n')
+        f.write(last_row)
+
+def test_truncated_last_row_is_not_labeled(tmp_path):
+    # 途中で途切れても CSV としては列が揃う行
+    for last_row in ['v1,12,', 'v1,12,"[[\'person\', 0.9', 'v1,1']:
+        file_path = str(tmp_path / 'results.csv')
+        write_partial(file_path, last_row)
+
+        assert read_labeled_cuts(file_path) == {('v1', 11)}
+
+def test_resume_rewrites_truncated_cut(tmp_path):
+    file_path = str(tmp_path / 'results.csv')
+    write_partial(file_path, 'v1,12,')
+
+    labeled_cuts = read_labeled_cuts(file_path)
+    csvfile, writer = open_label_writer(file_path, resume=True)
+    for cut_no in [11, 12]:
+        if ('v1', cut_no) not in labeled_cuts:
+            writer.writerow({'video_id': 'v1', 'cut_no': cut_no, 'labels': '[]'})
+    csvfile.close()
+
+    assert read_labeled_cuts(file_path) == {('v1', 11), ('v1', 12)}
+
+def test_missing_or_empty_file(tmp_path):
+    file_path = tmp_path / 'results.csv'
+    assert read_labeled_cuts(str(file_path)) == set()
+
+    file_path.write_text('video_id,cut_no,lab', encoding='utf-8')
+    assert read_labeled_cuts(str(file_path)) == set()
+
+def test_iter_csv_usecols_pads_short_rows(tmp_path):
+    file_path = tmp_path / 'cmData.csv'
+    file_path.write_text('x,映像コード,s1,s2\na,v1,1,2\nb,v2,3\n', encoding='utf-8')
+
+    rows = list(iter_csv(str(file_path), needs_skip_header=True, usecols=[1, 2, 3]))
+    assert rows == [['v1', '1', '2'], ['v2', '3', '']]
+
+    rows = list(iter_csv(str(file_path), usecols=['映像コード', 's2']))
+    assert rows == [['v1', '2'], ['v2', '']]
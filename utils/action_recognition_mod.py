@@ -2,16 +2,26 @@
 import time 
 import glob
 import os
-import re
-import csv
-import operator
-from file_io import create_dest_folder, read_txt, write_csv
-from init_setting import setup_logger
+import ast
+import copy
+from collections import defaultdict
+from operator import itemgetter
+from file_io import create_dest_folder, read_txt, read_csv, read_labeled_cuts, open_label_writer, get_cut_key
+from init_setting import setup_logger, get_clip_policy
+from frame_share_mod import iter_shared_videos, split_cuts
+from model_artifact_mod import load_artifact
 
+import cv2
+import numpy as np
 import torch
+from mmcv.parallel import collate, scatter
 from mmaction.apis import init_recognizer, inference_recognizer
+from mmaction.datasets.pipelines import Compose
 
 LABEL_THRESHOLD = 0.8  # ラベル付け時の閾値
+FLUSH_INTERVAL = 10    # 結果をファイルに書き出す間隔（動画数）
+BATCH_SIZE = 8         # 1回の推論でまとめて処理するカット数
+VIDEO_EXTENSION = '.mp4'    # 元動画の拡張子（MP4）
 
 # ログ設定
 logger = setup_logger(__name__)
@@ -34,12 +44,328 @@ def labeling_from_results(results, top_n=1):
     """
     return [[result[0], result[1]] for result in results[:top_n] if result[1] >= LABEL_THRESHOLD]
 
-def action_recognition(config_file, checkpoint_file, classes_file, movie_dir):
-    """動作認識を行い、ラベル付け結果を返す関数
+def read_cut_frames(video_path, cut_point, skip_cut_nos=None):
+    """元動画を先頭から1回だけ読み込み、カットごとのフレームデータを返すジェネレータ
+
+    カット動画をファイルから読み込む代わりに、元動画からカット範囲（スタートフレーム～エンドフレーム）を直接取り出す
+
+    Parameters
+    ----------
+    video_path : str
+        元動画のパス
+
+    cut_point : list
+        カット検出点（フレーム番号）のリスト
+
+    skip_cut_nos : set, default None
+        フレームデータが不要なカット番号の集合（デコード後の変換を省略する）
+        最後に必要なカットより後は読み進めず、全てのカットが不要な場合は元動画を開かない
+
+    Yields
+    -------
+    tuple
+        (cut_no, frames)  frames : numpy.ndarray (フレーム数, 高さ, 幅, 3)、RGB（不要なカット・読み込めなかった場合は None）
+    """
+    skip_cut_nos = skip_cut_nos or set()
+
+    # 最後に必要なカット
+    last_cut_no = max((cut_no for cut_no in range(1, len(cut_point)+1) if cut_no not in skip_cut_nos), default=0)
+
+    # 全てのカットが不要な場合（同一の重複CM、ラベル付け済みの動画など）は元動画を開かない
+    if last_cut_no == 0:
+        for cut_no in range(1, len(cut_point)+1):
+            yield cut_no, None
+        return
+
+    cap = cv2.VideoCapture(video_path)
+    # ビデオキャプチャーが開けていない場合、例外を返す
+    if cap.isOpened() is False:
+        raise ValueError('読み込みエラー : 動画ID ' + video_path + 'が上手く読み取れません。')
+
+    try:
+        begin = 0   # カット最初のフレーム
+        for i, end in enumerate(cut_point):
+            cut_no = i+1
+
+            # 不要なカットはフレームを読み進めるだけ（最後に必要なカットより後は読み進めない）
+            if cut_no in skip_cut_nos:
+                if cut_no < last_cut_no:
+                    for _ in range(begin, end+1):
+                        cap.grab()
+                yield cut_no, None
+                begin = end+1
+                continue
+
+            frames = []
+            for _ in range(begin, end+1):
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))   # 処理のため、BGRからRGBにする
+
+            yield cut_no, np.stack(frames) if frames else None
+            begin = end+1
+    finally:
+        cap.release()
+
+def iter_source_cuts(video_dir, cut_point_path, labeled_cuts, clip_policy=None):
+    """カット点データを読み込み、元動画ごとにカットのフレームデータを返すジェネレータ
+
+    Parameters
+    ----------
+    video_dir : str
+        元動画が存在するフォルダパス
+
+    cut_point_path : str
+        カット点データ(.csv)のファイルパス
+
+    labeled_cuts : set
+        ラベル付け済みのカットの集合 {(video_id, cut_no), ...}（フレームデータを取り出さない）
+
+    clip_policy : dict, default None
+        動作認識のクリップ設定（推論しない短いカットはフレームデータを取り出さない）
+
+    Yields
+    -------
+    tuple
+        (video_id, cut_point, cut_frames)  cut_frames : (cut_no, frames) を返すジェネレータ
+    """
+    video_id_list, cut_point_list = read_csv(cut_point_path)
+    cut_point_dict = {video_id: ast.literal_eval(cut_point) for video_id, cut_point in zip(video_id_list, cut_point_list)}
+
+    # 動画IDごとのラベル付け済みのカット番号 {video_id: {cut_no, ...}}
+    labeled_cut_nos = {}
+    for labeled_id, cut_no in labeled_cuts:
+        labeled_cut_nos.setdefault(labeled_id, set()).add(cut_no)
+
+    for video_id in sorted(cut_point_dict):
+        video_path = os.path.normpath(os.path.join(video_dir, video_id + VIDEO_EXTENSION))
+        cut_point = cut_point_dict[video_id]
+        _, skipped = plan_cut_groups(cut_point, clip_policy)
+        skip_cut_nos = skipped | labeled_cut_nos.get(video_id, set())
+
+        yield video_id, cut_point, read_cut_frames(video_path, cut_point, skip_cut_nos)
+
+def calc_num_clips(cut_length, clip_policy):
+    """カット長からクリップ数を決める関数
+
+    Parameters
+    ----------
+    cut_length : int
+        カット長（フレーム数）
+
+    clip_policy : dict
+        動作認識のクリップ設定
+
+    Returns
+    -------
+    int
+        クリップ数（カット長 / frames_per_clip を min_clips ～ max_clips に収めた値）
+    """
+    num_clips = int(np.ceil(cut_length / clip_policy['frames_per_clip']))
+
+    return int(np.clip(num_clips, clip_policy['min_clips'], clip_policy['max_clips']))
+
+def plan_cut_groups(cut_point, clip_policy):
+    """カット長に応じて、まとめて推論するカットのグループとクリップ数を決める関数
+
+    [短いカットの扱い]
+        infer : 他のカットと同様に推論する
+        skip  : 推論しない（空のラベルを付与する）
+        merge : 後ろのカットと統合して推論し、統合したカット全てに同じラベルを付与する
+                動画の最後の短いカットは前のカットと統合する
+
+    Parameters
+    ----------
+    cut_point : list
+        カット検出点（フレーム番号）のリスト
+
+    clip_policy : dict or None
+        動作認識のクリップ設定（None の場合は全カットを Config の設定のまま推論する）
+
+    Returns
+    -------
+    groups : list
+        推論するカットのグループ [([cut_no, ...], num_clips), ...]（num_clips が None の場合は Config の設定）
+
+    skipped : set
+        推論しないカット番号の集合
+    """
+    cut_lengths = np.diff([-1] + list(cut_point))   # 各カットのフレーム数
+
+    if clip_policy is None:
+        return [([i+1], None) for i in range(len(cut_lengths))], set()
+
+    groups = []     # 推論するカットのグループ
+    skipped = set() # 推論しないカット
+    pending = []    # 後ろのカットと統合する短いカット
+    for i, cut_length in enumerate(cut_lengths):
+        cut_no = i+1
+
+        # 短いカットの場合
+        if cut_length < clip_policy['min_cut_frames']:
+            if clip_policy['short_cut'] == 'skip':
+                skipped.add(cut_no)
+                continue
+            if clip_policy['short_cut'] == 'merge':
+                pending.append(cut_no)
+                continue
+
+        groups.append(pending + [cut_no])
+        pending = []
+
+    # 動画の最後の短いカットは前のグループと統合
+    if pending:
+        if groups:
+            groups[-1] += pending
+        else:
+            groups.append(pending)
+
+    groups = [(cut_nos, calc_num_clips(sum(cut_lengths[c-1] for c in cut_nos), clip_policy)) for cut_nos in groups]
+
+    return groups, skipped
+
+def build_array_pipeline(model, num_clips=None):
+    """フレームデータ（配列）を入力とする推論時の前処理を作成する関数
+
+    MMAction2 の inference_recognizer で配列を入力した場合と同じ前処理にする
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        動作認識モデル
+
+    num_clips : int, default None
+        サンプリングするクリップ数（None の場合は Config の設定のまま）
+
+    Returns
+    -------
+    mmaction.datasets.pipelines.Compose
+        推論時の前処理
+    """
+    test_pipeline = copy.deepcopy(model.cfg.data.test.pipeline)
+    test_pipeline = [dict(type='ArrayDecode') if 'Decode' in step['type'] else step for step in test_pipeline if 'Init' not in step['type']]
+
+    # クリップ数の変更
+    if num_clips is not None:
+        for step in test_pipeline:
+            if step['type'] == 'SampleFrames':
+                step['num_clips'] = num_clips
+
+    return Compose(test_pipeline)
+
+def inference_recognizer_batch(model, clips):
+    """複数カットのフレームデータをまとめて動作認識する関数
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        動作認識モデル
+
+    clips : list
+        前処理済みのカットのデータのリスト
+
+    Returns
+    -------
+    list
+        カットごとの推論結果（inference_recognizer と同じ上位5件の [(クラス番号, スコア), ...]）
+    """
+    data = collate(clips, samples_per_gpu=len(clips))
+    if next(model.parameters()).is_cuda:
+        data = scatter(data, [next(model.parameters()).device])[0]
+
+    with torch.no_grad():
+        scores = model(return_loss=False, **data)
+
+    return [sorted(enumerate(score), key=itemgetter(1), reverse=True)[:5] for score in scores]
+
+def recognize_video_cuts(model, video_cuts, labeled_cuts, clip_policy=None):
+    """元動画ごとに全カットをまとめて動作認識し、カットごとの推論結果を返すジェネレータ
+
+    各カット（グループ）のフレームデータは揃った時点で前処理し、元動画ごとに
+    クリップ数が同じものを BATCH_SIZE 件ずつまとめて推論する
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        動作認識モデル
+
+    video_cuts : iterable
+        元動画ごとのカットのフレームデータ (video_id, cut_point, [(cut_no, frames), ...])
+
+    labeled_cuts : set
+        ラベル付け済みのカットの集合 {(video_id, cut_no), ...}（読み飛ばす）
+
+    clip_policy : dict, default None
+        動作認識のクリップ設定（[plan_cut_groups] 参照）
+
+    Yields
+    -------
+    tuple
+        (video_id, cut_no, results)  results : 推論結果（推論しない・読み込めなかったカットは空のリスト）
+    """
+    pipelines = {}  # クリップ数ごとの前処理
+
+    for video_id, cut_point, cut_frames in video_cuts:
+        groups, skipped = plan_cut_groups(cut_point, clip_policy)
+        group_index = {cut_no: i for i, (cut_nos, _) in enumerate(groups) for cut_no in cut_nos}   # カット番号 → グループ
+        group_frames = defaultdict(list)    # グループごとのフレームデータ
+
+        # 推論しないカットは空の結果
+        cut_results = {cut_no: [] for cut_no in skipped if (video_id, cut_no) not in labeled_cuts}
+        batches = defaultdict(list)  # クリップ数ごとの前処理済みデータ [(カット番号のリスト, データ), ...]
+        for cut_no, frames in cut_frames:
+            if cut_no in skipped:
+                continue
+
+            i = group_index[cut_no]
+            cut_nos, num_clips = groups[i]
+            if frames is not None and len(frames) > 0:
+                group_frames[i].append(frames)
+
+            # グループの最後のカットまでフレームデータを集める
+            if cut_no != cut_nos[-1]:
+                continue
+
+            frames = group_frames.pop(i, [])
+            target_cut_nos = [c for c in cut_nos if (video_id, c) not in labeled_cuts]
+
+            # 全てラベル付け済みのグループは推論しない
+            if not target_cut_nos:
+                continue
+
+            # 読み込めなかったグループは推論しない
+            if not frames:
+                cut_results.update({c: [] for c in target_cut_nos})
+                continue
+
+            frames = np.concatenate(frames) if len(frames) > 1 else frames[0]
+            if num_clips not in pipelines:
+                pipelines[num_clips] = build_array_pipeline(model, num_clips)
+            clip = pipelines[num_clips](dict(total_frames=len(frames), label=-1, start_index=0, array=frames, modality='RGB'))
+            batches[num_clips].append((target_cut_nos, clip))
+
+        # クリップ数が同じものを BATCH_SIZE 件ずつ推論
+        for batch in batches.values():
+            for i in range(0, len(batch), BATCH_SIZE):
+                targets, clips = zip(*batch[i:i+BATCH_SIZE])
+                for target_cut_nos, results in zip(targets, inference_recognizer_batch(model, list(clips))):
+                    cut_results.update({c: results for c in target_cut_nos})
+
+        for cut_no in sorted(cut_results):
+            yield video_id, cut_no, cut_results[cut_no]
+
+def action_recognition(config_file, checkpoint_file, classes_file, movie_dir, labeled_cuts=None, shm_manifest=None,
+                       video_dir=None, cut_point_path=None, clip_policy=None, artifact_file=None):
+    """動作認識を行い、ラベル付け結果を1カットずつ返すジェネレータ
 
     MMAction2 のAPIを用いて動作認識を行う
         参考: MMAction2(https://github.com/open-mmlab/mmaction2)
 
+    カットは (動画ID, カット番号) 順に処理するため、結果もその順で返る
+    共有メモリ、または元動画とカット点データを指定した場合は、カット動画のファイルを読み込まず、
+    元動画ごとに全カットをまとめて推論する（クリップ設定に従い、カット長に応じてクリップ数を変え、短いカットは推論しない・統合する）
+
     Parameters
     ----------
     config_file : str
@@ -53,40 +379,74 @@ def action_recognition(config_file, checkpoint_file, classes_file, movie_dir):
     
     movie_dir : str
         動画フォルダのパス
+
+    labeled_cuts : set, default None
+        ラベル付け済みのカットの集合 {(video_id, cut_no), ...}（読み飛ばす）
+
+    shm_manifest : str, default None
+        共有メモリのマニフェストのパス（指定した場合、動画フォルダではなく共有メモリから各カットのフレームを読み込む）
+
+    video_dir : str, default None
+        元動画が存在するフォルダパス（cut_point_path と共に指定した場合、元動画からカット範囲を直接読み込む）
+
+    cut_point_path : str, default None
+        カット点データ(.csv)のファイルパス
+
+    clip_policy : dict, default None
+        動作認識のクリップ設定（共有メモリ・元動画から読み込む場合のみ指定できる）
+
+    artifact_file : str, default None
+        事前構築したモデルのアーティファクトのパス（指定した場合、Configファイル・checkpointファイルの代わりに読み込む）
    
-    Returns
+    Yields
     -------
-    label_results : list
-        動画ディレクトリ内の全動画のラベル付け結果
+    dict
+        1カットのラベル付け結果 {'video_id': video_id, 'cut_no': cut_no, 'labels': labels}
     """
+    labeled_cuts = labeled_cuts or set()
+
+    # エラー処理（カット動画のファイルはカットごとに推論するため、クリップ設定を適用できない）
+    if clip_policy is not None and shm_manifest is None and video_dir is None:
+        raise ValueError('[CLIP_POLICY] はカット動画のファイルを読み込む場合は使用できません。共有メモリ、または元動画とカット点データを指定してください。')
+
     # 使用デバイスの設定
     device = 'cuda' if torch.cuda.is_available() else 'cpu' 
    
     # モデルの初期化
-    model = init_recognizer(config_file, checkpoint_file, device=device)
+    if artifact_file:
+        model = load_artifact(artifact_file, device=device, kind='recognizer')
+    else:
+        model = init_recognizer(config_file, checkpoint_file, device=device)
     
     # 認識クラスの取得
     classes = read_txt(classes_file)
 
-    # 推論する動画パス一覧の取得
-    movie_files = glob.glob(os.path.join(movie_dir, '**/*'))
-
     # 動作認識（推論）
-    label_results = []  # ラベル付け結果
-    for movie_path in movie_files:
-        results = inference_recognizer(model, movie_path)   # 推論結果
+    if shm_manifest is not None or video_dir is not None:
+        # フレームデータを元動画ごとにまとめて取得（動画ID, カット番号順）
+        if shm_manifest is not None:
+            # 共有メモリ上の各カットのフレームデータ（RGB）
+            video_cuts = ((video_id, cut_point, split_cuts(frames, cut_point))
+                          for video_id, cut_point, frames in iter_shared_videos(shm_manifest, 'action_recognition'))
+        else:
+            # 元動画から直接読み込んだ各カットのフレームデータ（RGB）
+            video_cuts = iter_source_cuts(video_dir, cut_point_path, labeled_cuts, clip_policy)
+
+        cut_results = recognize_video_cuts(model, video_cuts, labeled_cuts, clip_policy)
+    else:
+        # カット動画のファイルを1つずつ推論（動画ID, カット番号順）
+        movie_files = sorted(glob.glob(os.path.join(movie_dir, '**/*')), key=get_cut_key)
+        cut_results = (get_cut_key(movie_path) + (inference_recognizer(model, movie_path),)
+                       for movie_path in movie_files if get_cut_key(movie_path) not in labeled_cuts)
+
+    for video_id, cut_no, results in cut_results:
         results = [(classes[k[0]], k[1]) for k in results]
         labels = labeling_from_results(results)             # 付与ラベル
-
-        video_id, file_name = movie_path.replace('\\', '/').split('/')[-2:]
-        cut_no = int(re.sub(r'\D', '', file_name.split('.mp4')[0]))
         
         logger.debug(f'{video_id}, {cut_no}, {labels}')
 
-        # 結果を辞書型で格納
-        label_results.append({'video_id': video_id, 'cut_no': cut_no, 'labels': labels})
-
-    return label_results
+        # 結果を辞書型で返す
+        yield {'video_id': video_id, 'cut_no': cut_no, 'labels': labels}
 
 def parse_args():
     """コマンドライン引数を処理して返す関数
@@ -102,8 +462,16 @@ def parse_args():
     parser.add_argument('classes', help='認識クラス一覧ファイル(.txt)のパス')
     parser.add_argument('movie_dir', help='動画フォルダのパス')
     parser.add_argument('results_path', help='結果格納ファイル(.csv)のパス') # 
+    parser.add_argument('--artifact', help='事前構築したモデルのアーティファクトのパス（指定した場合はConfig・checkpointの代わりに使用）')
+    parser.add_argument('--shm-manifest', help='共有メモリのマニフェスト(.json)のパス（指定した場合は動画フォルダの代わりに使用）')
+    parser.add_argument('--video-dir', help='元動画のフォルダパス（--cut-point と共に指定した場合は動画フォルダの代わりに使用）')
+    parser.add_argument('--cut-point', help='カット点データ(.csv)のパス')
+    parser.add_argument('--resume', action='store_true', help='結果格納ファイルを読み込み、ラベル付け済みのカットを読み飛ばして再開する')
     args = parser.parse_args()
 
+    if (args.video_dir is None) != (args.cut_point is None):
+        parser.error('--video-dir と --cut-point は両方指定してください。')
+
     return args
 
 if __name__ == '__main__':
@@ -115,18 +483,27 @@ if __name__ == '__main__':
     # ラベル付け結果の保存先フォルダの作成
     create_dest_folder(os.path.dirname(args.results_path))
 
-    # 動作認識
-    label_results = action_recognition(args.config, args.checkpoints, args.classes, args.movie_dir)
-    
-    # 結果をソート
-    label_results = sorted(label_results, key=operator.itemgetter('video_id', 'cut_no'))
-    
-    # CSVファイルに保存
-    field_name = ['video_id', 'cut_no', 'labels']
-    with open(args.results_path, 'w', encoding='utf-8', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames = field_name)
-        writer.writeheader()
-        writer.writerows(label_results)
+    # 再開する場合はラベル付け済みのカットを取得
+    labeled_cuts = read_labeled_cuts(args.results_path) if args.resume else set()
+    if labeled_cuts:
+        logger.debug(f'ラベル付け済みの {len(labeled_cuts)} カットを読み飛ばします。')
+
+    # 動作認識のクリップ設定の取得
+    clip_policy = get_clip_policy()
+
+    # 動作認識（1カットごとにCSVファイルへ追記）
+    csvfile, writer = open_label_writer(args.results_path, resume=args.resume)
+    try:
+        label_results = action_recognition(args.config, args.checkpoints, args.classes, args.movie_dir, labeled_cuts, args.shm_manifest,
+                                           args.video_dir, args.cut_point, clip_policy, args.artifact)
+        for i, label_result in enumerate(label_results, 1):
+            writer.writerow(label_result)
+
+            # 一定間隔でファイルに書き出す
+            if i % FLUSH_INTERVAL == 0:
+                csvfile.flush()
+    finally:
+        csvfile.close()
 
     # 処理時間の表示
     elapsed_time = time.time() - start
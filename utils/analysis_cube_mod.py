@@ -0,0 +1,305 @@
+"""
+ラベル × 好感要因 × 属性（性別・年代など）の集計キューブを作成・参照するモジュール
+
+CMデータの好感要因（15項目）と属性別の好感度（17区分）を、各CMのシーンに付与されたラベルで集計し、
+集計結果を1つのファイル(.npz)に保存する
+分析時は保存したキューブから任意のラベル・好感要因・属性の組み合わせを取り出す（CSVファイルの再読み込み不要）
+
+[集計値]（グループ : all（上位・下位の全て）, top（上位）, btm（下位））
+    count         : ラベルが付与されたシーン数                         (グループ, ラベル)
+    cm_count      : ラベルが付与されたシーンを含むCM数                  (グループ, ラベル)
+    factor_sum    : 好感要因の合計（シーンごとにCMの値を加算）           (グループ, ラベル, 好感要因)
+    factor_count  : 好感要因の値があるシーン数                         (グループ, ラベル, 好感要因)
+    segment_sum   : 属性別の好感度の合計（シーンごとにCMの値を加算）     (グループ, ラベル, 属性)
+    segment_count : 属性別の好感度の値があるシーン数                   (グループ, ラベル, 属性)
+    sum           : 好感要因 × 属性別の好感度の合計                     (グループ, ラベル, 好感要因, 属性)
+    weight_sum    : 好感要因の値があるシーンの属性別の好感度の合計        (グループ, ラベル, 好感要因, 属性)
+    ※ CMデータの空欄・数値以外の値は集計に含めない（合計・シーン数のどちらにも加えない）
+    [平均値]
+    好感要因の平均 = factor_sum / factor_count
+    属性別の好感度の平均 = segment_sum / segment_count
+    属性で重み付けした好感要因の平均 = sum / weight_sum（その属性の好感度が高いCMほど重視した好感要因の平均）
+
+[使い方]
+    キューブの作成
+        python -m utils.analysis_cube_mod build
+    キューブの参照（ラベル・好感要因・属性は複数指定可、省略時は全て）
+        python -m utils.analysis_cube_mod show [--group {all,top,btm}] [--label ラベル名 ...] [--factor 好感要因 ...] [--segment 属性 ...]
+"""
+import argparse
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from utils.init_setting import Path, setup_logger
+from utils.file_io import iter_csv
+from utils.label_vocab_mod import load_label_vocab
+from utils.analysis_mod import load_scene_table, build_scene_label_matrix
+
+# 好感要因の列（CMデータでは [出演者・キャラクター] の列名が2つあるため、[ユーモラス] の直前の列を好感要因とする）
+FACTOR_COLUMNS = ['出演者・キャラクター', 'ユーモラス', 'セクシー', '宣伝文句', '音楽・サウンド', '商品にひかれた', '説得力に共感した',
+                  'ダサイけど憎めない', '時代の先端を感じた', '心がなごむ', 'ストーリー展開', '企業姿勢にウソがない', '映像・画像',
+                  '周囲の評判も良い', 'かわいらしい']
+# 属性別の好感度の列
+SEGMENT_COLUMNS = ['男性全体', '女性全体', '男性6-12', '男性13-19', '男性20-29', '男性30-39', '男性40-49', '男性50-59', '男性60以上',
+                   '女性6-12', '女性13-17', '独身女性18-24', '独身女性25-59', '主婦39以下', '主婦40-49', '主婦50-59', '女性60以上']
+GROUPS = ['all', 'top', 'btm']  # グループ（all は上位・下位の全て）
+
+# ログ設定
+logger = setup_logger(__name__)
+
+def to_float(value):
+    """CMデータの値を数値に変換する関数（空欄・数値以外は nan）
+
+    Parameters
+    ----------
+    value : str
+        CMデータの値
+
+    Returns
+    -------
+    float
+        数値
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+def load_cm_attributes(cmData_paths):
+    """CMデータ(.csv)から映像コード・好感要因・属性別の好感度の列のみを読み込む関数
+
+    Parameters
+    ----------
+    cmData_paths : dict
+        グループごとのCMデータのファイルパス {グループ名 : ファイルパス}
+
+    Returns
+    -------
+    cm_table : dict
+        CMのテーブル
+        {'group': グループ名, 'video_id': 動画ID, 'factor': 好感要因 (CM数, 好感要因数), 'segment': 属性別の好感度 (CM数, 属性数)}
+        （空欄・数値以外の値は nan）
+    """
+    groups, video_ids, factors, segments = [], [], [], []
+    for group, cmData_path in cmData_paths.items():
+        rows = iter_csv(cmData_path)
+        header = next(rows)
+
+        # 列の位置
+        factor_begin = header.index(FACTOR_COLUMNS[1]) - 1
+        factor_cols = list(range(factor_begin, factor_begin + len(FACTOR_COLUMNS)))
+        if [header[col] for col in factor_cols] != FACTOR_COLUMNS:
+            raise ValueError(f'CMデータの好感要因の列が想定と異なります。（{cmData_path}）')
+        segment_cols = [header.index(column) for column in SEGMENT_COLUMNS]
+        video_id_col = header.index('映像コード')
+
+        for data in rows:
+            groups.append(group)
+            video_ids.append(data[video_id_col])
+            factors.append([to_float(data[col]) for col in factor_cols])
+            segments.append([to_float(data[col]) for col in segment_cols])
+
+    return {
+        'group': np.array(groups, dtype=str),
+        'video_id': np.array(video_ids, dtype=str),
+        'factor': np.array(factors, dtype=np.float64).reshape(-1, len(FACTOR_COLUMNS)),
+        'segment': np.array(segments, dtype=np.float64).reshape(-1, len(SEGMENT_COLUMNS))
+    }
+
+def build_analysis_cube(scene_table, cm_table, vocab):
+    """ラベル × 好感要因 × 属性の集計キューブを作成する関数
+
+    [手順]
+        1. CM × ラベルのシーン数の行列を作成（CM × シーンの対応の行列 と シーン × ラベルの有無の行列の積）
+        2. CMごとの値を [1, 好感要因, 属性, 好感要因 × 属性] と、値の有無（空欄は 0）の列に並べ、1回の行列積でグループごとに集計
+
+    Parameters
+    ----------
+    scene_table : dict
+        シーンのテーブル（[analysis_mod.load_scene_table] の結果）
+
+    cm_table : dict
+        CMのテーブル（[load_cm_attributes] の結果）
+
+    vocab : dict
+        ラベルの語彙
+
+    Returns
+    -------
+    cube : dict
+        集計キューブ（モジュールの説明を参照）
+    """
+    num_labels = len(vocab['labels'])
+    num_factors, num_segments = len(FACTOR_COLUMNS), len(SEGMENT_COLUMNS)
+
+    # CMごとのシーン（映像コードで対応付け）
+    scene_rows = [scene_table['index'].get(video_id, np.zeros(0, dtype=np.int64)) for video_id in cm_table['video_id']]
+    lengths = np.array([len(rows) for rows in scene_rows], dtype=np.int64)
+    if np.any(lengths == 0):
+        logger.warning(f'シーンデータが無いCM : {np.count_nonzero(lengths == 0)} 件')
+
+    # CM × ラベルのシーン数
+    presence = build_scene_label_matrix(scene_table, np.concatenate(scene_rows + [np.zeros(0, dtype=np.int64)]), num_labels)
+    presence.data[:] = 1    # シーンごとにラベルの有無
+    cm_scene = csr_matrix((np.ones(lengths.sum()), np.arange(lengths.sum()), np.concatenate([[0], np.cumsum(lengths)])),
+                          shape=(len(lengths), lengths.sum()))
+    cm_labels = (cm_scene @ presence).tocsr()
+
+    # CMごとの値 [1, 好感要因, 属性, 好感要因 × 属性, 好感要因の有無, 属性の有無, 好感要因の有無 × 属性]（空欄の値は 0 として加算しない）
+    factor_valid, segment_valid = ~np.isnan(cm_table['factor']), ~np.isnan(cm_table['segment'])
+    factor, segment = np.where(factor_valid, cm_table['factor'], 0.0), np.where(segment_valid, cm_table['segment'], 0.0)
+    num_cms = len(factor)
+    columns = [np.ones((num_cms, 1)), factor, segment, (factor[:, :, np.newaxis] * segment[:, np.newaxis, :]).reshape(num_cms, -1),
+               factor_valid, segment_valid, (factor_valid[:, :, np.newaxis] * segment[:, np.newaxis, :]).reshape(num_cms, -1)]
+    values = np.hstack(columns).astype(np.float64)
+    splits = np.cumsum([column.shape[1] for column in columns])[:-1]
+
+    # グループごとに集計（ラベル × 値の行列積）
+    cube = {'count': [], 'cm_count': [], 'factor_sum': [], 'segment_sum': [], 'sum': [], 'factor_count': [], 'segment_count': [], 'weight_sum': []}
+    for group in GROUPS:
+        rows = np.arange(num_cms) if group == 'all' else np.flatnonzero(cm_table['group'] == group)
+        group_labels = cm_labels[rows]
+        totals = np.split(group_labels.T @ values[rows], splits, axis=1)  # 列の区分ごとの (ラベル数, 列数)
+
+        cube['count'].append(totals[0][:, 0])
+        cube['cm_count'].append(np.asarray((group_labels > 0).sum(axis=0)).ravel())
+        cube['factor_sum'].append(totals[1])
+        cube['segment_sum'].append(totals[2])
+        cube['sum'].append(totals[3].reshape(num_labels, num_factors, num_segments))
+        cube['factor_count'].append(totals[4])
+        cube['segment_count'].append(totals[5])
+        cube['weight_sum'].append(totals[6].reshape(num_labels, num_factors, num_segments))
+
+    cube = {key: np.stack(value) for key, value in cube.items()}
+    cube.update({'labels': np.array(vocab['labels'], dtype=str), 'factors': np.array(FACTOR_COLUMNS, dtype=str),
+                 'segments': np.array(SEGMENT_COLUMNS, dtype=str), 'groups': np.array(GROUPS, dtype=str)})
+
+    return cube
+
+def save_analysis_cube(cube, cube_path):
+    """集計キューブを保存する関数（.npz）
+
+    Parameters
+    ----------
+    cube : dict
+        集計キューブ
+
+    cube_path : str
+        保存先のファイルパス
+    """
+    np.savez_compressed(cube_path, **cube)
+
+def load_analysis_cube(cube_path):
+    """保存した集計キューブを読み込む関数
+
+    Parameters
+    ----------
+    cube_path : str
+        集計キューブのファイルパス
+
+    Returns
+    -------
+    cube : dict
+        集計キューブ
+    """
+    with np.load(cube_path) as data:
+        return {key: data[key] for key in data.files}
+
+def slice_cube(cube, group='all', labels=None, factors=None, segments=None):
+    """集計キューブから指定した組み合わせの平均値を取り出す関数
+
+    Parameters
+    ----------
+    cube : dict
+        集計キューブ
+
+    group : str, default 'all'
+        グループ（'all', 'top', 'btm'）
+
+    labels, factors, segments : list, default None
+        ラベル名・好感要因・属性のリスト（None の場合は全て）
+
+    Returns
+    -------
+    result : dict
+        {'labels': ラベル名, 'factors': 好感要因, 'segments': 属性, 'count': シーン数 (ラベル数,),
+         'factor_mean': 好感要因の平均 (ラベル数, 好感要因数), 'segment_mean': 属性別の好感度の平均 (ラベル数, 属性数),
+         'weighted_mean': 属性で重み付けした好感要因の平均 (ラベル数, 好感要因数, 属性数)}
+    """
+    def select(names, candidates):
+        if names is None:
+            return np.arange(len(candidates))
+        index = {name: i for i, name in enumerate(candidates.tolist())}
+        missing = [name for name in names if name not in index]
+        if missing:
+            raise ValueError(f'指定した項目はキューブにありません。（{", ".join(missing)}）')
+        return np.array([index[name] for name in names], dtype=np.int64)
+
+    # エラー処理（値の有無を集計していない古いキューブ）
+    if 'weight_sum' not in cube:
+        raise ValueError('集計キューブが古い形式です。build で作り直してください。')
+
+    g = select([group], cube['groups'])[0]
+    l, f, s = select(labels, cube['labels']), select(factors, cube['factors']), select(segments, cube['segments'])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'labels': cube['labels'][l], 'factors': cube['factors'][f], 'segments': cube['segments'][s], 'count': cube['count'][g, l],
+            'factor_mean': cube['factor_sum'][g][np.ix_(l, f)] / cube['factor_count'][g][np.ix_(l, f)],
+            'segment_mean': cube['segment_sum'][g][np.ix_(l, s)] / cube['segment_count'][g][np.ix_(l, s)],
+            'weighted_mean': cube['sum'][g][np.ix_(l, f, s)] / cube['weight_sum'][g][np.ix_(l, f, s)]
+        }
+
+def parse_args():
+    """コマンドライン引数を処理して返す関数
+
+    Returns
+    -------
+    args : argparse.ArgumentParser
+        解析されたコマンドライン引数
+    """
+    parser = argparse.ArgumentParser(description='ラベル × 好感要因 × 属性の集計キューブ')
+    parser.add_argument('--cube', help='集計キューブのファイルパス（省略時は好感度の結果フォルダの analysis_cube.npz）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('build', help='シーンデータ・CMデータから集計キューブを作成する')
+
+    show_parser = subparsers.add_parser('show', help='集計キューブから指定した組み合わせの平均値を表示する')
+    show_parser.add_argument('--group', choices=GROUPS, default='all', help='グループ')
+    show_parser.add_argument('--label', nargs='+', help='ラベル名')
+    show_parser.add_argument('--factor', nargs='+', help='好感要因')
+    show_parser.add_argument('--segment', nargs='+', help='属性')
+
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == '__main__':
+    # コマンドライン引数の取得
+    args = parse_args()
+
+    # パス設定
+    path = Path()
+    cube_path = args.cube or os.path.join(path.favo_dir, 'analysis_cube.npz')
+
+    if args.command == 'build':
+        vocab = load_label_vocab(path.label_vocab_path)
+        cube = build_analysis_cube(load_scene_table(path.scene_data_path),
+                                   load_cm_attributes({'top': path.cmData_top_path, 'btm': path.cmData_btm_path}), vocab)
+        os.makedirs(os.path.dirname(cube_path), exist_ok=True)
+        save_analysis_cube(cube, cube_path)
+
+        logger.debug('集計キューブを保存しました。')
+        logger.debug('保存先 : ' + cube_path)
+    else:
+        result = slice_cube(load_analysis_cube(cube_path), args.group, args.label, args.factor, args.segment)
+
+        # ラベルごとに [好感要因, 属性, 平均値] を表示（シーンが無いラベルは除く）
+        for i, label in enumerate(result['labels']):
+            if result['count'][i] == 0:
+                continue
+            print(f'{label}（シーン数: {int(result["count"][i])}）')
+            for j, factor in enumerate(result['factors']):
+                print(f'  {factor}: ' + ', '.join(f'{segment} {result["weighted_mean"][i, j, k]:.3f}'
+                                                  for k, segment in enumerate(result['segments'])))
@@ -1,135 +1,500 @@
 import os
-import ast
-from collections import Counter
 import numpy as np
-import re
+import cv2
+from scipy.sparse import csr_matrix
 
 from utils.init_setting import setup_logger
-from utils.file_io import read_csv, read_favo, write_ranking_data, write_csv, create_dest_folder
+from utils.file_io import iter_csv, write_ranking_data, write_csv, create_dest_folder
+from utils.label_vocab_mod import decode_ids, resolve_labels, get_verb_mask
+
+DEFAULT_FPS = 30    # FPS が取得できない場合のフレームレート
+EXTENSION = '.mp4'  # 動画の拡張子
+SCENE_RANGE = 1000  # ランキングを集計するシーン範囲（件数）
+TOP_N = 10          # ランキングに出力するラベル数
+WINDOW_CHUNK = 256  # スライド窓のラベル件数を一度に算出する窓の数
 
 # ログ設定
 logger = setup_logger(__name__)
 
-def shaping_scene_data(scene_data):
-    """シーンデータを整形して返す関数
+def read_video_fps(video_path):
+    """動画ファイルから FPS を読み込む関数
 
     Parameters
     ----------
-    scene_data : list
-        シーンデータ
+    video_path : str
+        動画のファイルパス
 
     Returns
     -------
-    scene_dic
-        辞書化したシーンデータ
-        {video_id : [scene_no, start, end, label], [scene_no, start, end, label], ...}
+    float
+        FPS（取得できない場合は DEFAULT_FPS）
     """
-    scene_dic = {}              # 動画IDごとにシーンデータを辞書化
-    prev_id = scene_data[0][0]  # 前データのID
-    values = []
-    for data in scene_data:
-        video_id = data[0]      # 動画ID
-        scene_no = data[1]      # シーン番号
-        start = int(data[2])    # スタートフレーム
-        end = int(data[3])      # エンドフレーム
-        label = ast.literal_eval(data[4])  # ラベルのリスト
-
-        # 前データのIDと動画IDが異なる場合
-        if prev_id != video_id:
-            scene_dic[prev_id] = values
-            prev_id = video_id
-            values = []
-        else:
-            values.append([scene_no, start, end, label])
-
-        # 最後のデータ
-        if scene_data.index(data) == len(scene_data)-1:
-            scene_dic[prev_id] = values
-    
-    return scene_dic
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) if cap.isOpened() else 0
+    finally:
+        cap.release()
+
+    if not fps or fps <= 0:
+        logger.warning(f'FPS を取得できません。{DEFAULT_FPS} fps とします。（{video_path}）')
+        return DEFAULT_FPS
+
+    return fps
+
+def load_video_fps(video_id_list, video_info_path=None, video_dir=None):
+    """動画ごとの FPS を返す関数
+
+    カット分割で保存した動画情報(.csv)から読み込み、含まれない動画（重複CMとしてカット分割を省略した動画 など）は動画ファイルから読み込む
+
+    Parameters
+    ----------
+    video_id_list : list
+        動画IDのリスト
+
+    video_info_path : str, default None
+        動画情報(.csv)のファイルパス
+
+    video_dir : str, default None
+        動画データが存在するフォルダパス（None の場合、動画情報に無い動画は DEFAULT_FPS とする）
+
+    Returns
+    -------
+    fps_dic : dict
+        動画ごとの FPS {video_id : fps}
+    """
+    fps_dic = {}
+    if video_info_path is not None and os.path.exists(video_info_path):
+        fps_dic = {row[0]: float(row[1]) for row in iter_csv(video_info_path, needs_skip_header=True)}
+
+    for video_id in video_id_list:
+        if video_id not in fps_dic:
+            fps_dic[video_id] = read_video_fps(os.path.join(video_dir, video_id + EXTENSION)) if video_dir is not None else DEFAULT_FPS
+
+    return fps_dic
+
+def align_scene_favo(video_nos, starts, ends, favo_list, fps_list):
+    """全シーンのフレーム範囲に対応する好感度の平均値を一括で算出する関数
 
-def get_best_favo(start, end, favo_list):
-    """フレーム情報から一番最適な好感度を返す関数
-    
     [手順]
-        1. フレーム範囲から一番近い秒数範囲を算出
-        2. 秒数範囲に該当する好感度の平均を取る
+        1. フレーム範囲の開始・終了に一番近い秒数を算出（好感度は n 秒目の値が n * fps フレームに対応する）
+        2. 全シーンの秒数範囲の好感度を、先頭の秒数から1秒ずつ全シーンまとめて加算して平均を取る
+           （累積和の差分は桁落ちで結果が変わるため、シーンごとに先頭から順に合計する）
 
     Parameters
     ----------
-    start : int
-        開始フレーム
-    
-    end : int
-        終了フレーム
+    video_nos : numpy.ndarray
+        シーンごとの動画の番号（favo_list, fps_list のインデックス）
+
+    starts : numpy.ndarray
+        シーンごとの開始フレーム
+
+    ends : numpy.ndarray
+        シーンごとの終了フレーム
 
     favo_list : list
-        好感度のリスト（毎秒ごと）
+        動画ごとの好感度の配列（毎秒ごと）
+
+    fps_list : numpy.ndarray
+        動画ごとの FPS
 
     Returns
     -------
-    float
-        フレーム範囲付近の好感度の平均値
-    """ 
-    max_sec = len(favo_list)    # 動画秒数
-    fps = 30    # フレームレート
-    sec_list = [i*fps for i in range(1, max_sec+1)] # 秒数（フレーム表記）のリスト
-    start_near_sec = sec_list[np.abs(np.asarray(sec_list) - start).argmin()]    # 一番近い秒数
-    end_near_sec = sec_list[np.abs(np.asarray(sec_list) - end).argmin()]
-    near_sec_range =  [start_near_sec+i*fps for i in range((end_near_sec-start_near_sec)//fps+1)]    # 一番近い秒数範囲
-    candidate_favo = [favo_list[ns//30-1] for ns in near_sec_range] # 該当好感度
-
-    # 好感度の平均値を返す
-    return round(sum(candidate_favo) / len(candidate_favo), 3)
-
-def add_favo_to_scene(scene_data, favo_data):
-    """シーンデータに好感度データを付与して返す関数
-    
+    numpy.ndarray
+        シーンごとの好感度の平均値（小数点以下3桁、好感度が無い動画のシーンは nan）
+    """
+    video_nos = np.asarray(video_nos, dtype=np.int64)
+    lengths = np.array([len(favo) for favo in favo_list], dtype=np.int64)   # 動画ごとの秒数
+    offsets = np.concatenate([[0], np.cumsum(lengths)])                     # 連結後の各動画の開始位置
+    values = np.concatenate([np.asarray(favo, dtype=np.float64) for favo in favo_list] + [np.zeros(0)])    # 全動画の好感度
+
+    # 好感度が無い動画のシーンは nan
+    favo = np.full(len(video_nos), np.nan)
+    valid = lengths[video_nos] > 0
+    video_nos = video_nos[valid]
+
+    # 一番近い秒数（1 ～ 動画秒数、等距離の場合は前の秒数）
+    max_sec = lengths[video_nos]
+    fps = np.asarray(fps_list, dtype=np.float64)[video_nos]
+    start_sec = np.clip(np.ceil(np.asarray(starts)[valid] / fps - 0.5), 1, max_sec).astype(np.int64)
+    end_sec = np.clip(np.ceil(np.asarray(ends)[valid] / fps - 0.5), 1, max_sec).astype(np.int64)
+
+    # 秒数範囲の好感度の合計（j 秒目を、秒数範囲が j 秒以上の全シーンに加算）
+    counts = end_sec - start_sec + 1
+    first = offsets[video_nos] + start_sec - 1  # 各シーンの最初の秒数の位置
+    sums = np.zeros(len(counts))
+    for j in range(counts.max(initial=0)):
+        in_range = counts > j
+        sums[in_range] += values[first[in_range] + j]
+
+    # 秒数範囲の好感度の平均値（小数点以下3桁への丸めは round と同じ）
+    favo[valid] = [round(mean, 3) for mean in (sums / counts).tolist()]
+
+    return favo
+
+def load_scene_table(scene_data_path):
+    """シーンデータ(.csv)を1回だけ読み込み、列ごとの配列（列指向のテーブル）にする関数
+
+    ラベルIDは全シーン分を連結した1つの配列とし、シーンごとの開始位置で参照する
+
     Parameters
     ----------
-    scene_data : list
-        シーンデータ
-    
-    favo_data : list
-        好感度データ
+    scene_data_path : str
+        シーンのデータ(.csv)のファイルパス
 
     Returns
     -------
-    scene_favo_list : list
-        場面データ [[video_id, scene_no, start, end, [label, ...], best_favo], ....]
-    """ 
-    header, *favo_data = favo_data  # ヘッダーと分離
-    video_id_col = header.index('映像コード')  # 動画IDの列
-    video_id_list = [data[video_id_col] for data in favo_data]  # 動画IDリスト
-
-    # データの整形（動画IDごとに辞書化）
-    favo_dic = {data[video_id_col] : [float(favo) for favo in data[video_id_col+1:] if favo != '']for data in favo_data}    # 好感度データ
-    scene_dic = shaping_scene_data(scene_data)  # シーンデータ
-
-    # 各シーンに好感度を付与
-    scene_favo_list = [] # シーンのリスト
-    for video_id in video_id_list:
-        for sl in scene_dic[video_id]:
-            scene_no = sl[0]    # シーン番号
-            start = sl[1]       # スタートフレーム
-            end = sl[2]         # エンドフレーム
-            labels = sl[3]      # ラベル
+    scene_table : dict
+        シーンのテーブル
+        {'video_id': 動画ID, 'scene_no': シーン番号, 'start': スタートフレーム, 'end': エンドフレーム,
+         'label_ids': 全シーンのラベルID（連結）, 'label_offsets': シーンごとのラベルIDの開始位置（シーン数 + 1）,
+         'index': {video_id : 行番号の配列}}
+    """
+    video_ids, scene_nos, starts, ends, labels = [], [], [], [], []
+    for video_id, scene_no, start, end, label in iter_csv(scene_data_path, needs_skip_header=True):
+        video_ids.append(video_id)
+        scene_nos.append(int(scene_no))
+        starts.append(int(start))
+        ends.append(int(end))
+        labels.append(label)
+
+    # 映像コード（動画ID）ごとの行番号
+    index = {}
+    for row, video_id in enumerate(video_ids):
+        index.setdefault(video_id, []).append(row)
+
+    return {
+        'video_id': np.array(video_ids, dtype=str),
+        'scene_no': np.array(scene_nos, dtype=np.int64),
+        'start': np.array(starts, dtype=np.int64),
+        'end': np.array(ends, dtype=np.int64),
+        'label_ids': decode_ids(' '.join(labels)),
+        'label_offsets': np.concatenate([[0], np.cumsum([len(label.split()) for label in labels])]).astype(np.int64),
+        'index': {video_id: np.array(rows, dtype=np.int64) for video_id, rows in index.items()}
+    }
+
+def load_favo_table(cmData_paths):
+    """CMデータ(.csv)から映像コードと好感度（毎秒）の列のみを1回だけ読み込む関数
+
+    Parameters
+    ----------
+    cmData_paths : dict
+        グループごとのCMデータのファイルパス {グループ名 : ファイルパス}（例 : {'top': 上位, 'btm': 下位}）
+
+    Returns
+    -------
+    favo_table : dict
+        好感度のテーブル
+        {'group': グループ名, 'video_id': 動画ID, 'favo': 好感度の配列（毎秒ごと）のリスト}
+        行はCMデータの行順（グループ順）に並ぶ（同じ動画IDが複数のグループに含まれる場合も、グループごとに1行とする）
+    """
+    groups, video_ids, favo_list = [], [], []
+    for group, cmData_path in cmData_paths.items():
+        header = next(iter_csv(cmData_path), [])   # ヘッダー
+        video_id_col = header.index('映像コード')   # 動画IDの列（以降の列が好感度）
+
+        # 映像コードと好感度の列のみを読み込む
+        usecols = list(range(video_id_col, len(header)))
+        for data in iter_csv(cmData_path, needs_skip_header=True, usecols=usecols):
+            groups.append(group)
+            video_ids.append(data[0])
+            favo_list.append(np.array([float(favo) for favo in data[1:] if favo != '']))
+
+    return {
+        'group': np.array(groups, dtype=str),
+        'video_id': np.array(video_ids, dtype=str),
+        'favo': favo_list
+    }
+
+def join_scene_favo(scene_table, favo_table, fps_dic):
+    """CMデータの各動画にシーンを映像コードで対応付け（ハッシュ結合）、シーンごとの好感度を付与する関数
+
+    結合結果はCMデータの行順・シーン番号順に並び、グループで絞り込んで上位・下位の集計に使用する
+
+    Parameters
+    ----------
+    scene_table : dict
+        シーンのテーブル（[load_scene_table] の結果）
+
+    favo_table : dict
+        好感度のテーブル（[load_favo_table] の結果）
+
+    fps_dic : dict
+        動画ごとの FPS {video_id : fps}
+
+    Returns
+    -------
+    scene_favo : dict
+        シーンと好感度の結合テーブル
+        {'group': グループ名, 'cm_row': 好感度のテーブルの行番号, 'scene_row': シーンのテーブルの行番号, 'favo': シーンの好感度}
+    """
+    cm_rows, scene_rows = [], []
+    for cm_row, video_id in enumerate(favo_table['video_id']):
+        rows = scene_table['index'].get(video_id)
+        if rows is None:
+            logger.warning(f'{video_id} : シーンデータがありません。')
+            continue
+
+        cm_rows.append(np.full(len(rows), cm_row, dtype=np.int64))
+        scene_rows.append(rows)
+
+    cm_rows = np.concatenate(cm_rows) if cm_rows else np.zeros(0, dtype=np.int64)
+    scene_rows = np.concatenate(scene_rows) if scene_rows else np.zeros(0, dtype=np.int64)
+
+    # シーン範囲から最適な好感度を一括で取得
+    favo = align_scene_favo(cm_rows, scene_table['start'][scene_rows], scene_table['end'][scene_rows],
+                            favo_table['favo'], [fps_dic[video_id] for video_id in favo_table['video_id']])
+
+    return {'group': favo_table['group'][cm_rows], 'cm_row': cm_rows, 'scene_row': scene_rows, 'favo': favo}
+
+def gather_labels(scene_table, scene_rows):
+    """指定したシーンのラベルIDを連結して返す関数
+
+    Parameters
+    ----------
+    scene_table : dict
+        シーンのテーブル
+
+    scene_rows : numpy.ndarray
+        シーンのテーブルの行番号
+
+    Returns
+    -------
+    numpy.ndarray
+        ラベルID（連結）
+    """
+    offsets = scene_table['label_offsets']
+    lengths = offsets[scene_rows + 1] - offsets[scene_rows]
+
+    # 各シーンのラベルIDの位置 = シーンの開始位置 + シーン内の番号
+    positions = np.repeat(offsets[scene_rows] - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths) + np.arange(lengths.sum())
+
+    return scene_table['label_ids'][positions]
+
+def count_labels(label_ids, num_labels, mask=None):
+    """ラベルIDの件数を降順で返す関数
+
+    Parameters
+    ----------
+    label_ids : numpy.ndarray
+        ラベルID
+
+    num_labels : int
+        ラベルの語彙のサイズ
+
+    mask : numpy.ndarray, default None
+        集計するラベルIDかどうか（インデックスがラベルID）
+
+    Returns
+    -------
+    list
+        ラベルの件数 [[label_id, 件数], ...]（件数の降順、同数の場合はラベルIDの昇順）
+    """
+    counts = np.bincount(label_ids, minlength=num_labels)
+    if mask is not None:
+        counts = np.where(mask, counts, 0)
+    order = np.argsort(-counts, kind='stable')
+
+    return [[int(label_id), int(counts[label_id])] for label_id in order if counts[label_id] > 0]
+
+def build_scene_label_matrix(scene_table, scene_rows, num_labels):
+    """シーン × ラベルの件数の疎行列を作成する関数
+
+    Parameters
+    ----------
+    scene_table : dict
+        シーンのテーブル
+
+    scene_rows : numpy.ndarray
+        行列の行にするシーン（シーンのテーブルの行番号、この順に並べる）
+
+    num_labels : int
+        ラベルの語彙のサイズ
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        シーン × ラベルの件数の行列 (シーン数, ラベル数)
+    """
+    offsets = scene_table['label_offsets']
+    indptr = np.concatenate([[0], np.cumsum(offsets[scene_rows + 1] - offsets[scene_rows])])
+    label_ids = gather_labels(scene_table, scene_rows)
+
+    matrix = csr_matrix((np.ones(len(label_ids), dtype=np.int64), label_ids, indptr), shape=(len(scene_rows), num_labels))
+    matrix.sum_duplicates()     # 同じラベルの件数をまとめる
+
+    return matrix
+
+def get_ranking_windows(num_scenes, window_size=SCENE_RANGE):
+    """好感度順のシーンから、上位・中位・下位のシーン範囲を返す関数
+
+    Parameters
+    ----------
+    num_scenes : int
+        総シーン数
+
+    window_size : int, default SCENE_RANGE
+        シーン範囲の件数
+
+    Returns
+    -------
+    dict
+        シーン範囲 {'top': (開始, 終了), 'mid': (開始, 終了), 'btm': (開始, 終了)}（好感度の降順の行番号、終了は含まない）
+    """
+    half = num_scenes // 2
+    return {
+        'top': (0, min(window_size, num_scenes)),
+        'mid': (max(half - window_size//2, 0), min(half + window_size//2, num_scenes)),
+        'btm': (max(num_scenes - window_size, 0), num_scenes)
+    }
+
+def window_label_stats(matrix, start, end, total_cnt, mask=None, top_n=TOP_N):
+    """シーン範囲のラベル件数と、全シーンの件数に対する割合を返す関数
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        シーン × ラベルの件数の行列（好感度の降順）
+
+    start, end : int
+        シーン範囲（行番号、終了は含まない）
+
+    total_cnt : numpy.ndarray
+        全シーンのラベルごとの件数
+
+    mask : numpy.ndarray, default None
+        集計するラベルかどうか（インデックスがラベルID、動詞のみ など）
+
+    top_n : int, default TOP_N
+        返すラベル数（None の場合は全て）
+
+    Returns
+    -------
+    list
+        ラベルの件数 [[label_id, 件数, 割合], ...]（件数の降順、同数の場合はラベルIDの昇順）
+    """
+    counts = np.asarray(matrix[start:end].sum(axis=0)).ravel()
+
+    return rank_label_counts(counts, total_cnt, mask, top_n)
+
+def rank_label_counts(counts, total_cnt, mask=None, top_n=TOP_N):
+    """ラベルごとの件数から、件数の多いラベルと全シーンの件数に対する割合を返す関数
+
+    Parameters
+    ----------
+    counts : numpy.ndarray
+        ラベルごとの件数（インデックスがラベルID）
+
+    total_cnt : numpy.ndarray
+        全シーンのラベルごとの件数
+
+    mask : numpy.ndarray, default None
+        集計するラベルかどうか（インデックスがラベルID、動詞のみ など）
+
+    top_n : int, default TOP_N
+        返すラベル数（None の場合は全て）
+
+    Returns
+    -------
+    list
+        ラベルの件数 [[label_id, 件数, 割合], ...]（件数の降順、同数の場合はラベルIDの昇順）
+    """
+    if mask is not None:
+        counts = np.where(mask, counts, 0)
+    ratio = np.divide(counts, total_cnt, out=np.zeros(len(counts)), where=total_cnt > 0)
+
+    order = np.argsort(-counts, kind='stable')[:np.count_nonzero(counts)][:top_n]
 
-            # シーン範囲から最適な好感度を取得
-            best_favo = get_best_favo(start, end, favo_dic[video_id])
+    return [[int(label_id), int(counts[label_id]), round(float(ratio[label_id]), 2)] for label_id in order]
 
-            scene_favo_list.append([video_id, scene_no, start, end, labels, best_favo])
+def iter_prefix_counts(matrix, begin, step, num, chunk_size=WINDOW_CHUNK):
+    """行列の先頭から等間隔の位置までのラベル件数の合計（累積和）を、chunk_size 件ずつ返すジェネレータ
 
-    return scene_favo_list
+    隣り合う位置の間の行の合計を疎行列の積で求めて累積するため、全行の累積和を作成しない
 
-def favo_analysis(cmData_top_path, cmData_btm_path, scene_dir, favo_dir):
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        シーン × ラベルの件数の行列
+
+    begin : int
+        最初の位置（行番号）
+
+    step : int
+        位置の間隔（行数）
+
+    num : int
+        位置の数
+
+    chunk_size : int, default WINDOW_CHUNK
+        一度に返す位置の数
+
+    Yields
+    -------
+    numpy.ndarray
+        先頭から各位置まで（位置の行は含まない）のラベル件数の合計 (位置の数, ラベル数)（i 番目は begin + i * step 行目まで）
+    """
+    prefix = np.asarray(matrix[:begin].sum(axis=0)).ravel()   # 先頭から最初の位置までの合計
+    pos = begin
+    for k in range(0, num, chunk_size):
+        n = min(chunk_size, num - k)
+
+        # 隣り合う位置の間の行の合計（区間 × 行の行列との積）
+        rows = (n - 1) * step
+        segment = csr_matrix((np.ones(rows, dtype=np.int64), np.arange(rows), np.arange(0, rows + 1, step)), shape=(n - 1, rows))
+        segment_sums = (segment @ matrix[pos:pos+rows]).toarray()
+
+        prefixes = prefix + np.vstack([np.zeros((1, matrix.shape[1]), dtype=np.int64), np.cumsum(segment_sums, axis=0)])
+        yield prefixes
+
+        # 次の位置までの合計
+        pos += rows
+        prefix = prefixes[-1] + np.asarray(matrix[pos:pos+step].sum(axis=0)).ravel()
+        pos += step
+
+def sliding_window_counts(matrix, window_size, stride, chunk_size=WINDOW_CHUNK):
+    """好感度順のシーンの全てのスライド窓について、ラベル件数を chunk_size 窓ずつ返すジェネレータ
+
+    窓の開始・終了位置までの累積和の差分で各窓の件数を求める
+    一度に算出する件数は (chunk_size, ラベル数) に収まるため、窓の数（シーン数）が増えてもメモリ使用量は増えない
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        シーン × ラベルの件数の行列（好感度の降順）
+
+    window_size : int
+        窓のシーン数
+
+    stride : int
+        窓をずらすシーン数
+
+    chunk_size : int, default WINDOW_CHUNK
+        一度に返す窓の数
+
+    Yields
+    -------
+    numpy.ndarray
+        窓ごとのラベル件数 (窓の数, ラベル数)（全体で k 番目の窓は k * stride 行目から window_size 件）
+    """
+    num_scenes = matrix.shape[0]
+    num_windows = (num_scenes - window_size) // stride + 1 if window_size <= num_scenes else 0
+
+    window_begins = iter_prefix_counts(matrix, 0, stride, num_windows, chunk_size)
+    window_ends = iter_prefix_counts(matrix, window_size, stride, num_windows, chunk_size)
+    for begin_counts, end_counts in zip(window_begins, window_ends):
+        yield end_counts - begin_counts
+
+def favo_analysis(cmData_top_path, cmData_btm_path, scene_dir, favo_dir, vocab, video_info_path=None, video_dir=None, window_size=SCENE_RANGE,
+                  sliding_window=0, sliding_stride=0):
     """ラベル件数を集計して出力する関数
 
     [手順]
-        1. データの読み込み・前処理
-        2. 場面データに好感度データの追加
-        3. ラベル件数のカウント
+        1. シーンデータ・CMデータ（上位・下位）の読み込み（1回のみ）
+        2. 映像コードで結合し、場面データに好感度データの追加
+        3. 上位・下位ごとのラベル件数のカウント
         4. 結果の保存
+        5. 全シーンを好感度順に並べ、上位・中位・下位のシーン範囲のラベルのランキングを保存
+        6. スライド窓を指定した場合は、窓ごとのラベルのランキングを保存
 
     Parameters
     ----------
@@ -144,44 +509,65 @@ def favo_analysis(cmData_top_path, cmData_btm_path, scene_dir, favo_dir):
 
     favo_dir :str
         好感度の結果を出力するフォルダパス
-    """
-    # CMデータの取得
-    cmData_top = read_csv(cmData_top_path) # 上位データ
-    cmData_btm = read_csv(cmData_btm_path) # 下位データ
 
-    # 場面データの読み込み
-    scene_data = read_csv(scene_dir, needs_skip_header=True)
-    
-    # 場面データに好感度データを追加
-    top_scene_list = add_favo_to_scene(scene_data, cmData_top)
-    btm_scene_list = add_favo_to_scene(scene_data, cmData_btm)
-
-    # ラベル件数カウント
-    # 上位データ
-    top_all_label = [label for all_scene in top_scene_list for label in all_scene[4]] 
-    top_label_cnt = [[c[0], int(c[1])] for c in Counter(top_all_label).most_common()]
-    top_verb_label = [data for data in top_all_label if data[0].islower()]
-    top_verb_cnt = [[c[0], int(c[1])] for c in Counter(top_verb_label).most_common()]
-    result_txt = (
-        f'シーン件数: {len(top_scene_list)}, ラベル件数: {len(top_all_label)}(動作ラベル: {len(top_verb_cnt)}), '
-        f'総秒数: {sum([int(data[3]) for data, n_data in zip(top_scene_list, top_scene_list[1:]) if n_data[2] == 0] + [top_scene_list[-1][3]]) // 30} 秒'
-    )
-    logger.debug(result_txt)
-
-    # 下位データ
-    btm_all_label = [label for all_scene in btm_scene_list for label in all_scene[4]] 
-    btm_label_cnt = [[c[0], int(c[1])] for c in Counter(btm_all_label).most_common()]
-    btm_verb_label = [data for data in btm_all_label if data[0].islower()]
-    btm_verb_cnt = [[c[0], int(c[1])] for c in Counter(btm_verb_label).most_common()]
-    result_txt = (
-        f'シーン件数: {len(btm_scene_list)}, ラベル件数: {len(btm_all_label)}(動作ラベル: {len(btm_verb_cnt)}),'
-        f'総秒数: {sum([int(data[3]) for data, n_data in zip(btm_scene_list, btm_scene_list[1:]) if n_data[2] == 0] + [btm_scene_list[-1][3]]) // 30} 秒'
-    )
-    logger.debug(result_txt)
+    vocab : dict
+        ラベルの語彙（ラベル名は結果の出力時にのみ参照する）
+
+    video_info_path : str, default None
+        動画情報(.csv)のファイルパス（シーンのフレーム範囲を秒数に変換する FPS を取得する）
+
+    video_dir : str, default None
+        動画データが存在するフォルダパス（動画情報に無い動画の FPS を取得する）
+
+    window_size : int, default SCENE_RANGE
+        ランキングを集計するシーン範囲の件数
+
+    sliding_window : int, default 0
+        スライド窓のシーン数（0 の場合は、スライド窓のランキングを出力しない）
+
+    sliding_stride : int, default 0
+        スライド窓をずらすシーン数（0 の場合は sliding_window と同じ）
+    """
+    # シーンデータ・CMデータを1回だけ読み込み、映像コードで結合
+    scene_table = load_scene_table(scene_dir)
+    favo_table = load_favo_table({'top': cmData_top_path, 'btm': cmData_btm_path})
+    fps_dic = load_video_fps(favo_table['video_id'], video_info_path, video_dir)
+    scene_favo = join_scene_favo(scene_table, favo_table, fps_dic)
 
     # 結果フォルダを作成
     create_dest_folder(favo_dir)
 
+    # 上位・下位ごとに集計（結合結果をグループで絞り込む）
+    num_labels = len(vocab['labels'])
+    verb_mask = get_verb_mask(vocab)    # 動詞ラベルかどうか
+    results = {}
+    for group in ('top', 'btm'):
+        in_group = scene_favo['group'] == group
+        scene_rows = scene_favo['scene_row'][in_group]
+        cm_rows = scene_favo['cm_row'][in_group]
+
+        # ラベル件数カウント（ラベルIDごと）
+        all_label = gather_labels(scene_table, scene_rows)
+        label_cnt = count_labels(all_label, num_labels)
+        verb_cnt = count_labels(all_label, num_labels, verb_mask)
+
+        # 総秒数（動画ごとの最終フレーム / FPS の合計）
+        video_ids = favo_table['video_id'][np.unique(cm_rows)]
+        total_sec = sum(scene_table['end'][scene_table['index'][video_id]].max() / fps_dic[video_id] for video_id in video_ids)
+        logger.debug(f'シーン件数: {len(scene_rows)}, ラベル件数: {len(all_label)}(動作ラベル: {len(verb_cnt)}), 総秒数: {int(total_sec)} 秒')
+
+        # 場面データ（ラベルIDをラベル名に変換）
+        offsets = scene_table['label_offsets']
+        scene_list = [[scene_table['video_id'][row], int(scene_table['scene_no'][row]), int(scene_table['start'][row]), int(scene_table['end'][row]),
+                       resolve_labels(scene_table['label_ids'][offsets[row]:offsets[row+1]], vocab), favo]
+                      for row, favo in zip(scene_rows.tolist(), scene_favo['favo'][in_group].tolist())]
+        label_cnt, verb_cnt = [[[vocab['labels'][label_id], cnt] for label_id, cnt in cnt_list] for cnt_list in (label_cnt, verb_cnt)]
+
+        results[group] = (scene_list, label_cnt, verb_cnt)
+
+    top_scene_list, top_label_cnt, top_verb_cnt = results['top']
+    btm_scene_list, btm_label_cnt, btm_verb_cnt = results['btm']
+
     # CSVファイルに保存
     write_csv(top_scene_list, os.path.normpath(os.path.join(favo_dir, 'top_scene_data.csv')))
     write_csv(btm_scene_list, os.path.normpath(os.path.join(favo_dir, 'btm_scene_data.csv')))
@@ -189,81 +575,43 @@ def favo_analysis(cmData_top_path, cmData_btm_path, scene_dir, favo_dir):
     write_csv(btm_label_cnt, os.path.normpath(os.path.join(favo_dir, 'btm_labels.csv')))
     write_csv(top_verb_cnt, os.path.normpath(os.path.join(favo_dir, 'top_verb.csv')))
     write_csv(btm_verb_cnt, os.path.normpath(os.path.join(favo_dir, 'btm_verb.csv')))
-    # 上位、中位、下位で〇〇シーンに付与されたラベル上位10件を出力
-    dic_len = len(scene_favo_dic)   # 総シーン数
-    all_favo = order_desc(scene_favo_dic, dic_len)   # 好感度の降順
-    scene_range = 1000  # 1000件のシーン範囲
-
-    all_scene = []  # 全シーンのデータ [動画名, シーン番号, 好感度, ラベルのリスト]
-    for scene in all_favo.keys():
-        video_id = scene[0]
-        scene_no = scene[1]
-        favo_val = all_favo[scene]
-        
-        # 該当のラベルデータ読み出し
-        label = [sd[3] for sd in scene_dic[video_id] if sd[0] == scene_no][0]
-        
-        all_scene.append([video_id, scene_no, favo_val, label])
-    
-    all_label = []  # 全ラベルのデータ
-    for scene in all_scene:
-        label = [re.sub("\(.*\)", "", s) for s in scene[3]] # 個数削除
-        all_label += label
-        
-    # 総ラベル件数辞書 {'女性' : 3112, '男性' : 2362, ...}
-    all_cnt = [[c[0], str(c[1])] for c in Counter(all_label).most_common()]
-    label_cnt_dic = {a[0]:int(a[1]) for a in all_cnt}
-    
-    # 上位
-    top_scene = all_scene[:scene_range]
-    top_label = []
-    for scene in top_scene:
-        label = [re.sub("\(.*\)", "", s) for s in scene[3]] # 個数削除
-        top_label += label
-
-    # 件数順にソート 
-    top_cnt = [[c[0], c[1], str(round(c[1] / label_cnt_dic[c[0]], 2))] for c in Counter(top_label).most_common()]
-    
-    for t in top_cnt[:10]:
-        print(t)
-    print('-----------')
-    
-    # 中位
-    mid_scene = all_scene[(dic_len//2)-(scene_range//2):(dic_len//2)+(scene_range//2)]
-    mid_label = []
-    for scene in mid_scene:
-        label = [re.sub("\(.*\)", "", s) for s in scene[3]] # 個数削除
-        mid_label += label
-    
-    # 件数順にソート
-    mid_cnt = [[c[0], c[1], str(round(c[1] / label_cnt_dic[c[0]], 2))]   for c in Counter(mid_label).most_common()]
-
-    for m in mid_cnt[:10]:
-        print(m)
-    print('-----------')
-
-    # 下位
-    btm_scene = all_scene[-scene_range:]
-    btm_label = []
-    for scene in btm_scene:
-        label = [re.sub("\(.*\)", "", s) for s in scene[3]] # 個数削除
-        btm_label += label
 
-    # 件数順にソート
-    btm_cnt = [[c[0], c[1], str(round(c[1] / label_cnt_dic[c[0]], 2))]   for c in Counter(btm_label).most_common()]
-
-    for b in btm_cnt[:10]:
-        print(b)
-    
-    # CSVファイルに出力
-    data = [top_cnt[:10], mid_cnt[:10], btm_cnt[:10]]
-    for num in range(len(data)):
-        if i == 0:
-            file_name = 'facter_' + str(i) + '.csv'
-        elif i == 1:
-            file_name = 'facter_A.csv'
-        else:
-            file_name = 'facter_' + str(i-1) + '.csv'
-        
-        output_path = os.path.normpath(os.path.join(result_path, file_name))
-        write_ranking_data(data[num], output_path, num)
\ No newline at end of file
+    # --------------------------------------------------
+    # 上位、中位、下位のシーン範囲に付与されたラベル上位10件を出力
+    # --------------------------------------------------
+    # 全シーンを好感度の降順に並べたシーン × ラベルの行列（好感度が無いシーンは、下位に数えないよう除く）
+    ranked = np.flatnonzero(~np.isnan(scene_favo['favo']))
+    order = ranked[np.argsort(-scene_favo['favo'][ranked], kind='stable')]
+    matrix = build_scene_label_matrix(scene_table, scene_favo['scene_row'][order], num_labels)
+    total_cnt = np.asarray(matrix.sum(axis=0)).ravel()    # 総ラベル件数
+
+    ranking_path = os.path.normpath(os.path.join(favo_dir, 'label_ranking.csv'))
+    for num, (window, (start, end)) in enumerate(get_ranking_windows(matrix.shape[0], window_size).items()):
+        for kind, mask in (('all', None), ('verb', verb_mask)):
+            ranking = [[window, kind, vocab['labels'][label_id], cnt, ratio]
+                       for label_id, cnt, ratio in window_label_stats(matrix, start, end, total_cnt, mask)]
+            write_ranking_data(ranking, ranking_path, num * 2 + (kind == 'verb'))
+
+            logger.debug(f'{window}（{start+1} ～ {end} 件目）, {kind} : ' + ', '.join(f'{r[2]}({r[3]}, {r[4]})' for r in ranking))
+
+    # --------------------------------------------------
+    # 好感度順のスライド窓ごとに、付与されたラベル上位10件を出力
+    # --------------------------------------------------
+    if sliding_window > 0:
+        stride = sliding_stride or sliding_window
+        sliding_path = os.path.normpath(os.path.join(favo_dir, 'label_ranking_sliding.csv'))
+
+        # 窓のラベル件数を算出した分ずつ書き出す [開始（件目）, 終了（件目）, 種類, ラベル, 件数, 割合]
+        write_ranking_data([], sliding_path, 0)
+        num_windows = 0 # 窓の数
+        for window_counts in sliding_window_counts(matrix, sliding_window, stride):
+            ranking = []
+            for counts in window_counts:
+                start = num_windows * stride
+                for kind, mask in (('all', None), ('verb', verb_mask)):
+                    ranking += [[start+1, start+sliding_window, kind, vocab['labels'][label_id], cnt, ratio]
+                                for label_id, cnt, ratio in rank_label_counts(counts, total_cnt, mask)]
+                num_windows += 1
+            write_ranking_data(ranking, sliding_path, num_windows)
+
+        logger.debug(f'スライド窓（{sliding_window} 件, {stride} 件ずつ）: {num_windows} 窓')
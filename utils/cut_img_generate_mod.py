@@ -63,7 +63,7 @@ def save_cut_img(video_id, cut_point, frames, dest_path):
     logger.debug('保存先 : ' + dest_path)
     logger.debug('-' * 90)
 
-def cut_img_generate(video_dir, cut_img_dir, cut_point_path):
+def cut_img_generate(video_dir, cut_img_dir, cut_point_path, skip_video_ids=None):
     """各カットからカット画像を作成する関数
 
     カット画像 ・・・ 物体認識に使用する画像
@@ -85,7 +85,12 @@ def cut_img_generate(video_dir, cut_img_dir, cut_point_path):
     cut_point_path : str
         分割したカット点を保存しているファイルパス（.csv）   
         [cut_segmentation_mod.py] で行った結果    
+
+    skip_video_ids : set, default None
+        カット画像を作成しない動画IDの集合（同一の重複CMなど、ラベル付けを行わない動画）
     """
+    skip_video_ids = skip_video_ids or set()
+
     # --------------------------------------------------
     # カット画像の保存先フォルダの作成
     # --------------------------------------------------
@@ -101,6 +106,10 @@ def cut_img_generate(video_dir, cut_img_dir, cut_point_path):
     # カット画像の作成
     # --------------------------------------------------
     for video_id, cut_point in zip(video_id_list, cut_point_list):
+        # ラベル付けを行わない動画は読み込まない
+        if video_id in skip_video_ids:
+            continue
+
         file_name = video_id + CUT_EXTENSION    # ファイル名.拡張子
         input_video_path = os.path.normpath(os.path.join(video_dir, file_name)) # 動画ファイルの入力パス 
 
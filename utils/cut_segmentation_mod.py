@@ -12,6 +12,7 @@ HIST_THRESHOLD = 0.8        # ヒストグラムインタセクション（HI）
 FLASH_THRESHOLD = 0.65      # フラッシュ検出時のHIの類似度比較時の閾値
 EFFECT_THRESHOLD = 0.8      # エフェクト検出時のHIの類似度比較時の閾値
 EXTENSION = '.mp4'          # 保存するカットの拡張子（MP4）
+VIDEO_INFO_HEADER = ['動画ID', 'FPS', '幅', '高さ', '総フレーム数']   # 動画情報の列
 
 # ログ設定
 logger = setup_logger(__name__)
@@ -527,14 +528,14 @@ def save_cut(video_id, cut_point, frames, video_info, dest_path):
     # save_graph_path = os.path.normpath(os.path.join(dest_path, 'change_rate_graph.jpg'))
     # save_diff_rate_graph(diff_rates, save_graph_path)
 
-def cut_segmentation(video_id_list, video_dir, cut_dir, cut_point_path):
+def cut_segmentation(video_id_list, video_dir, cut_dir, cut_point_path, frame_store=None, save_files=True, video_info_path=None):
     """カット分割を行い、各カットをフォルダに保存する関数
     
     [手順]
         1. 保存先フォルダの作成 
         2. 動画の読み込み、フレームデータ，動画情報の抽出
         3. カット点の検出
-        4. カットの保存
+        4. カットの保存（共有メモリへの公開）
 
     Parameters
     ----------
@@ -549,6 +550,16 @@ def cut_segmentation(video_id_list, video_dir, cut_dir, cut_point_path):
     
     cut_point_path : str
         カット分割結果（カット点）を保存するファイルパス（.csv）
+
+    frame_store : utils.frame_share_mod.SharedFrameStore, default None
+        フレームデータを公開する共有メモリ（指定した場合、物体検出・動作認識に共有メモリで受け渡す）
+        参照側がラベル付け結果を (動画ID, カット番号) 順に書き出せるよう、動画IDの昇順に処理する
+
+    save_files : bool, default True
+        カット（動画）をファイルに保存するかどうか
+
+    video_info_path : str, default None
+        動画情報（FPS など）を保存するファイルパス（.csv）（好感度との対応付けで使用する）
     """
     # --------------------------------------------------
     # カットの保存先フォルダの作成
@@ -558,8 +569,9 @@ def cut_segmentation(video_id_list, video_dir, cut_dir, cut_point_path):
     # --------------------------------------------------
     # カット分割
     # --------------------------------------------------
-    cut_point_list = [] # カット点のリスト
-    for video_id in video_id_list:
+    cut_point_dict = {}     # 動画IDごとのカット点
+    video_info_dict = {}    # 動画IDごとの動画情報
+    for video_id in (video_id_list if frame_store is None else sorted(video_id_list)):
         file_name = video_id + EXTENSION    # ファイル名.拡張子
         input_video_path = os.path.normpath(os.path.join(video_dir, file_name)) # 動画ファイルの入力パス 
 
@@ -573,19 +585,31 @@ def cut_segmentation(video_id_list, video_dir, cut_dir, cut_point_path):
         # 動画の読み込み、フレームデータと動画情報を抽出
         # --------------------------------------------------
         frames, video_info = read_video_data(input_video_path)
+        video_info_dict[video_id] = [video_id] + video_info + [len(frames)]
         
         # --------------------------------------------------
         # カット点の検出
         # --------------------------------------------------
         cut_point = detect_cut_point(frames)
-        cut_point_list.append(cut_point)
+        cut_point_dict[video_id] = cut_point
         
         # --------------------------------------------------
         # カット点の情報を使用して、動画を分割して保存
         # --------------------------------------------------
-        save_cut(video_id, cut_point, frames, video_info, dest_path)
+        if save_files:
+            save_cut(video_id, cut_point, frames, video_info, dest_path)
+
+        # --------------------------------------------------
+        # フレームデータを共有メモリに公開
+        # --------------------------------------------------
+        if frame_store is not None:
+            frame_store.publish(video_id, frames, cut_point)
     
     # --------------------------------------------------
     # カット点のリストをCSVファイルに保存（後の処理で再使用するため）
     # --------------------------------------------------
-    write_csv([video_id_list, cut_point_list], cut_point_path)
\ No newline at end of file
+    write_csv([video_id_list, [cut_point_dict[video_id] for video_id in video_id_list]], cut_point_path)
+
+    # 動画情報をCSVファイルに保存
+    if video_info_path is not None:
+        write_csv([VIDEO_INFO_HEADER] + [video_info_dict[video_id] for video_id in video_id_list], video_info_path)
\ No newline at end of file
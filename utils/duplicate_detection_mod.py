@@ -0,0 +1,443 @@
+"""
+CMデータ内の重複CM（同一・派生のCM）を検出し、処理結果を再利用するモジュール
+
+同じCMが異なる映像コードで複数回含まれる場合（再放送版、15秒版と30秒版 など）に、
+重複部分のカット分割・ラベル付けを省略する
+
+[手順]
+    1. 指紋の作成 : 各動画のフレームを一定間隔で抽出し、知覚ハッシュ（dHash, 64bit）の系列を作成
+    2. 時間方向の位置合わせ : ハッシュが一致したフレームの組ごとに時間差（オフセット）を投票し、
+                             票が多いオフセットで系列を重ね合わせて、一致する区間（共有区間）を求める
+    3. 分類
+        同一（exact）   : 動画全体が参照動画と一致する
+                          → カット分割・ラベル付けを行わず、参照動画のカット点・ラベルを使用する
+        部分（partial） : 動画の一部が参照動画と一致する（15秒版と30秒版 など）
+                          → カット分割は行い、共有区間内で参照動画のカットと範囲が一致するカットのラベル付けを省略する
+    ラベルを再利用した動画のシーンは、再利用したカット点・ラベルからシーン統合で作成される
+
+ラベル付けの省略には、ラベル付けの再開（--resume）の仕組みを利用する
+再利用するカットの仮の行をラベル付け結果に書き込んでおき、ラベル付けの終了後に参照動画のラベルで置き換える
+"""
+import ast
+import csv
+import os
+from collections import Counter
+
+import numpy as np
+import cv2
+from utils.init_setting import setup_logger
+from utils.file_io import read_csv, write_csv, iter_csv, open_label_writer
+
+SAMPLE_FPS = 5              # 指紋を作成する1秒あたりのフレーム数
+HAMMING_THRESHOLD = 6       # 同じフレームとみなすハッシュのハミング距離の上限
+BAND_BITS = 16              # 候補の検索に使用するハッシュの分割幅（ビット）
+MIN_HASH_BITS = 8           # 検索に使用するハッシュの 1 のビット数の下限（単色のフレームは使用しない）
+MAX_BUCKET = 200            # 検索に使用するバケットのサイズの上限（ありふれたフレームは使用しない）
+MIN_VOTES = 5               # 候補とするオフセットの得票数の下限
+MAX_CANDIDATES = 5          # 1動画あたりに検証するオフセットの数
+MAX_GAP = 2                 # 共有区間内で許容する不一致フレーム数（抽出フレーム単位）
+MIN_SHARED_SEC = 2.0        # 部分一致とみなす共有区間の秒数の下限
+EXACT_COVERAGE = 0.98       # 同一とみなす共有区間の割合の下限
+FRAME_TOLERANCE = 1         # カットの範囲が一致するとみなすフレーム数の誤差
+EXTENSION = '.mp4'          # 動画の拡張子
+REPORT_HEADER = ['動画ID', '参照動画ID', '種類', 'オフセット', '共有区間の開始フレーム', '共有区間の終了フレーム', '共有区間の秒数']
+
+# ログ設定
+logger = setup_logger(__name__)
+
+def dhash(frame):
+    """フレームの知覚ハッシュ（dHash, 64bit）を算出する関数
+
+    Parameters
+    ----------
+    frame : numpy.ndarray
+        フレームデータ（BGR）
+
+    Returns
+    -------
+    int
+        ハッシュ値
+    """
+    gray = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()   # 隣接画素の明暗（8 x 8）
+
+    return int(np.packbits(bits).view('>u8')[0])
+
+def hamming_distance(hashes1, hashes2):
+    """ハッシュの配列同士のハミング距離を返す関数
+
+    Parameters
+    ----------
+    hashes1, hashes2 : numpy.ndarray
+        ハッシュの配列（uint64）
+
+    Returns
+    -------
+    numpy.ndarray
+        要素ごとのハミング距離
+    """
+    xor = np.bitwise_xor(hashes1, hashes2).astype('>u8')
+
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+def video_fingerprint(video_path, sample_fps=SAMPLE_FPS):
+    """動画の指紋（抽出したフレームのハッシュの系列）を作成する関数
+
+    Parameters
+    ----------
+    video_path : str
+        動画のファイルパス
+
+    sample_fps : int, default SAMPLE_FPS
+        1秒あたりの抽出フレーム数
+
+    Returns
+    -------
+    fingerprint : dict
+        指紋 {'fps': FPS, 'frame_count': 総フレーム数, 'step': 抽出間隔（フレーム）, 'hashes': ハッシュの系列（uint64）}
+    """
+    cap = cv2.VideoCapture(video_path)
+    if cap.isOpened() is False:
+        raise ValueError('読み込みエラー : 動画ID ' + video_path + 'が上手く読み取れません。')
+
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        step = max(1, int(round(fps / sample_fps)))
+
+        # 抽出するフレームのみデコードする
+        hashes = []
+        frame_no = 0
+        while cap.grab():
+            if frame_no % step == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                hashes.append(dhash(frame))
+            frame_no += 1
+    finally:
+        cap.release()
+
+    return {'fps': fps, 'frame_count': frame_no, 'step': step, 'hashes': np.array(hashes, dtype=np.uint64)}
+
+def iter_band_keys(hashes):
+    """検索に使用するハッシュの分割値を返すジェネレータ
+
+    1 のビット数が少ない（多い）ハッシュ（単色に近いフレーム）は、無関係な動画とも一致するため使用しない
+
+    Parameters
+    ----------
+    hashes : numpy.ndarray
+        ハッシュの系列
+
+    Yields
+    -------
+    tuple
+        (抽出フレームの番号, (分割番号, 分割値))
+    """
+    for i, value in enumerate(hashes.tolist()):
+        bit_count = bin(value).count('1')
+        if bit_count < MIN_HASH_BITS or bit_count > 64 - MIN_HASH_BITS:
+            continue
+
+        for band in range(64 // BAND_BITS):
+            yield i, (band, (value >> (band * BAND_BITS)) & ((1 << BAND_BITS) - 1))
+
+def find_shared_run(hashes, ref_hashes, offset):
+    """オフセットで重ね合わせた2つのハッシュの系列から、最も長い共有区間を求める関数
+
+    Parameters
+    ----------
+    hashes : numpy.ndarray
+        対象の動画のハッシュの系列
+
+    ref_hashes : numpy.ndarray
+        参照動画のハッシュの系列
+
+    offset : int
+        オフセット（参照動画の抽出フレーム番号 = 対象の動画の抽出フレーム番号 + offset）
+
+    Returns
+    -------
+    tuple or None
+        共有区間 (開始, 終了)（対象の動画の抽出フレーム番号）、共有区間が無い場合は None
+    """
+    # 重なる範囲
+    begin = max(0, -offset)
+    end = min(len(hashes), len(ref_hashes) - offset)
+    if end <= begin:
+        return None
+
+    matched = np.flatnonzero(hamming_distance(hashes[begin:end], ref_hashes[begin+offset:end+offset]) <= HAMMING_THRESHOLD)
+    if len(matched) == 0:
+        return None
+
+    # 不一致が MAX_GAP 以下の箇所は連続しているとみなして、最長の区間を選ぶ
+    runs = np.split(matched, np.flatnonzero(np.diff(matched) > MAX_GAP + 1) + 1)
+    run = max(runs, key=lambda r: r[-1] - r[0])
+
+    return begin + int(run[0]), begin + int(run[-1])
+
+def find_duplicates(video_id_list, video_dir):
+    """動画リストから重複CMを検出する関数
+
+    先に出現した動画を参照動画とし、後に出現した動画ごとに最も長く一致する参照動画を求める
+    同一と判定した動画は、以降の動画の参照動画にはしない（最初の動画が代表する）
+
+    Parameters
+    ----------
+    video_id_list : list
+        動画IDのリスト
+
+    video_dir : str
+        動画データが存在するフォルダパス
+
+    Returns
+    -------
+    duplicates : list
+        重複CMのリスト（動画IDのリストの順）
+        [{'video_id': 動画ID, 'ref_id': 参照動画ID, 'kind': 'exact' or 'partial', 'offset': オフセット（フレーム）,
+          'start': 共有区間の開始フレーム, 'end': 共有区間の終了フレーム, 'shared_sec': 共有区間の秒数, 'step': 指紋の抽出間隔}, ...]
+        オフセットは 参照動画のフレーム番号 = 対象の動画のフレーム番号 + offset
+    """
+    fingerprints = []   # 参照動画の指紋 [(動画ID, 指紋), ...]
+    band_table = {}     # ハッシュの分割値ごとの出現位置 {(分割番号, 分割値): [(参照動画の番号, 抽出フレーム番号), ...]}
+    duplicates = []
+
+    for video_id in video_id_list:
+        fingerprint = video_fingerprint(os.path.join(video_dir, video_id + EXTENSION))
+        hashes, step = fingerprint['hashes'], fingerprint['step']
+        band_keys = list(iter_band_keys(hashes))
+
+        # 一致したフレームの組ごとにオフセットを投票
+        votes = Counter()
+        for i, band_key in band_keys:
+            bucket = band_table.get(band_key, ())
+            if len(bucket) > MAX_BUCKET:
+                continue
+            for ref_no, ref_i in bucket:
+                votes[(ref_no, ref_i - i)] += 1
+
+        # 得票数の多いオフセットを検証し、最も長い共有区間を選ぶ
+        best = None     # (共有区間の長さ, 参照動画の番号, オフセット, 共有区間)
+        for (ref_no, offset), count in votes.most_common(MAX_CANDIDATES):
+            if count < MIN_VOTES or fingerprints[ref_no][1]['step'] != step:
+                continue
+            run = find_shared_run(hashes, fingerprints[ref_no][1]['hashes'], offset)
+            if run is not None and (best is None or run[1] - run[0] > best[0]):
+                best = (run[1] - run[0], ref_no, offset, run)
+
+        kind = None
+        if best is not None:
+            _, ref_no, offset, (start, end) = best
+            ref_id, ref_fingerprint = fingerprints[ref_no]
+            shared_sec = (end - start + 1) * step / fingerprint['fps']
+
+            # 分類
+            num_samples, num_ref_samples = len(hashes), len(ref_fingerprint['hashes'])
+            if (offset == 0 and fingerprint['frame_count'] == ref_fingerprint['frame_count']
+                    and end - start + 1 >= EXACT_COVERAGE * max(num_samples, num_ref_samples)):
+                kind = 'exact'
+            elif shared_sec >= MIN_SHARED_SEC:
+                kind = 'partial'
+
+        if kind is not None:
+            duplicates.append({'video_id': video_id, 'ref_id': ref_id, 'kind': kind, 'offset': offset * step,
+                               'start': start * step, 'end': min((end + 1) * step, fingerprint['frame_count']) - 1,
+                               'shared_sec': round(shared_sec, 2), 'step': step})
+            logger.debug(f'{video_id} : {ref_id} と{"同一" if kind == "exact" else "部分一致"}（共有区間 {shared_sec:.2f} 秒）')
+
+        # 同一でない動画を参照動画として登録
+        if kind != 'exact':
+            ref_no = len(fingerprints)
+            fingerprints.append((video_id, fingerprint))
+            for i, band_key in band_keys:
+                band_table.setdefault(band_key, []).append((ref_no, i))
+
+    return duplicates
+
+def write_duplicate_report(duplicates, report_path):
+    """重複CMの検出結果を保存する関数
+
+    Parameters
+    ----------
+    duplicates : list
+        重複CMのリスト（[find_duplicates] の結果）
+
+    report_path : str
+        保存先のファイルパス（.csv）
+    """
+    with open(report_path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_HEADER)
+        for d in duplicates:
+            writer.writerow([d['video_id'], d['ref_id'], d['kind'], d['offset'], d['start'], d['end'], d['shared_sec']])
+
+def get_cut_ranges(cut_point):
+    """カット点から各カットのフレームの範囲を返す関数
+
+    Parameters
+    ----------
+    cut_point : list
+        カット検出点（フレーム番号）のリスト
+
+    Returns
+    -------
+    list
+        カットの範囲 [(開始フレーム, 終了フレーム), ...]（カット番号順）
+    """
+    return list(zip([0] + [point + 1 for point in cut_point[:-1]], cut_point))
+
+def match_shared_cuts(duplicate, cut_point, ref_cut_point):
+    """部分一致した動画のカットのうち、共有区間内で参照動画のカットと範囲が一致するカットを求める関数
+
+    指紋のオフセットは抽出間隔単位のため、共有区間内のカット点の時間差からフレーム単位のオフセットを求め直す
+
+    Parameters
+    ----------
+    duplicate : dict
+        重複CMの検出結果
+
+    cut_point : list
+        対象の動画のカット点
+
+    ref_cut_point : list
+        参照動画のカット点
+
+    Returns
+    -------
+    dict
+        一致したカット {カット番号: 参照動画のカット番号}
+    """
+    start, end, offset = duplicate['start'], duplicate['end'], duplicate['offset']
+    ref_points = np.array(ref_cut_point)
+    if len(ref_points) == 0:
+        return {}
+
+    # フレーム単位のオフセット（共有区間内のカット点と最も近い参照動画のカット点の時間差の中央値）
+    deltas = []
+    for point in cut_point:
+        if start <= point <= end:
+            nearest = int(ref_points[np.abs(ref_points - (point + offset)).argmin()])
+            if abs(nearest - (point + offset)) <= duplicate['step']:
+                deltas.append(nearest - point)
+    if not deltas:
+        return {}
+    offset = int(np.median(deltas))
+
+    # 範囲が一致するカット
+    ref_cut_nos = {cut_range: cut_no for cut_no, cut_range in enumerate(get_cut_ranges(ref_cut_point), 1)}
+    shared_cuts = {}
+    for cut_no, (cut_start, cut_end) in enumerate(get_cut_ranges(cut_point), 1):
+        if cut_start < start or cut_end > end:
+            continue
+        for d_start in range(-FRAME_TOLERANCE, FRAME_TOLERANCE + 1):
+            for d_end in range(-FRAME_TOLERANCE, FRAME_TOLERANCE + 1):
+                ref_cut_no = ref_cut_nos.get((cut_start + offset + d_start, cut_end + offset + d_end))
+                if ref_cut_no is not None:
+                    shared_cuts[cut_no] = ref_cut_no
+
+    return shared_cuts
+
+def seed_duplicate_cuts(video_id_list, duplicates, cut_point_path, noun_label_path, verb_label_path, seed_labels=True):
+    """重複CMのカット点・ラベルの再利用を準備する関数（カット分割の後、ラベル付けの前に実行する）
+
+    [手順]
+        1. 同一の動画のカット点として参照動画のカット点をカット点データに追加（動画IDのリストの順に保存し直す）
+        2. 参照動画のカットと一致するカットを求め、ラベル付け結果に仮の行（空のラベル）を書き込む
+           ラベル付けを再開（--resume）として実行すると、仮の行のカットは読み飛ばされる
+        3. 省略した処理量をログに出力
+
+    Parameters
+    ----------
+    video_id_list : list
+        動画IDのリスト（同一の動画を含む全ての動画）
+
+    duplicates : list
+        重複CMのリスト（[find_duplicates] の結果）
+
+    cut_point_path : str
+        カット分割結果（カット点）のファイルパス（.csv）
+
+    noun_label_path : str
+        ラベル付け結果(物体検出)のファイルパス
+
+    verb_label_path : str
+        ラベル付け結果(動作認識)のファイルパス
+
+    seed_labels : bool, default True
+        ラベル付け結果に仮の行を書き込むかどうか
+        （False の場合はラベル付けの後に実行し、部分一致のカットもラベル付け済みとして扱う）
+
+    Returns
+    -------
+    reuse_map : dict
+        再利用するカット {(動画ID, カット番号): (参照動画ID, 参照動画のカット番号)}（参照が解決できる順）
+    """
+    # カット点データの読み込み
+    cut_point_dict = {video_id: ast.literal_eval(cut_point) for video_id, cut_point in zip(*read_csv(cut_point_path))}
+
+    reuse_map = {}
+    for duplicate in duplicates:
+        video_id, ref_id = duplicate['video_id'], duplicate['ref_id']
+        ref_cut_point = cut_point_dict[ref_id]
+
+        # 同一 : 全カットを再利用
+        if duplicate['kind'] == 'exact':
+            cut_point_dict[video_id] = list(ref_cut_point)
+            shared_cuts = {cut_no: cut_no for cut_no in range(1, len(ref_cut_point)+1)}
+        # 部分一致 : 共有区間内で範囲が一致するカットを再利用
+        else:
+            shared_cuts = match_shared_cuts(duplicate, cut_point_dict[video_id], ref_cut_point)
+
+        for cut_no, ref_cut_no in shared_cuts.items():
+            # 参照先のカットも再利用の場合は、元のカットを参照する
+            reuse_map[(video_id, cut_no)] = reuse_map.get((ref_id, ref_cut_no), (ref_id, ref_cut_no))
+
+    # カット点データを動画IDのリストの順に保存し直す
+    write_csv([video_id_list, [cut_point_dict[video_id] for video_id in video_id_list]], cut_point_path)
+
+    # ラベル付け結果に仮の行を書き込む（ラベル付けを再開として実行した際に読み飛ばされる）
+    if seed_labels:
+        for label_path in (noun_label_path, verb_label_path):
+            csvfile, writer = open_label_writer(label_path)
+            with csvfile:
+                for video_id, cut_no in sorted(reuse_map):
+                    writer.writerow({'video_id': video_id, 'cut_no': cut_no, 'labels': []})
+
+    # 省略した処理量（仮の行を書き込まない場合、ラベル付けを省略したのは同一の動画のカットのみ）
+    exact_ids = {d['video_id'] for d in duplicates if d['kind'] == 'exact'}
+    skipped_cuts = list(reuse_map) if seed_labels else [key for key in reuse_map if key[0] in exact_ids]
+    cut_frames = {(video_id, cut_no): end - start + 1
+                  for video_id, cut_point in cut_point_dict.items() for cut_no, (start, end) in enumerate(get_cut_ranges(cut_point), 1)}
+    total_frames = sum(cut_frames.values())
+    seg_saved = sum(frames for (video_id, _), frames in cut_frames.items() if video_id in exact_ids)
+    label_saved = sum(cut_frames[key] for key in skipped_cuts)
+    logger.debug(f'重複CM : 同一 {len(exact_ids)} 本, 部分一致 {len(duplicates) - len(exact_ids)} 本')
+    logger.debug(f'カット分割を省略 : {seg_saved} / {total_frames} フレーム（{seg_saved / max(total_frames, 1):.1%}）')
+    logger.debug(f'ラベル付けを省略 : {len(skipped_cuts)} / {len(cut_frames)} カット, {label_saved} / {total_frames} フレーム（{label_saved / max(total_frames, 1):.1%}）')
+
+    return reuse_map
+
+def propagate_duplicate_labels(reuse_map, label_path):
+    """ラベル付け結果の仮の行を、参照動画のカットのラベルで置き換える関数（ラベル付けの後に実行する）
+
+    ラベル付け結果は (動画ID, カット番号) の昇順に並べ替えて保存し直す
+
+    Parameters
+    ----------
+    reuse_map : dict
+        再利用するカット（[seed_duplicate_cuts] の結果）
+
+    label_path : str
+        ラベル付け結果のファイルパス
+    """
+    rows = {(row[0], int(row[1])): row[2] for row in iter_csv(label_path, needs_skip_header=True)}
+
+    # 参照先のラベルで置き換え（参照先にラベル付け結果が無い場合は空のラベル）
+    for key, ref_key in reuse_map.items():
+        rows[key] = rows.get(ref_key, '[]')
+
+    csvfile, writer = open_label_writer(label_path)
+    with csvfile:
+        for (video_id, cut_no) in sorted(rows):
+            writer.writerow({'video_id': video_id, 'cut_no': cut_no, 'labels': rows[(video_id, cut_no)]})
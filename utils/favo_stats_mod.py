@@ -0,0 +1,347 @@
+"""
+ラベルと好感度の関連の有意性を検定するモジュール
+
+ラベルごとに、そのラベルを含むシーンと含まないシーンの好感度の平均値の差を効果量とし、
+    並べ替え検定（好感度をシーン間で並べ替える）による p 値
+    ブートストラップ（シーンを復元抽出する）による信頼区間
+を算出する
+リサンプリングは、リサンプリング結果を並べた行列とシーン × ラベルの疎行列の積として一括で計算し、
+一定数ごとのバッチに分けてプロセスプールで並列に実行する
+各バッチの乱数は固定のシードから SeedSequence で生成するため、並列数に関係なく同じ結果になる
+
+[使い方]
+    python -m utils.favo_stats_mod [--resamples N] [--seed SEED] [--workers N] [--group {all,top,btm}]
+"""
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from utils.init_setting import Path, setup_logger
+from utils.label_vocab_mod import load_label_vocab
+from utils.analysis_mod import load_scene_table, load_favo_table, load_video_fps, join_scene_favo, build_scene_label_matrix
+
+NUM_RESAMPLES = 10000       # リサンプリング回数
+BATCH_SIZE = 250            # 1バッチあたりのリサンプリング回数
+MAX_BATCH_ELEMENTS = 2**22  # 1バッチで作成する行列の要素数の上限（シーン数 × バッチサイズ）
+CONFIDENCE = 0.95           # 信頼区間の信頼水準
+SEED = 0                    # 乱数シード
+RESULT_HEADER = ['ラベル', 'シーン数', '平均好感度（あり）', '平均好感度（なし）', '差', 'p値', 'q値', '信頼区間（下限）', '信頼区間（上限）']
+
+# ログ設定
+logger = setup_logger(__name__)
+
+# ワーカープロセスで共有するデータ（[init_worker] で設定）
+_presence = None    # シーン × ラベルの有無の行列（CSR）
+_favo = None        # シーンの好感度
+
+def calc_effects(presence, favo, weights=None):
+    """ラベルごとの好感度の平均値の差（あり - なし）を算出する関数
+
+    Parameters
+    ----------
+    presence : scipy.sparse.csr_matrix
+        シーン × ラベルの有無の行列
+
+    favo : numpy.ndarray
+        シーンの好感度 (シーン数,) または リサンプリングごとの好感度 (バッチサイズ, シーン数)
+
+    weights : numpy.ndarray, default None
+        シーンの重み（復元抽出の回数） (バッチサイズ, シーン数)、None の場合は全シーン 1
+
+    Returns
+    -------
+    numpy.ndarray
+        ラベルごとの差 (ラベル数,) または (バッチサイズ, ラベル数)（いずれかの群が空の場合は nan）
+        群が空かどうかは件数で判定する（全シーンに含まれるラベルは、なしの群の合計に丸め誤差が残るため）
+    """
+    # ラベルありの群の合計・件数（行列積）、ラベルなしの群は全体から引く
+    if weights is None:
+        weighted = favo
+        with_cnt = np.asarray(presence.sum(axis=0)).ravel()
+        total_cnt = favo.shape[-1]
+    else:
+        weighted = favo * weights
+        with_cnt = weights @ presence
+        total_cnt = weights.sum(axis=-1, keepdims=True)
+    with_sum = weighted @ presence
+    without_sum = weighted.sum(axis=-1, keepdims=weighted.ndim > 1) - with_sum
+    without_cnt = total_cnt - with_cnt
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where((with_cnt > 0) & (without_cnt > 0), with_sum / with_cnt - without_sum / without_cnt, np.nan)
+
+def init_worker(presence, favo):
+    """ワーカープロセスに共有するデータを設定する関数
+
+    Parameters
+    ----------
+    presence : scipy.sparse.csr_matrix
+        シーン × ラベルの有無の行列
+
+    favo : numpy.ndarray
+        シーンの好感度
+    """
+    global _presence, _favo
+    _presence, _favo = presence, favo
+
+def permutation_batch(seed_seq, batch_size, observed):
+    """並べ替え検定の1バッチを実行する関数（ワーカープロセスで実行）
+
+    Parameters
+    ----------
+    seed_seq : numpy.random.SeedSequence
+        バッチの乱数シード
+
+    batch_size : int
+        バッチのリサンプリング回数
+
+    observed : numpy.ndarray
+        ラベルごとの差（観測値）
+
+    Returns
+    -------
+    numpy.ndarray
+        ラベルごとに、並べ替えた差の絶対値が観測値の絶対値以上となった回数
+    """
+    rng = np.random.default_rng(seed_seq)
+    permuted = rng.permuted(np.tile(_favo, (batch_size, 1)), axis=1)   # 行ごとに並べ替え
+    effects = calc_effects(_presence, permuted)
+
+    return (np.abs(effects) >= np.abs(observed) - 1e-12).sum(axis=0)
+
+def bootstrap_batch(seed_seq, batch_size):
+    """ブートストラップの1バッチを実行する関数（ワーカープロセスで実行）
+
+    Parameters
+    ----------
+    seed_seq : numpy.random.SeedSequence
+        バッチの乱数シード
+
+    batch_size : int
+        バッチのリサンプリング回数
+
+    Returns
+    -------
+    numpy.ndarray
+        ラベルごとの差 (バッチサイズ, ラベル数)
+    """
+    rng = np.random.default_rng(seed_seq)
+    num_scenes = len(_favo)
+
+    # 復元抽出の回数を重みとする（行ごとに1回のリサンプリング）
+    samples = rng.integers(0, num_scenes, size=(batch_size, num_scenes)) + np.arange(batch_size)[:, np.newaxis] * num_scenes
+    weights = np.bincount(samples.ravel(), minlength=batch_size * num_scenes).reshape(batch_size, num_scenes).astype(np.float64)
+
+    return calc_effects(_presence, _favo, weights)
+
+def split_batches(num_resamples, num_scenes):
+    """リサンプリング回数をバッチに分割する関数
+
+    Parameters
+    ----------
+    num_resamples : int
+        リサンプリング回数
+
+    num_scenes : int
+        シーン数
+
+    Returns
+    -------
+    list
+        バッチごとのリサンプリング回数
+    """
+    batch_size = max(1, min(BATCH_SIZE, MAX_BATCH_ELEMENTS // max(num_scenes, 1)))
+    return [min(batch_size, num_resamples - i) for i in range(0, num_resamples, batch_size)]
+
+def benjamini_hochberg(p_values):
+    """Benjamini-Hochberg 法で多重比較を補正した q 値を返す関数
+
+    Parameters
+    ----------
+    p_values : numpy.ndarray
+        p 値
+
+    Returns
+    -------
+    numpy.ndarray
+        q 値
+    """
+    num = len(p_values)
+    order = np.argsort(p_values)
+    q_values = p_values[order] * num / np.arange(1, num + 1)
+    q_values = np.minimum.accumulate(q_values[::-1])[::-1]  # 単調性の確保
+
+    result = np.empty(num)
+    result[order] = np.minimum(q_values, 1.0)
+
+    return result
+
+def label_significance(presence, favo, num_resamples=NUM_RESAMPLES, seed=SEED, max_workers=None, confidence=CONFIDENCE):
+    """ラベルごとの好感度の差について、並べ替え検定の p 値とブートストラップ信頼区間を算出する関数
+
+    Parameters
+    ----------
+    presence : scipy.sparse.csr_matrix
+        シーン × ラベルの有無の行列（値は 0 または 1）
+
+    favo : numpy.ndarray
+        シーンの好感度（nan を含まないこと）
+
+    num_resamples : int, default NUM_RESAMPLES
+        リサンプリング回数（並べ替え検定・ブートストラップそれぞれ）
+
+    seed : int, default SEED
+        乱数シード
+
+    max_workers : int, default None
+        並列数（None の場合は CPU 数）
+
+    confidence : float, default CONFIDENCE
+        信頼区間の信頼水準
+
+    Returns
+    -------
+    stats : dict
+        ラベルごとの統計量
+        {'count': シーン数, 'mean_with': 平均好感度（あり）, 'mean_without': 平均好感度（なし）, 'effect': 差,
+         'p_value': p 値, 'q_value': q 値, 'ci_low': 信頼区間（下限）, 'ci_high': 信頼区間（上限）}
+    """
+    favo = np.asarray(favo, dtype=np.float64)
+    count = np.asarray(presence.sum(axis=0)).ravel()
+    with_sum = favo @ presence
+
+    # 差を定義できるラベル（ありの群・なしの群の両方にシーンがある）
+    valid = (count > 0) & (count < len(favo))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_with = np.where(count > 0, with_sum / count, np.nan)
+        mean_without = np.where(count < len(favo), (favo.sum() - with_sum) / (len(favo) - count), np.nan)
+    observed = np.where(valid, mean_with - mean_without, np.nan)
+
+    # バッチごとの乱数シード（バッチの分割はシーン数とリサンプリング回数のみで決まる）
+    batches = split_batches(num_resamples, len(favo))
+    perm_seeds, boot_seeds = np.random.SeedSequence(seed).spawn(2)
+    perm_seeds, boot_seeds = perm_seeds.spawn(len(batches)), boot_seeds.spawn(len(batches))
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=(presence, favo)) as executor:
+        perm_futures = [executor.submit(permutation_batch, s, b, observed) for s, b in zip(perm_seeds, batches)]
+        boot_futures = [executor.submit(bootstrap_batch, s, b) for s, b in zip(boot_seeds, batches)]
+
+        exceed = sum(future.result() for future in perm_futures)
+        boot_effects = np.vstack([future.result() for future in boot_futures])
+
+    # p 値（観測値を含めた並べ替えの割合）、q 値
+    p_value = (exceed + 1) / (num_resamples + 1)
+    p_value = np.where(valid, p_value, np.nan)
+    q_value = np.full(len(p_value), np.nan)
+    q_value[valid] = benjamini_hochberg(p_value[valid])
+
+    # パーセンタイル信頼区間（差が定義できないリサンプリングは除く）
+    alpha = (1 - confidence) / 2
+    with np.errstate(all='ignore'):
+        ci_low, ci_high = np.nanquantile(np.where(valid, boot_effects, 0.0), [alpha, 1 - alpha], axis=0)
+
+    return {'count': count, 'mean_with': mean_with, 'mean_without': mean_without, 'effect': observed,
+            'p_value': p_value, 'q_value': q_value,
+            'ci_low': np.where(valid, ci_low, np.nan), 'ci_high': np.where(valid, ci_high, np.nan)}
+
+def load_presence_matrix(path, vocab, group='all'):
+    """シーンデータ・CMデータを結合し、好感度のあるシーンのラベルの有無の行列と好感度を返す関数
+
+    Parameters
+    ----------
+    path : utils.init_setting.Path
+        パス設定
+
+    vocab : dict
+        ラベルの語彙
+
+    group : str, default 'all'
+        対象のCMデータ（'all' : 上位・下位の両方、'top' : 上位、'btm' : 下位）
+
+    Returns
+    -------
+    presence : scipy.sparse.csr_matrix
+        シーン × ラベルの有無の行列
+
+    favo : numpy.ndarray
+        シーンの好感度
+    """
+    scene_table = load_scene_table(path.scene_data_path)
+    favo_table = load_favo_table({'top': path.cmData_top_path, 'btm': path.cmData_btm_path})
+    fps_dic = load_video_fps(favo_table['video_id'], path.video_info_path, path.video_dir)
+    scene_favo = join_scene_favo(scene_table, favo_table, fps_dic)
+
+    target = ~np.isnan(scene_favo['favo'])
+    if group != 'all':
+        target &= scene_favo['group'] == group
+
+    presence = build_scene_label_matrix(scene_table, scene_favo['scene_row'][target], len(vocab['labels']))
+    presence.data[:] = 1    # 件数ではなく有無
+
+    return presence, scene_favo['favo'][target]
+
+def write_label_stats(stats, vocab, dest_path):
+    """ラベルごとの統計量を p 値の昇順に保存する関数
+
+    Parameters
+    ----------
+    stats : dict
+        ラベルごとの統計量（[label_significance] の結果）
+
+    vocab : dict
+        ラベルの語彙
+
+    dest_path : str
+        保存先のファイルパス（.csv）
+    """
+    order = [label_id for label_id in np.lexsort((-np.abs(stats['effect']), stats['p_value'])) if stats['count'][label_id] > 0]
+
+    with open(dest_path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(RESULT_HEADER)
+        for label_id in order:
+            writer.writerow([vocab['labels'][label_id], int(stats['count'][label_id])] +
+                            [round(float(stats[key][label_id]), 4) for key in ('mean_with', 'mean_without', 'effect', 'p_value', 'q_value', 'ci_low', 'ci_high')])
+
+def parse_args():
+    """コマンドライン引数を処理して返す関数
+
+    Returns
+    -------
+    args : argparse.ArgumentParser
+        解析されたコマンドライン引数
+    """
+    parser = argparse.ArgumentParser(description='ラベルと好感度の関連の有意性検定')
+    parser.add_argument('--resamples', type=int, default=NUM_RESAMPLES, help='リサンプリング回数（並べ替え検定・ブートストラップそれぞれ）')
+    parser.add_argument('--seed', type=int, default=SEED, help='乱数シード')
+    parser.add_argument('--workers', type=int, help='並列数（省略時は CPU 数）')
+    parser.add_argument('--group', choices=['all', 'top', 'btm'], default='all', help='対象のCMデータ')
+    parser.add_argument('--dest', help='結果の保存先（省略時は好感度の結果フォルダの label_stats_[group].csv）')
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == '__main__':
+    start = time.time() # 開始時間
+
+    # コマンドライン引数の取得
+    args = parse_args()
+
+    # パス設定
+    path = Path()
+    vocab = load_label_vocab(path.label_vocab_path)
+
+    presence, favo = load_presence_matrix(path, vocab, args.group)
+    logger.debug(f'シーン数: {presence.shape[0]}, ラベル数: {np.count_nonzero(presence.getnnz(axis=0))}')
+
+    stats = label_significance(presence, favo, args.resamples, args.seed, args.workers)
+
+    dest_path = args.dest or os.path.join(path.favo_dir, f'label_stats_{args.group}.csv')
+    os.makedirs(os.path.dirname(dest_path) or '.', exist_ok=True)
+    write_label_stats(stats, vocab, dest_path)
+
+    logger.debug(f'有意性検定が終了しました。（リサンプリング {args.resamples} 回, {time.time() - start:.1f} 秒）')
+    logger.debug('保存先 : ' + dest_path)
@@ -1,10 +1,55 @@
+import codecs
 import csv
 import os
+import re
 import shutil
 
+ENCODINGS = ['iso-2022-jp', 'euc-jp', 'sjis', 'utf-8-sig']  # 判定する文字コード（判定順）
+SNIFF_SIZE = 64 * 1024  # 文字コードの判定時に読み込む単位[byte]
+
+# 文字コードの判定結果 {(ファイルパス, 更新時刻): 文字コード}
+_encoding_cache = {}
+
+def sniff_encoding(file_path):
+    """ファイルの先頭部分から文字コードを判定する関数
+
+    ファイル全体ではなく、ASCII以外の文字が現れるまでの先頭部分（SNIFF_SIZE 単位）のみを読み込んで判定する
+    先頭部分の末尾で途切れたマルチバイト文字は、インクリメンタルデコーダで判定から除外する
+
+    Parameters
+    ----------
+    file_path : str
+        読み込むファイルのパス
+
+    Returns
+    -------
+    enc : str
+        ファイルの文字コード
+    """
+    sample = b''
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(SNIFF_SIZE)
+            sample += chunk
+            is_eof = len(chunk) < SNIFF_SIZE
+
+            # ASCII以外の文字（エスケープシーケンスを含む）が現れるまで読み込む
+            if is_eof or any(b >= 0x80 or b == 0x1b for b in chunk):
+                break
+
+    for enc in ENCODINGS:
+        decoder = codecs.getincrementaldecoder(enc)()
+        try:
+            decoder.decode(sample, final=is_eof)
+        except UnicodeDecodeError:
+            continue
+        return enc
+
 def getEncode(file_path):
     """読み込んだファイルが対応している文字コードを返す関数
 
+    判定結果はファイルパスと更新時刻ごとにキャッシュする
+
     Parameters
     ----------
     file_path : str
@@ -15,14 +60,11 @@ def getEncode(file_path):
     enc : str
         ファイルの文字コード
     """
-    encs = ['iso-2022-jp', 'euc-jp', 'sjis', 'utf-8-sig']
-    for enc in encs:
-        with open(file_path, encoding=enc) as fr:
-            try:
-                fr = fr.read()
-            except UnicodeDecodeError:
-                continue
-        return enc
+    key = (os.path.abspath(file_path), os.path.getmtime(file_path))
+    if key not in _encoding_cache:
+        _encoding_cache[key] = sniff_encoding(file_path)
+
+    return _encoding_cache[key]
 
 def read_txt(file_path, needs_skip_header=False):
     """テキストファイルを読み込んで、その結果を返す関数
@@ -52,8 +94,10 @@ def read_txt(file_path, needs_skip_header=False):
 
     return results
 
-def read_csv(file_path, needs_skip_header=False):
-    """CSVファイルを読み込んで、その結果を返す関数
+def iter_csv(file_path, needs_skip_header=False, usecols=None):
+    """CSVファイルを1行ずつ読み込むジェネレータ
+
+    読み込み終了時（途中で中断した場合も含む）にファイルを閉じる
 
     Parameters
     ----------
@@ -63,24 +107,35 @@ def read_csv(file_path, needs_skip_header=False):
     needs_skip_header : bool, default False
         ヘッダーを読み飛ばすかどうか
 
-    Returns
+    usecols : list, default None
+        読み込む列（列番号、またはヘッダーの列名）のリスト
+        列名を指定した場合、ヘッダーは列の特定に使用し、結果には含めない
+
+    Yields
     -------
     list
-        読み込んだ結果を返すリスト
+        1行分のデータ
     """
     # 文字コードを取得
     enc = getEncode(file_path)
 
-    csvfile = open(file_path, 'r', encoding=enc)
-    reader = csv.reader(csvfile)
+    with open(file_path, 'r', encoding=enc, newline='') as csvfile:
+        reader = csv.reader(csvfile)
 
-    # ヘッダーを読み飛ばしたい時
-    if needs_skip_header:
-        header = next(reader)  
-        
-    return [row for row in reader]
+        # ヘッダーを読み飛ばしたい時、列名で列を指定した時
+        if needs_skip_header or (usecols is not None and any(isinstance(col, str) for col in usecols)):
+            header = next(reader, [])
+            if usecols is not None:
+                usecols = [header.index(col) if isinstance(col, str) else col for col in usecols]
 
-def read_favo(file_path, needs_skip_header=False):
+        if usecols is None:
+            yield from reader
+        else:
+            # 末尾の列が欠けた行は、空文字で補う
+            for row in reader:
+                yield [row[col] if col < len(row) else '' for col in usecols]
+
+def read_csv(file_path, needs_skip_header=False):
     """CSVファイルを読み込んで、その結果を返す関数
 
     Parameters
@@ -90,23 +145,31 @@ def read_favo(file_path, needs_skip_header=False):
 
     needs_skip_header : bool, default False
         ヘッダーを読み飛ばすかどうか
-        
+
     Returns
     -------
     list
         読み込んだ結果を返すリスト
     """
-    # 文字コードを取得
-    enc = getEncode(file_path)
+    return list(iter_csv(file_path, needs_skip_header))
 
-    csvfile = open(file_path, 'r', encoding=enc)
-    reader = csv.reader(csvfile, delimiter=',')
+def read_favo(file_path, needs_skip_header=False):
+    """CSVファイルを読み込んで、その結果を返す関数
 
-    # ヘッダーを読み飛ばしたい時
-    if needs_skip_header:
-        header = next(reader)  
+    Parameters
+    ----------
+    file_path : str
+        読み込むCSVファイルのパス
 
-    return [row for row in reader]
+    needs_skip_header : bool, default False
+        ヘッダーを読み飛ばすかどうか
+        
+    Returns
+    -------
+    list
+        読み込んだ結果を返すリスト
+    """
+    return list(iter_csv(file_path, needs_skip_header))
 
 def write_csv(data, dest_path):
     """データを受け取り、CSVに書き出す関数
@@ -128,6 +191,21 @@ def write_csv(data, dest_path):
         else:   # 1次元配列の場合
             writer.writerow(data)
 
+def append_csv(data, dest_path):
+    """データを受け取り、CSVに追記する関数（ファイルが無い場合は作成する）
+
+    Parameters
+    ----------
+    data : list
+        出力するデータ（2次元配列）
+        
+    dest_path : str
+        保存先ファイルのパス
+    """
+    with open(dest_path, 'a', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerows(data)
+
 def write_ranking_data(data, dest_path, i):
     """ランキングのデータを受け取り、CSVに書き出す関数
 
@@ -167,4 +245,103 @@ def create_dest_folder(dest_path, is_create_newly=False):
     # 既に存在する かつ 新規に作成する場合は削除してから作成
     if os.path.exists(dest_path) and is_create_newly:
         shutil.rmtree(dest_path)    # フォルダ削除
-        os.makedirs(dest_path, exist_ok=True)   # 保存先フォルダの作成
\ No newline at end of file
+        os.makedirs(dest_path, exist_ok=True)   # 保存先フォルダの作成
+
+def get_cut_key(file_path):
+    """ファイルパスから (動画ID, カット番号) を返す関数
+
+    Parameters
+    ----------
+    file_path : str
+        カット画像（カット動画）のファイルパス
+
+    Returns
+    -------
+    tuple
+        (video_id, cut_no)
+    """
+    video_id, file_name = file_path.replace('\\', '/').split('/')[-2:]
+    cut_no = int(re.sub(r'\D', '', os.path.splitext(file_name)[0]))
+
+    return video_id, cut_no
+
+def read_labeled_cuts(file_path):
+    """ラベル付け結果ファイル(.csv)から、ラベル付け済みのカットを返す関数
+
+    中断したラベル付けを再開する際に、処理済みのカットを読み飛ばすために使用する
+    改行で終わっていない最終行（書き込み途中で中断した行）は、再開時に切り捨てるため処理済みとして扱わない
+    （途中で途切れた行も CSV としては読み込めてしまうため、改行の有無で判定する）
+
+    Parameters
+    ----------
+    file_path : str
+        ラベル付け結果ファイル(.csv)のパス
+
+    Returns
+    -------
+    labeled_cuts : set
+        ラベル付け済みのカットの集合 {(video_id, cut_no), ...}
+    """
+    labeled_cuts = set()
+
+    # ファイルが存在しない場合は、処理済みのカットなし
+    if not os.path.exists(file_path):
+        return labeled_cuts
+
+    # 改行で終わる行のみを読み込む（[open_label_writer] で切り捨てる範囲と一致させる）
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    lines = data[:data.rfind(b'\n') + 1].decode('utf-8').splitlines()
+
+    for row in csv.DictReader(lines):
+        # 列が欠けた行は読み飛ばす
+        if None in row.values() or not row['cut_no'].isdigit():
+            continue
+
+        labeled_cuts.add((row['video_id'], int(row['cut_no'])))
+
+    return labeled_cuts
+
+def open_label_writer(dest_path, resume=False):
+    """ラベル付け結果を逐次書き込むためのファイルとライターを返す関数
+
+    再開する場合は既存のファイルに追記する
+    その際、中断により途中まで書き込まれた最終行は切り捨てる
+
+    Parameters
+    ----------
+    dest_path : str
+        ラベル付け結果ファイル(.csv)のパス
+
+    resume : bool, default False
+        中断したラベル付けを再開するかどうか
+
+    Returns
+    -------
+    csvfile : io.TextIOWrapper
+        書き込み先のファイル（呼び出し側で close すること）
+
+    writer : csv.DictWriter
+        ラベル付け結果のライター
+    """
+    field_name = ['video_id', 'cut_no', 'labels']
+
+    # 再開する かつ 既存のファイルがある場合は追記
+    if resume and os.path.exists(dest_path) and os.path.getsize(dest_path) > 0:
+        # 途中まで書き込まれた最終行を切り捨てる
+        with open(dest_path, 'rb+') as f:
+            data = f.read()
+            f.truncate(data.rfind(b'\n') + 1)
+
+        csvfile = open(dest_path, 'a', encoding='utf-8', newline='')
+        writer = csv.DictWriter(csvfile, fieldnames=field_name)
+
+        # ヘッダーまで切り捨てられた場合は書き直す
+        if csvfile.tell() == 0:
+            writer.writeheader()
+    else:
+        csvfile = open(dest_path, 'w', encoding='utf-8', newline='')
+        writer = csv.DictWriter(csvfile, fieldnames=field_name)
+        writer.writeheader()
+
+    return csvfile, writer
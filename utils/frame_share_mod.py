@@ -0,0 +1,307 @@
+"""
+カット分割で読み込んだフレームデータを共有メモリで受け渡すモジュール
+
+カット分割（メインプロセス）が動画ごとのフレームデータを共有メモリ（POSIX shared memory）に置き、
+物体検出・動作認識（別プロセス）はマニフェストを読んで共有メモリから直接フレームを参照する
+カット動画・カット画像のファイルへの書き出しと再読み込みを経由しないため、エンコード・デコードが不要になる
+
+物体検出・動作認識はカット分割と同時に実行し、1動画ずつ受け渡す
+    1. カット分割は1動画を公開するたびに、マニフェストに1行追記する
+    2. 物体検出・動作認識はマニフェストを追いかけて読み込み、1動画の処理を終えるたびに受領ファイルに動画IDを追記する
+    3. カット分割は全ての参照側が受領した動画の共有メモリを解放する
+       公開中の動画が上限（max_live）に達した場合は、解放されるまで次の動画を公開しない
+そのため、共有メモリの使用量は動画 max_live 本分に収まる
+
+マニフェストの形式（1行に1動画の JSON、最終行は終了の印）
+    {"video_id": 動画ID, "shm_name": 共有メモリ名, "shape": [フレーム数, 高さ, 幅, 3], "dtype": "|u1", "cut_point": [カット点, ...]}
+    {"end": true}
+
+動画は (動画ID) の昇順に公開すること（ラベル付け結果を (動画ID, カット番号) 順に書き出すため）
+"""
+import json
+import os
+import time
+
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+CONSUMERS = ['object_detection', 'action_recognition']  # フレームデータの参照側
+MAX_LIVE_VIDEOS = 2     # 同時に公開する動画数の上限
+POLL_INTERVAL = 0.2     # マニフェスト・受領ファイルの確認間隔[sec]
+
+def get_ack_path(manifest_path, consumer):
+    """参照側の受領ファイルのパスを返す関数
+
+    Parameters
+    ----------
+    manifest_path : str
+        マニフェストのファイルパス
+
+    consumer : str
+        参照側の名前
+
+    Returns
+    -------
+    str
+        受領ファイルのパス（処理を終えた動画IDを1行ずつ追記する）
+    """
+    return f'{os.path.splitext(manifest_path)[0]}_{consumer}.ack'
+
+class SharedFrameStore:
+    def __init__(self, manifest_path, consumers=CONSUMERS, max_live=MAX_LIVE_VIDEOS):
+        """フレームデータを共有メモリに公開するクラス
+
+        作成時にマニフェスト・受領ファイルを空にするため、参照側のプロセスは作成後に起動すること
+
+        Attributes
+        ----------
+        blocks : dict
+            公開中の動画IDごとの共有メモリ {video_id: multiprocessing.shared_memory.SharedMemory}
+
+        processes : list
+            参照側のプロセス（subprocess.Popen）（異常終了した場合に待機を打ち切るため）
+        """
+        self.manifest_path = manifest_path
+        self.ack_paths = [get_ack_path(manifest_path, consumer) for consumer in consumers]
+        self.max_live = max(max_live, 1)
+        self.blocks = {}
+        self.processes = []
+        self.is_finished = False
+
+        for file_path in [manifest_path] + self.ack_paths:
+            open(file_path, 'w', encoding='utf-8').close()
+
+    def watch(self, processes):
+        """参照側のプロセスを登録する関数
+
+        Parameters
+        ----------
+        processes : list
+            参照側のプロセス（subprocess.Popen）
+        """
+        self.processes = list(processes)
+
+    def append_manifest(self, entry):
+        """マニフェストに1行追記する関数"""
+        with open(self.manifest_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def release(self):
+        """全ての参照側が受領した動画の共有メモリを解放する関数"""
+        acked = None
+        for ack_path in self.ack_paths:
+            with open(ack_path, 'r', encoding='utf-8') as f:
+                video_ids = {line.strip() for line in f if line.endswith('\n')}
+            acked = video_ids if acked is None else acked & video_ids
+
+        for video_id in [video_id for video_id in self.blocks if video_id in acked]:
+            shm = self.blocks.pop(video_id)
+            shm.close()
+            shm.unlink()
+
+    def wait_for_space(self):
+        """公開中の動画が上限未満になるまで待機する関数"""
+        while True:
+            self.release()
+            if len(self.blocks) < self.max_live:
+                return
+
+            # 参照側が先に終了した場合は、受領されないため打ち切る
+            if any(process.poll() is not None for process in self.processes):
+                raise RuntimeError('フレームデータの参照側のプロセスが終了したため、共有メモリでの受け渡しを中断しました。')
+
+            time.sleep(POLL_INTERVAL)
+
+    def publish(self, video_id, frames, cut_point):
+        """1動画分のフレームデータを共有メモリに公開する関数
+
+        Parameters
+        ----------
+        video_id : str
+            動画ID
+
+        frames : list
+            フレームデータ（動画の全画像データ、RGB）
+
+        cut_point : list
+            カット検出点（フレーム番号）のリスト
+        """
+        self.wait_for_space()
+
+        shape = (len(frames),) + frames[0].shape
+        dtype = frames[0].dtype
+
+        # 共有メモリを確保して、フレームデータを書き込む
+        shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * dtype.itemsize)
+        shared_frames = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        for i, frame in enumerate(frames):
+            shared_frames[i] = frame
+        del shared_frames
+
+        self.blocks[video_id] = shm
+        self.append_manifest({
+            'video_id': video_id,
+            'shm_name': shm.name,
+            'shape': list(shape),
+            'dtype': dtype.str,
+            'cut_point': [int(c) for c in cut_point]
+        })
+
+    def finish(self):
+        """全動画の公開が終わったことをマニフェストに書き込む関数"""
+        if not self.is_finished:
+            self.append_manifest({'end': True})
+            self.is_finished = True
+
+    def close(self):
+        """公開中の全ての共有メモリを解放する関数（参照側の終了後に呼び出す）"""
+        self.finish()   # 異常終了時も参照側が待機し続けないようにする
+
+        for shm in self.blocks.values():
+            shm.close()
+            shm.unlink()
+
+        self.blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def follow_manifest(manifest_path):
+    """マニフェストを追いかけて読み込み、公開された動画を順に返すジェネレータ
+
+    終了の印を読み込むまで、追記を待機する
+
+    Parameters
+    ----------
+    manifest_path : str
+        マニフェストのファイルパス
+
+    Yields
+    -------
+    dict
+        公開された動画の情報
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        while True:
+            pos = f.tell()
+            line = f.readline()
+
+            # 追記途中の行は、書き終わるまで待機
+            if not line.endswith('\n'):
+                f.seek(pos)
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            entry = json.loads(line)
+            if entry.get('end'):
+                return
+
+            yield entry
+
+def attach_shared_memory(shm_name):
+    """公開されている共有メモリに接続する関数
+
+    参照側のプロセス終了時に共有メモリが解放されないよう、resource_tracker の管理対象から外す
+
+    Parameters
+    ----------
+    shm_name : str
+        共有メモリ名
+
+    Returns
+    -------
+    shm : multiprocessing.shared_memory.SharedMemory
+        共有メモリ
+    """
+    try:
+        shm = shared_memory.SharedMemory(name=shm_name, track=False) # Python 3.13 以降
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+    return shm
+
+def iter_shared_videos(manifest_path, consumer):
+    """共有メモリのフレームデータを動画ごとに返すジェネレータ
+
+    次の動画に進む時点で、前の動画の処理を終えたものとして受領ファイルに追記する
+    返すフレームデータは共有メモリのビュー（コピーなし）であり、次の動画に進むと参照できなくなる
+
+    Parameters
+    ----------
+    manifest_path : str
+        マニフェストのファイルパス
+
+    consumer : str
+        参照側の名前（[CONSUMERS] のいずれか）
+
+    Yields
+    -------
+    tuple
+        (video_id, cut_point, frames)  frames : numpy.ndarray (フレーム数, 高さ, 幅, 3)、RGB
+    """
+    ack_path = get_ack_path(manifest_path, consumer)
+
+    for entry in follow_manifest(manifest_path):
+        shm = attach_shared_memory(entry['shm_name'])
+        frames = np.ndarray(tuple(entry['shape']), dtype=np.dtype(entry['dtype']), buffer=shm.buf)
+
+        yield entry['video_id'], entry['cut_point'], frames
+
+        del frames
+        try:
+            shm.close()
+        except BufferError:
+            # 呼び出し側がビューを保持している場合は、参照が無くなった時点で解放される
+            pass
+
+        # 受領ファイルに追記（公開側が共有メモリを解放する）
+        with open(ack_path, 'a', encoding='utf-8') as f:
+            f.write(entry['video_id'] + '\n')
+
+def split_cuts(frames, cut_point):
+    """動画のフレームデータをカットごとに返すジェネレータ
+
+    Parameters
+    ----------
+    frames : numpy.ndarray
+        動画のフレームデータ
+
+    cut_point : list
+        カット検出点（フレーム番号）のリスト
+
+    Yields
+    -------
+    tuple
+        (cut_no, cut_frames)
+    """
+    begin = 0   # カット最初のフレーム
+    for i, end in enumerate(cut_point):
+        yield i+1, frames[begin:end+1]
+        begin = end+1
+
+def iter_shared_cuts(manifest_path, consumer):
+    """共有メモリのフレームデータをカットごとに返すジェネレータ
+
+    カットは (動画ID, カット番号) 順に返す（カット画像・カット動画のファイルを読み込む場合と同じ順）
+    返すフレームデータは共有メモリのビュー（コピーなし）であり、次の動画に進むと参照できなくなる
+
+    Parameters
+    ----------
+    manifest_path : str
+        マニフェストのファイルパス
+
+    consumer : str
+        参照側の名前（[CONSUMERS] のいずれか）
+
+    Yields
+    -------
+    tuple
+        (video_id, cut_no, cut_frames)  cut_frames : numpy.ndarray (フレーム数, 高さ, 幅, 3)、RGB
+    """
+    for video_id, cut_point, frames in iter_shared_videos(manifest_path, consumer):
+        for cut_no, cut_frames in split_cuts(frames, cut_point):
+            yield video_id, cut_no, cut_frames
@@ -35,6 +35,9 @@ class Path:
         cut_point_path : str
             カット点データ(.csv)の保存ファイルパス
 
+        video_info_path : str
+            動画情報（FPS など）(.csv)の保存ファイルパス
+
         noun_label_path : str
             ラベル付け結果(物体検出)の保存ファイルパス
 
@@ -44,6 +47,12 @@ class Path:
         label_path : str
             ラベル付け結果の保存ファイルパス
 
+        label_data_dir : str
+            ラベルデータ（ラベル一覧・スクリーニング用の対応表）のフォルダパス
+
+        label_vocab_path : str
+            ラベルの語彙(.json)の保存ファイルパス
+
         scene_dir : str
             シーン(動画)の保存フォルダパス
 
@@ -63,9 +72,12 @@ class Path:
         self.cut_dir = os.path.join(self.root_path, config['PATH']['cut_dir'])
         self.cut_img_dir = os.path.join(self.root_path, config['PATH']['cut_img_dir'])
         self.cut_point_path = os.path.join(self.root_path, config['PATH']['cut_point_path'])
+        self.video_info_path = os.path.join(self.root_path, config['PATH'].get('video_info_path', 'result\\video_info.csv'))
         self.noun_label_path = os.path.join(self.root_path, config['PATH']['noun_label_path'])
         self.verb_label_path = os.path.join(self.root_path, config['PATH']['verb_label_path'])
         self.label_path = os.path.join(self.root_path, config['PATH']['label_path'])
+        self.label_data_dir = os.path.join(self.root_path, config['PATH'].get('label_data_dir', 'data\\Label'))
+        self.label_vocab_path = os.path.join(self.root_path, config['PATH'].get('label_vocab_path', 'result\\label_vocab.json'))
         self.scene_dir = os.path.join(self.root_path, config['PATH']['scene_dir'])
         self.scene_data_path = os.path.join(self.root_path, config['PATH']['scene_data_path'])
         self.favo_dir = os.path.join(self.root_path, config['PATH']['favo_dir'])
@@ -89,6 +101,83 @@ def read_config(ini_file):
         cut_dir = result\\cut
         cut_img_dir = result\\cut_img
         cut_point_path = result\\cut_point.csv
+        ; 動画情報（FPS など）の保存先（省略時は以下の値）
+        video_info_path = result\\video_info.csv
+
+        ; ラベルデータのフォルダ・ラベルの語彙の保存先（省略時は以下の値）
+        label_data_dir = data\\Label
+        label_vocab_path = result\\label_vocab.json
+
+        ; 物体検出の環境
+        [OBJECT_DET_ENV]
+        object_detection_env = [conda環境名]
+        config_file_path = [configファイルのパス]
+        checkpoint_file_path = [checkpointファイルのパス]
+        classes_file_path = [認識クラス一覧ファイルのパス]
+        ; 推論のバックエンド（mmdet または onnx）、onnx の場合はONNXファイルのパスも設定
+        backend = mmdet
+        onnx_file_path = [ONNXファイルのパス]
+        ; 事前構築したモデルのアーティファクトのパス（省略時は config・checkpoint から初期化）
+        artifact_file_path = [アーティファクトのパス]
+        ; 高速モード（off : 無効、on : 縮小スケールで推論し、閾値付近のスコアがある場合のみ元のスケールで再推論、
+        ;             eval : 常に両方のスケールで推論し、ラベルの一致率と速度向上率を報告）※ backend = mmdet の場合のみ
+        fast_mode = off
+        ; 縮小スケールの倍率
+        fast_scale_ratio = 0.5
+        ; 再推論する閾値付近の範囲（|スコア - 閾値| < uncertain_band）
+        uncertain_band = 0.1
+
+        ; 動作認識の環境
+        [ACTION_REC_ENV]
+        action_recognition_env = [conda環境名]
+        config_file_path = [configファイルのパス]
+        checkpoint_file_path = [checkpointファイルのパス]
+        classes_file_path = [認識クラス一覧ファイルのパス]
+        artifact_file_path = [アーティファクトのパス]
+
+        ; 物体検出・動作認識の統合実行の環境（labeling = unified の場合、MMDetection と MMAction2 の両方が必要）
+        [LABELING_ENV]
+        labeling_env = [conda環境名]
+
+        ; パイプラインの動作設定（省略時は既定値）
+        [PIPELINE]
+        ; カット分割から物体検出・動作認識へのフレームの受け渡し方法（file または shared_memory、shared_memory は labeling = separate の場合のみ）
+        frame_handoff = file
+        ; カット（動画）・カット画像をファイルとして保存するか（frame_handoff = shared_memory または labeling = unified の場合のみ省略可）
+        ; labeling = unified の場合はカット画像を使用しないため、保存する場合もカット（動画）のみ保存する
+        save_cut_files = yes
+        ; frame_handoff = file の場合に動作認識が読み込む動画（cut_file : カット動画、source_video : 元動画のカット範囲）
+        clip_source = cut_file
+        ; ラベル付けの実行方法（separate : 物体検出・動作認識を別プロセス、unified : 1プロセスで元動画を1回だけデコード）
+        labeling = separate
+        ; 共有メモリのマニフェストの保存先、同時に公開する動画数の上限（共有メモリの使用量は動画この本数分に収まる）
+        frame_manifest_path = result\\frame_manifest.json
+        shm_max_videos = 2
+        ; シーンの動画の作成（eager : シーン統合時に全シーンを作成、on_demand : 編集リストのみ保存し、要求時に作成）
+        scene_render = eager
+        ; シーン統合の実行方法（batch : ラベル付けの終了後に全動画をまとめて統合、
+        ;                        online : ラベル付けと同時に実行し、全カットのラベルが揃った動画から順にシーンを確定（scene_render = on_demand の場合のみ））
+        scene_integration = batch
+        ; シーンの編集リスト（EDL）の保存先
+        scene_edl_path = result\\scene_edl.csv
+        ; on_demand の場合に作成したシーンの動画のキャッシュフォルダ、合計サイズの上限[MB]
+        scene_cache_dir = result\\scene_cache
+        scene_cache_size_mb = 2048
+        ; 重複CM（同一・派生のCM）を検出し、重複部分のカット分割・ラベル付けを省略するか、検出結果の保存先
+        dedup = no
+        dedup_report_path = result\\duplicate_report.csv
+
+        ; 動作認識のクリップ設定（省略時は Config の設定のまま全カットを推論）
+        [CLIP_POLICY]
+        ; このフレーム数未満のカットを短いカットとする
+        min_cut_frames = 8
+        ; 短いカットの扱い（infer : 推論する、skip : 推論せず空のラベル、merge : 後ろのカットと統合して推論）
+        short_cut = skip
+        ; 1クリップあたりのフレーム数（カット長 / frames_per_clip をクリップ数とする）
+        frames_per_clip = 32
+        ; クリップ数の下限・上限
+        min_clips = 1
+        max_clips = 10
 
         ; ログ設定
         [LOG]
@@ -172,8 +261,11 @@ def get_env_data(env_name):
 
     Returns
     -------
-    logger : logging.Logger
-        ログ設定
+    list
+        環境設定データ
+        OBJECT_DET_ENV : [conda環境名, configファイル, checkpointファイル, 認識クラス一覧ファイル, バックエンド, ONNXファイル, アーティファクト]
+        ACTION_REC_ENV : [conda環境名, configファイル, checkpointファイル, 認識クラス一覧ファイル, アーティファクト]
+        LABELING_ENV : [conda環境名]
     """
     # 設定ファイルの読み込み
     config = read_config(INI_FILE)
@@ -185,8 +277,11 @@ def get_env_data(env_name):
         config_file_path = config[env_name]['config_file_path']             # configファイルのパス
         checkpoint_file_path = config[env_name]['checkpoint_file_path']     # modelデータのパス
         classes_file_path = config[env_name]['classes_file_path']           # 認識クラス一覧のファイルパス
+        backend = config[env_name].get('backend', 'mmdet')                  # 推論のバックエンド（mmdet または onnx）
+        onnx_file_path = config[env_name].get('onnx_file_path', '')         # ONNXファイルのパス（backend = onnx の場合）
+        artifact_file_path = config[env_name].get('artifact_file_path', '') # アーティファクトのパス（省略可）
 
-        return [object_detection_env, config_file_path, checkpoint_file_path, classes_file_path]
+        return [object_detection_env, config_file_path, checkpoint_file_path, classes_file_path, backend, onnx_file_path, artifact_file_path]
     
     # 動作認識用の環境
     elif env_name == 'ACTION_REC_ENV':
@@ -194,9 +289,165 @@ def get_env_data(env_name):
         config_file_path = config[env_name]['config_file_path']             # configファイルのパス
         checkpoint_file_path = config[env_name]['checkpoint_file_path']     # modelデータのパス
         classes_file_path = config[env_name]['classes_file_path']           # 認識クラス一覧のファイルパス
+        artifact_file_path = config[env_name].get('artifact_file_path', '') # アーティファクトのパス（省略可）
+
+        return [action_recognition_env, config_file_path, checkpoint_file_path, classes_file_path, artifact_file_path]
+
+    # 物体検出・動作認識の統合実行用の環境
+    elif env_name == 'LABELING_ENV':
+        labeling_env = config[env_name]['labeling_env']     # conda環境名
 
-        return [action_recognition_env, config_file_path, checkpoint_file_path, classes_file_path]
+        return [labeling_env]
     
     # エラー処理
     else:
-        raise ValueError('指定した環境名はありません。')
\ No newline at end of file
+        raise ValueError('指定した環境名はありません。')
+
+def get_pipeline_setting():
+    """設定ファイルからパイプラインの動作設定を取得する関数
+
+    [PIPELINE] セクションが無い場合や、項目が省略されている場合は既定値を使用する
+
+    Returns
+    -------
+    pipeline_setting : dict
+        パイプラインの動作設定
+        {'frame_handoff': str, 'save_cut_files': bool, 'clip_source': str, 'labeling': str, 'frame_manifest_path': str, 'shm_max_videos': int,
+         'scene_render': str, 'scene_integration': str, 'scene_edl_path': str, 'scene_cache_dir': str, 'scene_cache_size_mb': int,
+         'dedup': bool, 'dedup_report_path': str}
+    """
+    # 設定ファイルの読み込み
+    config = read_config(INI_FILE)
+
+    root_path = config['PATH']['root_path']  # ルートパス
+    section = config['PIPELINE'] if config.has_section('PIPELINE') else {}
+
+    pipeline_setting = {
+        'frame_handoff': section.get('frame_handoff', 'file'),  # フレームの受け渡し方法
+        'save_cut_files': config.getboolean('PIPELINE', 'save_cut_files', fallback=True),    # カット・カット画像の保存有無
+        'clip_source': section.get('clip_source', 'cut_file'),  # 動作認識が読み込む動画
+        'labeling': section.get('labeling', 'separate'),        # ラベル付けの実行方法
+        'frame_manifest_path': os.path.join(root_path, section.get('frame_manifest_path', 'result\\frame_manifest.json')),  # マニフェストの保存先
+        'shm_max_videos': config.getint('PIPELINE', 'shm_max_videos', fallback=2),    # 同時に公開する動画数の上限
+        'scene_render': section.get('scene_render', 'eager'),   # シーンの動画の作成
+        'scene_integration': section.get('scene_integration', 'batch'),   # シーン統合の実行方法
+        'scene_edl_path': os.path.join(root_path, section.get('scene_edl_path', 'result\\scene_edl.csv')),    # 編集リストの保存先
+        'scene_cache_dir': os.path.join(root_path, section.get('scene_cache_dir', 'result\\scene_cache')),    # シーンの動画のキャッシュフォルダ
+        'scene_cache_size_mb': config.getint('PIPELINE', 'scene_cache_size_mb', fallback=2048),             # キャッシュの合計サイズの上限[MB]
+        'dedup': config.getboolean('PIPELINE', 'dedup', fallback=False),    # 重複CMの検出・処理結果の再利用の有無
+        'dedup_report_path': os.path.join(root_path, section.get('dedup_report_path', 'result\\duplicate_report.csv'))  # 重複CMの検出結果の保存先
+    }
+
+    # エラー処理
+    if pipeline_setting['frame_handoff'] not in ('file', 'shared_memory'):
+        raise ValueError('指定したフレームの受け渡し方法はありません。')
+    if pipeline_setting['clip_source'] not in ('cut_file', 'source_video'):
+        raise ValueError('指定した動作認識の入力動画はありません。')
+    if pipeline_setting['labeling'] not in ('separate', 'unified'):
+        raise ValueError('指定したラベル付けの実行方法はありません。')
+    if pipeline_setting['scene_render'] not in ('eager', 'on_demand'):
+        raise ValueError('指定したシーンの動画の作成方法はありません。')
+    if pipeline_setting['scene_integration'] not in ('batch', 'online'):
+        raise ValueError('指定したシーン統合の実行方法はありません。')
+    if pipeline_setting['scene_integration'] == 'online' and pipeline_setting['scene_render'] != 'on_demand':
+        raise ValueError('scene_integration = online の場合は、scene_render = on_demand を指定してください。')
+    if pipeline_setting['frame_handoff'] == 'shared_memory' and pipeline_setting['labeling'] == 'unified':
+        raise ValueError('labeling = unified の場合は元動画から直接読み込むため、frame_handoff = shared_memory は指定できません。')
+    if pipeline_setting['frame_handoff'] == 'file' and pipeline_setting['labeling'] == 'separate' and not pipeline_setting['save_cut_files']:
+        raise ValueError('frame_handoff = file かつ labeling = separate の場合は、カットをファイルとして保存する必要があります。')
+    if (config.has_section('CLIP_POLICY') and pipeline_setting['labeling'] == 'separate' and pipeline_setting['frame_handoff'] == 'file'
+            and pipeline_setting['clip_source'] == 'cut_file'):
+        raise ValueError('[CLIP_POLICY] はカット動画のファイルを読み込む場合は使用できません。clip_source = source_video または frame_handoff = shared_memory を指定してください。')
+
+    return pipeline_setting
+
+def get_clip_policy():
+    """設定ファイルから動作認識のクリップ設定を取得する関数
+
+    Returns
+    -------
+    clip_policy : dict or None
+        動作認識のクリップ設定（[CLIP_POLICY] セクションが無い場合は None）
+        {'min_cut_frames': int, 'short_cut': str, 'frames_per_clip': int, 'min_clips': int, 'max_clips': int}
+    """
+    # 設定ファイルの読み込み
+    config = read_config(INI_FILE)
+
+    if not config.has_section('CLIP_POLICY'):
+        return None
+
+    clip_policy = {
+        'min_cut_frames': config.getint('CLIP_POLICY', 'min_cut_frames', fallback=8),   # 短いカットとするフレーム数
+        'short_cut': config.get('CLIP_POLICY', 'short_cut', fallback='skip'),           # 短いカットの扱い
+        'frames_per_clip': config.getint('CLIP_POLICY', 'frames_per_clip', fallback=32), # 1クリップあたりのフレーム数
+        'min_clips': config.getint('CLIP_POLICY', 'min_clips', fallback=1),             # クリップ数の下限
+        'max_clips': config.getint('CLIP_POLICY', 'max_clips', fallback=10)             # クリップ数の上限
+    }
+
+    # エラー処理
+    if clip_policy['short_cut'] not in ('infer', 'skip', 'merge'):
+        raise ValueError('指定した短いカットの扱いはありません。')
+
+    return clip_policy
+
+def get_fast_detection_setting():
+    """設定ファイルから物体検出の高速モードの設定を取得する関数
+
+    Returns
+    -------
+    fast_setting : dict or None
+        高速モードの設定（fast_mode = off または省略時は None）
+        {'mode': str, 'scale_ratio': float, 'uncertain_band': float}
+    """
+    # 設定ファイルの読み込み
+    config = read_config(INI_FILE)
+
+    mode = config.get('OBJECT_DET_ENV', 'fast_mode', fallback='off')
+
+    # エラー処理
+    if mode not in ('off', 'on', 'eval'):
+        raise ValueError('指定した高速モードはありません。')
+
+    if mode == 'off':
+        return None
+
+    fast_setting = {
+        'mode': mode,   # 高速モード
+        'scale_ratio': config.getfloat('OBJECT_DET_ENV', 'fast_scale_ratio', fallback=0.5),     # 縮小スケールの倍率
+        'uncertain_band': config.getfloat('OBJECT_DET_ENV', 'uncertain_band', fallback=0.1)     # 再推論する閾値付近の範囲
+    }
+
+    return fast_setting
+
+def get_analysis_setting():
+    """設定ファイルから好感度分析のランキングの設定を取得する関数
+
+    Returns
+    -------
+    analysis_setting : dict or None
+        ランキングの設定（[ANALYSIS] セクションが無い場合は None）
+        {'window_size': int, 'sliding_window': int, 'sliding_stride': int}
+        sliding_window が 0 の場合は、スライド窓のランキングを出力しない
+    """
+    # 設定ファイルの読み込み
+    config = read_config(INI_FILE)
+
+    if not config.has_section('ANALYSIS'):
+        return None
+
+    analysis_setting = {
+        'window_size': config.getint('ANALYSIS', 'window_size', fallback=1000),     # 上位・中位・下位のシーン範囲の件数
+        'sliding_window': config.getint('ANALYSIS', 'sliding_window', fallback=0),  # スライド窓のシーン数
+        'sliding_stride': config.getint('ANALYSIS', 'sliding_stride', fallback=0)   # スライド窓をずらすシーン数（0 の場合は窓のシーン数）
+    }
+
+    # エラー処理
+    if analysis_setting['window_size'] <= 0:
+        raise ValueError('window_size には 1 以上を指定してください。')
+    if analysis_setting['sliding_window'] < 0 or analysis_setting['sliding_stride'] < 0:
+        raise ValueError('sliding_window, sliding_stride には 0 以上を指定してください。')
+
+    if analysis_setting['sliding_stride'] == 0:
+        analysis_setting['sliding_stride'] = analysis_setting['sliding_window']
+
+    return analysis_setting
@@ -0,0 +1,245 @@
+"""
+ラベルの語彙（ラベルID）を作成・参照するモジュール
+
+物体検出・動作認識のクラス名（英語）を翻訳・スクリーニングした結果を1回だけ作成し、語彙ファイル(.json)に保存する
+ラベル整形以降の工程（シーン統合・分析）はラベルを整数のラベルIDの配列として扱い、
+ラベル名（日本語）は結果の出力時にのみ語彙から参照する
+
+語彙ファイルの形式
+    {'labels': [ラベル名, ...], 'kinds': ['noun' or 'verb', ...], 'noun': {クラス名: ラベルID}, 'verb': {クラス名: ラベルID}, 'sources': {ファイル名: 更新時刻}}
+    ラベルIDは labels, kinds のインデックス
+
+CSVファイルでは、ラベルIDを半角スペース区切りの文字列として保存する（例 : '0 3 3 12'）
+"""
+import json
+import os
+
+import numpy as np
+from utils.file_io import read_txt, read_csv
+
+# 語彙の作成元ファイル（ラベルデータのフォルダ内）
+SOURCE_FILES = {
+    'noun': ('noun_label(en).txt', 'noun_label(ja).txt', 'noun_screening.csv'),
+    'verb': ('verb_label(en).txt', 'verb_label(ja).txt', 'verb_screening.csv')
+}
+
+def trans_dic_creation(label_list_en, label_list_ja):
+    """ラベルの翻訳辞書を作成する関数
+
+    Parameters
+    ----------
+    label_list_en : list
+        ラベル一覧（英語）
+
+    label_list_ja : list
+        ラベル一覧（日本語）
+
+    Returns
+    -------
+    label_trans_dic : dict
+        ラベルの翻訳辞書 {english : japanese}
+    """
+    label_trans_dic = {}    # ラベルの翻訳辞書 {english : japanese}
+    for en, ja in zip(label_list_en, label_list_ja):
+        label_trans_dic[en] = ja
+
+    return label_trans_dic
+
+def get_source_mtimes(label_data_dir):
+    """語彙の作成元ファイルの更新時刻を返す関数
+
+    Parameters
+    ----------
+    label_data_dir : str
+        ラベルデータのフォルダパス
+
+    Returns
+    -------
+    dict
+        作成元ファイルの更新時刻 {ファイル名: 更新時刻}
+    """
+    return {file_name: os.path.getmtime(os.path.join(label_data_dir, file_name))
+            for file_names in SOURCE_FILES.values() for file_name in file_names}
+
+def build_label_vocab(label_data_dir):
+    """クラス名を翻訳・スクリーニングして、ラベルの語彙を作成する関数
+
+    [スクリーニング]
+        名詞 : 対応表に存在するラベルは変換し、存在しないラベルは翻訳結果のまま使用する
+        動詞 : 対応表に存在するラベルのみ変換して使用し、存在しないラベルは除外する
+
+    Parameters
+    ----------
+    label_data_dir : str
+        ラベルデータのフォルダパス
+
+    Returns
+    -------
+    vocab : dict
+        ラベルの語彙
+    """
+    vocab = {'labels': [], 'kinds': [], 'noun': {}, 'verb': {}, 'sources': get_source_mtimes(label_data_dir)}
+    label_ids = {}  # (種類, ラベル名) ごとのラベルID
+
+    for kind, (en_file, ja_file, screening_file) in SOURCE_FILES.items():
+        # ラベル一覧を読み込み（英語、日本語）
+        label_list_en = read_txt(os.path.join(label_data_dir, en_file))
+        label_list_ja = read_txt(os.path.join(label_data_dir, ja_file))
+
+        # ラベルの翻訳辞書作成
+        label_trans_dic = trans_dic_creation(label_list_en, label_list_ja)
+
+        # スクリーニング用データ
+        trans_table = {data[0]: data[1] for data in read_csv(os.path.join(label_data_dir, screening_file))}
+
+        for label_name_en, label_name_ja in label_trans_dic.items():
+            # スクリーニング
+            if label_name_ja in trans_table:    # 変換辞書に存在すれば
+                label_name_ja = trans_table[label_name_ja]
+            elif kind == 'verb':                # 動詞は変換辞書に存在しなければ除外
+                continue
+
+            # ラベルIDの割り当て（同じラベル名には同じIDを割り当てる）
+            if (kind, label_name_ja) not in label_ids:
+                label_ids[(kind, label_name_ja)] = len(vocab['labels'])
+                vocab['labels'].append(label_name_ja)
+                vocab['kinds'].append(kind)
+
+            vocab[kind][label_name_en] = label_ids[(kind, label_name_ja)]
+
+    return vocab
+
+def get_label_vocab(label_data_dir, vocab_path):
+    """ラベルの語彙を返す関数
+
+    語彙ファイルが存在し、作成元ファイルが更新されていなければ読み込む
+    それ以外の場合は作成して、語彙ファイルに保存する
+
+    Parameters
+    ----------
+    label_data_dir : str
+        ラベルデータのフォルダパス
+
+    vocab_path : str
+        語彙ファイル(.json)のパス
+
+    Returns
+    -------
+    vocab : dict
+        ラベルの語彙
+    """
+    if os.path.exists(vocab_path):
+        vocab = load_label_vocab(vocab_path)
+        if vocab.get('sources') == get_source_mtimes(label_data_dir):
+            return vocab
+
+    vocab = build_label_vocab(label_data_dir)
+
+    with open(vocab_path, 'w', encoding='utf-8') as f:
+        json.dump(vocab, f, ensure_ascii=False)
+
+    return vocab
+
+def load_label_vocab(vocab_path):
+    """語彙ファイルを読み込んで返す関数
+
+    Parameters
+    ----------
+    vocab_path : str
+        語彙ファイル(.json)のパス
+
+    Returns
+    -------
+    dict
+        ラベルの語彙
+    """
+    with open(vocab_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def to_label_ids(labels, vocab, kind):
+    """ラベル付け結果をラベルIDのリストに変換する関数
+
+    スクリーニングで除外されたラベルは含まない
+
+    Parameters
+    ----------
+    labels : list
+        ラベル付け結果 [[クラス名, スコア], ...]
+
+    vocab : dict
+        ラベルの語彙
+
+    kind : str
+        ラベルの種類（'noun' または 'verb'）
+
+    Returns
+    -------
+    list
+        ラベルIDのリスト
+    """
+    label_map = vocab[kind]
+
+    return [label_map[label[0]] for label in labels if label[0] in label_map]
+
+def encode_ids(label_ids):
+    """ラベルIDを CSV 保存用の文字列に変換する関数
+
+    Parameters
+    ----------
+    label_ids : list or numpy.ndarray
+        ラベルIDの配列
+
+    Returns
+    -------
+    str
+        半角スペース区切りのラベルID
+    """
+    return ' '.join(str(label_id) for label_id in label_ids)
+
+def decode_ids(text):
+    """CSV に保存された文字列をラベルIDの配列に変換する関数
+
+    Parameters
+    ----------
+    text : str
+        半角スペース区切りのラベルID
+
+    Returns
+    -------
+    numpy.ndarray
+        ラベルIDの配列（int32）
+    """
+    return np.array(text.split(), dtype=np.int32)
+
+def resolve_labels(label_ids, vocab):
+    """ラベルIDをラベル名に変換する関数
+
+    Parameters
+    ----------
+    label_ids : list or numpy.ndarray
+        ラベルIDの配列
+
+    vocab : dict
+        ラベルの語彙
+
+    Returns
+    -------
+    list
+        ラベル名のリスト
+    """
+    return [vocab['labels'][label_id] for label_id in label_ids]
+
+def get_verb_mask(vocab):
+    """ラベルIDごとに動詞ラベルかどうかを返す関数
+
+    Parameters
+    ----------
+    vocab : dict
+        ラベルの語彙
+
+    Returns
+    -------
+    numpy.ndarray
+        動詞ラベルかどうか（bool、インデックスがラベルID）
+    """
+    return np.array([kind == 'verb' for kind in vocab['kinds']], dtype=bool)
@@ -0,0 +1,218 @@
+"""
+物体検出・動作認識によるラベル付けを1プロセスでまとめて実行するスクリプト
+
+物体検出モデルと動作認識モデルを両方読み込んだまま、元動画ごとに1回だけデコードし、
+各カットの最後のフレーム（カット画像と同じフレーム）を物体検出に、カットのフレームデータを動作認識に渡す
+名詞ラベル・動詞ラベルは元動画ごとにそれぞれの結果格納ファイルへ追記する
+
+MMDetection と MMAction2 の両方がインストールされた環境で実行すること
+"""
+import argparse
+import time
+import os
+import ast
+
+import cv2
+import torch
+from file_io import create_dest_folder, read_txt, read_csv, read_labeled_cuts, open_label_writer
+from init_setting import setup_logger, get_clip_policy, get_fast_detection_setting
+import object_detection_mod
+import action_recognition_mod
+from mmaction.apis import init_recognizer
+from model_artifact_mod import load_artifact
+
+# ログ設定
+logger = setup_logger(__name__)
+
+def detect_while_reading(cut_frames, detection_model, inference, classes, video_id, noun_results, noun_labeled_cuts):
+    """カットのフレームデータを受け渡しながら、各カットの最後のフレームを物体検出するジェネレータ
+
+    動作認識に渡すフレームデータをそのまま物体検出にも使用するため、デコードは1回で済む
+
+    Parameters
+    ----------
+    cut_frames : iterable
+        カットのフレームデータ (cut_no, frames)
+
+    detection_model : torch.nn.Module or dict
+        物体検出モデル
+
+    inference : function
+        物体検出の推論関数
+
+    classes : list
+        物体検出の認識クラス一覧
+
+    video_id : str
+        動画ID
+
+    noun_results : dict
+        物体検出のラベル付け結果の格納先 {cut_no: labels}
+
+    noun_labeled_cuts : set
+        物体検出のラベル付け済みのカットの集合 {(video_id, cut_no), ...}（読み飛ばす）
+
+    Yields
+    -------
+    tuple
+        (cut_no, frames)  受け取ったフレームデータをそのまま返す
+    """
+    for cut_no, frames in cut_frames:
+        if (video_id, cut_no) not in noun_labeled_cuts:
+            if frames is None or len(frames) == 0:
+                noun_results[cut_no] = []
+            else:
+                img = cv2.cvtColor(frames[-1], cv2.COLOR_RGB2BGR)   # カット画像の読み込み結果と揃えるため、BGRにする
+                noun_results[cut_no] = object_detection_mod.labeling_from_results(inference(detection_model, img), classes)
+
+        yield cut_no, frames
+
+def labeling(det_env, rec_env, video_dir, cut_point_path, noun_labeled_cuts=None, verb_labeled_cuts=None, clip_policy=None):
+    """元動画ごとに物体検出・動作認識を行い、名詞ラベル・動詞ラベルを返すジェネレータ
+
+    Parameters
+    ----------
+    det_env : dict
+        物体検出の設定 {'config': str, 'checkpoint': str, 'classes': str, 'backend': str, 'onnx_file': str, 'artifact': str, 'fast_setting': dict}
+
+    rec_env : dict
+        動作認識の設定 {'config': str, 'checkpoint': str, 'classes': str, 'artifact': str}
+
+    video_dir : str
+        元動画が存在するフォルダパス
+
+    cut_point_path : str
+        カット点データ(.csv)のファイルパス
+
+    noun_labeled_cuts : set, default None
+        物体検出のラベル付け済みのカットの集合 {(video_id, cut_no), ...}（読み飛ばす）
+
+    verb_labeled_cuts : set, default None
+        動作認識のラベル付け済みのカットの集合 {(video_id, cut_no), ...}（読み飛ばす）
+
+    clip_policy : dict, default None
+        動作認識のクリップ設定
+
+    Yields
+    -------
+    tuple
+        (noun_label_results, verb_label_results)  1動画分のラベル付け結果のリスト {'video_id': video_id, 'cut_no': cut_no, 'labels': labels}
+    """
+    noun_labeled_cuts = noun_labeled_cuts or set()
+    verb_labeled_cuts = verb_labeled_cuts or set()
+
+    # モデルの初期化（両モデルを読み込んだままにする）
+    det_classes = read_txt(det_env['classes'])
+    detection_model, inference = object_detection_mod.init_detection_model(
+        det_env['config'], det_env['checkpoint'], det_classes, det_env['backend'], det_env['onnx_file'], det_env['artifact'])
+    fast_setting = det_env['fast_setting'] if det_env['backend'] == 'mmdet' else None
+    if fast_setting is not None:
+        inference, fast_stats = object_detection_mod.init_fast_inference(detection_model, det_classes, fast_setting)
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'     # 使用デバイスの設定
+    if rec_env['artifact']:
+        recognition_model = load_artifact(rec_env['artifact'], device=device, kind='recognizer')
+    else:
+        recognition_model = init_recognizer(rec_env['config'], rec_env['checkpoint'], device=device)
+    rec_classes = read_txt(rec_env['classes'])
+
+    # カット点データの読み込み
+    video_id_list, cut_point_list = read_csv(cut_point_path)
+    cut_point_dict = {video_id: ast.literal_eval(cut_point) for video_id, cut_point in zip(video_id_list, cut_point_list)}
+
+    for video_id in sorted(cut_point_dict):
+        video_path = os.path.normpath(os.path.join(video_dir, video_id + action_recognition_mod.VIDEO_EXTENSION))
+        cut_point = cut_point_dict[video_id]
+
+        # 両方ラベル付け済みのカットはフレームデータを取り出さない
+        skip_cut_nos = {cut_no for cut_no in range(1, len(cut_point)+1)
+                        if (video_id, cut_no) in noun_labeled_cuts and (video_id, cut_no) in verb_labeled_cuts}
+
+        # 元動画を1回だけデコードし、物体検出しながら動作認識に渡す
+        noun_results = {}
+        cut_frames = detect_while_reading(
+            action_recognition_mod.read_cut_frames(video_path, cut_point, skip_cut_nos),
+            detection_model, inference, det_classes, video_id, noun_results, noun_labeled_cuts)
+        verb_results = {}
+        for _, cut_no, results in action_recognition_mod.recognize_video_cuts(
+                recognition_model, [(video_id, cut_point, cut_frames)], verb_labeled_cuts, clip_policy):
+            results = [(rec_classes[k[0]], k[1]) for k in results]
+            verb_results[cut_no] = action_recognition_mod.labeling_from_results(results)
+
+        logger.debug(f'{video_id}, 名詞ラベル: {len(noun_results)} カット, 動詞ラベル: {len(verb_results)} カット')
+
+        yield ([{'video_id': video_id, 'cut_no': cut_no, 'labels': noun_results[cut_no]} for cut_no in sorted(noun_results)],
+               [{'video_id': video_id, 'cut_no': cut_no, 'labels': verb_results[cut_no]} for cut_no in sorted(verb_results)])
+
+    if fast_setting is not None:
+        object_detection_mod.report_fast_stats(fast_stats, fast_setting)
+
+def parse_args():
+    """コマンドライン引数を処理して返す関数
+
+    Returns
+    -------
+    args : argparse.ArgumentParser
+        解析されたコマンドライン引数
+    """
+    parser = argparse.ArgumentParser(description='物体検出・動作認識（推論）の統合実行')
+    parser.add_argument('det_config', help='物体検出のConfigファイルのパス')
+    parser.add_argument('det_checkpoints', help='物体検出のcheckpointファイルのパス')
+    parser.add_argument('det_classes', help='物体検出の認識クラス一覧ファイル(.txt)のパス')
+    parser.add_argument('rec_config', help='動作認識のConfigファイルのパス')
+    parser.add_argument('rec_checkpoints', help='動作認識のcheckpointファイルのパス')
+    parser.add_argument('rec_classes', help='動作認識の認識クラス一覧ファイル(.txt)のパス')
+    parser.add_argument('video_dir', help='元動画のフォルダパス')
+    parser.add_argument('cut_point', help='カット点データ(.csv)のパス')
+    parser.add_argument('noun_results_path', help='物体検出の結果格納ファイル(.csv)のパス')
+    parser.add_argument('verb_results_path', help='動作認識の結果格納ファイル(.csv)のパス')
+    parser.add_argument('--backend', choices=['mmdet', 'onnx'], default='mmdet', help='物体検出の推論のバックエンド')
+    parser.add_argument('--onnx-file', help='ONNXファイルのパス（--backend onnx の場合）')
+    parser.add_argument('--det-artifact', help='物体検出の事前構築したモデルのアーティファクトのパス')
+    parser.add_argument('--rec-artifact', help='動作認識の事前構築したモデルのアーティファクトのパス')
+    parser.add_argument('--resume', action='store_true', help='結果格納ファイルを読み込み、ラベル付け済みのカットを読み飛ばして再開する')
+    args = parser.parse_args()
+
+    if args.backend == 'onnx' and args.onnx_file is None:
+        parser.error('--backend onnx の場合は --onnx-file を指定してください。')
+
+    return args
+
+if __name__ == '__main__':
+    start = time.time() # 開始時間
+
+    # コマンドライン引数の取得
+    args = parse_args()
+
+    # ラベル付け結果の保存先フォルダの作成
+    create_dest_folder(os.path.dirname(args.noun_results_path))
+    create_dest_folder(os.path.dirname(args.verb_results_path))
+
+    # 再開する場合はラベル付け済みのカットを取得
+    noun_labeled_cuts = read_labeled_cuts(args.noun_results_path) if args.resume else set()
+    verb_labeled_cuts = read_labeled_cuts(args.verb_results_path) if args.resume else set()
+
+    det_env = {'config': args.det_config, 'checkpoint': args.det_checkpoints, 'classes': args.det_classes,
+               'backend': args.backend, 'onnx_file': args.onnx_file, 'artifact': args.det_artifact,
+               'fast_setting': get_fast_detection_setting()}
+    rec_env = {'config': args.rec_config, 'checkpoint': args.rec_checkpoints, 'classes': args.rec_classes,
+               'artifact': args.rec_artifact}
+
+    # ラベル付け（1動画ごとに両方のCSVファイルへ追記）
+    noun_file, noun_writer = open_label_writer(args.noun_results_path, resume=args.resume)
+    verb_file, verb_writer = open_label_writer(args.verb_results_path, resume=args.resume)
+    try:
+        label_results = labeling(det_env, rec_env, args.video_dir, args.cut_point,
+                                 noun_labeled_cuts, verb_labeled_cuts, get_clip_policy())
+        for noun_label_results, verb_label_results in label_results:
+            noun_writer.writerows(noun_label_results)
+            verb_writer.writerows(verb_label_results)
+            noun_file.flush()
+            verb_file.flush()
+    finally:
+        noun_file.close()
+        verb_file.close()
+
+    # 処理時間の表示
+    elapsed_time = time.time() - start
+    logger.debug('elapsed_time:{0}'.format(elapsed_time) + '[sec]')
@@ -0,0 +1,240 @@
+"""
+物体検出・動作認識モデルの事前構築（コンパイル）を行うスクリプト
+
+Configファイルの解析、モデルの構築、checkpointの読み込みを1回だけ行い、
+推論可能な状態のモデル（前処理設定の Config を含む）をそのまま1ファイル（アーティファクト）に保存する
+推論時はアーティファクトを読み込むだけでモデルを使用できるため、起動時間が短くなる
+
+[使い方]
+    アーティファクトの作成
+        python utils/model_artifact_mod.py compile [detector|recognizer] [config] [checkpoint] [artifact_file]
+    起動時間の比較（Config + checkpoint とアーティファクト）
+        python utils/model_artifact_mod.py benchmark [detector|recognizer] [config] [checkpoint] [artifact_file]
+
+※ MMDetection のモデルは後処理（NMS等）を含むため TorchScript に変換できない
+   そのため、構築済みのモジュールを torch.save で保存する
+   アーティファクトは作成時と同じバージョンの MMDetection / MMAction2 の環境で読み込むこと
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+import torch
+from init_setting import setup_logger
+
+REPEAT = 5  # 起動時間の計測回数
+
+# 起動時間を計測する子プロセスのスクリプト（ライブラリの読み込みからモデルが使用可能になるまでの時間を出力する）
+# 引数 : [モジュールのフォルダ, 起動方法, モデルの種類, Configファイル, checkpointファイル, アーティファクト]
+STARTUP_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+from model_artifact_mod import init_model, load_artifact
+mode, kind, config_file, checkpoint_file, artifact_file = sys.argv[2:]
+if mode == 'config':
+    init_model(kind, config_file, checkpoint_file, device='cpu')
+else:
+    load_artifact(artifact_file, device='cpu', kind=kind)
+print(time.perf_counter() - start)
+'''
+
+# ログ設定
+logger = setup_logger(__name__)
+
+def init_model(kind, config_file, checkpoint_file, device='cpu'):
+    """Configファイルと checkpointファイルからモデルを初期化する関数
+
+    Parameters
+    ----------
+    kind : str
+        モデルの種類（'detector' または 'recognizer'）
+
+    config_file : str
+        Configファイルのパス
+
+    checkpoint_file : str
+        checkpointファイルのパス
+
+    device : str, default 'cpu'
+        使用デバイス
+
+    Returns
+    -------
+    torch.nn.Module
+        推論可能な状態のモデル
+    """
+    if kind == 'detector':
+        from mmdet.apis import init_detector
+        return init_detector(config_file, checkpoint_file, device=device)
+    elif kind == 'recognizer':
+        from mmaction.apis import init_recognizer
+        return init_recognizer(config_file, checkpoint_file, device=device)
+    else:
+        raise ValueError('指定したモデルの種類はありません。')
+
+def compile_artifact(kind, config_file, checkpoint_file, artifact_file):
+    """モデルを構築してアーティファクトとして保存する関数
+
+    Parameters
+    ----------
+    kind : str
+        モデルの種類（'detector' または 'recognizer'）
+
+    config_file : str
+        Configファイルのパス
+
+    checkpoint_file : str
+        checkpointファイルのパス
+
+    artifact_file : str
+        保存するアーティファクトのパス
+    """
+    model = init_model(kind, config_file, checkpoint_file, device='cpu')
+    model.eval()
+
+    torch.save({'kind': kind, 'model': model, 'cfg': model.cfg, 'torch_version': torch.__version__}, artifact_file)
+
+    logger.debug('アーティファクトを保存しました。')
+    logger.debug('保存先 : ' + artifact_file)
+
+def load_artifact(artifact_file, device='cpu', kind=None):
+    """アーティファクトからモデルを読み込む関数
+
+    Parameters
+    ----------
+    artifact_file : str
+        アーティファクトのパス
+
+    device : str, default 'cpu'
+        使用デバイス
+
+    kind : str, default None
+        想定するモデルの種類（指定した場合、アーティファクトの種類と異なれば例外を返す）
+
+    Returns
+    -------
+    model : torch.nn.Module
+        推論可能な状態のモデル（model.cfg に前処理設定の Config を持つ）
+    """
+    try:
+        artifact = torch.load(artifact_file, map_location=device, weights_only=False)
+    except TypeError:
+        # weights_only 引数が無いバージョン
+        artifact = torch.load(artifact_file, map_location=device)
+
+    if kind is not None and artifact['kind'] != kind:
+        raise ValueError(f'アーティファクトのモデルの種類が異なります。（{artifact["kind"]}）')
+
+    model = artifact['model']
+    model.cfg = artifact['cfg']
+    model.to(device)
+    model.eval()
+
+    return model
+
+def measure_startup(mode, kind, config_file, checkpoint_file, artifact_file):
+    """新しいプロセスでモデルを初期化し、起動時間を返す関数
+
+    ライブラリの読み込み・レジストリの登録を含めて計測するため、計測ごとにプロセスを起動する
+
+    Parameters
+    ----------
+    mode : str
+        起動方法（'config' : Config + checkpoint から初期化、'artifact' : アーティファクトを読み込む）
+
+    kind : str
+        モデルの種類（'detector' または 'recognizer'）
+
+    config_file : str
+        Configファイルのパス
+
+    checkpoint_file : str
+        checkpointファイルのパス
+
+    artifact_file : str
+        アーティファクトのパス
+
+    Returns
+    -------
+    float
+        起動時間[sec]
+    """
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, module_dir, mode, kind, config_file, checkpoint_file, artifact_file],
+                            capture_output=True, text=True)
+
+    # エラー処理
+    if result.returncode != 0:
+        raise RuntimeError(f'起動時間の計測に失敗しました。（{mode}）\n{result.stderr}')
+
+    return float(result.stdout.strip().splitlines()[-1])
+
+def benchmark_startup(kind, config_file, checkpoint_file, artifact_file, repeat=REPEAT):
+    """Config + checkpoint からの初期化とアーティファクトの読み込みの起動時間を比較する関数
+
+    各計測は新しいプロセスで行い、計測順による偏りが出ないよう2つの起動方法を交互に計測する
+
+    Parameters
+    ----------
+    kind : str
+        モデルの種類（'detector' または 'recognizer'）
+
+    config_file : str
+        Configファイルのパス
+
+    checkpoint_file : str
+        checkpointファイルのパス
+
+    artifact_file : str
+        アーティファクトのパス
+
+    repeat : int, default REPEAT
+        計測回数
+
+    Returns
+    -------
+    dict
+        起動時間の中央値[sec] {'config': float, 'artifact': float}
+    """
+    elapsed_times = {'config': [], 'artifact': []}
+    for i in range(repeat):
+        modes = ['config', 'artifact'] if i % 2 == 0 else ['artifact', 'config']
+        for mode in modes:
+            elapsed_times[mode].append(measure_startup(mode, kind, config_file, checkpoint_file, artifact_file))
+
+    results = {key: statistics.median(times) for key, times in elapsed_times.items()}
+    logger.debug(f'起動時間（{kind}, {repeat}回の中央値） Config + checkpoint: {results["config"]:.3f}[sec], '
+                 f'アーティファクト: {results["artifact"]:.3f}[sec] ({results["config"] / results["artifact"]:.1f}倍)')
+
+    return results
+
+def parse_args():
+    """コマンドライン引数を処理して返す関数
+
+    Returns
+    -------
+    args : argparse.ArgumentParser
+        解析されたコマンドライン引数
+    """
+    parser = argparse.ArgumentParser(description='モデルのアーティファクトの作成・起動時間の比較')
+    parser.add_argument('command', choices=['compile', 'benchmark'], help='compile : アーティファクトの作成、benchmark : 起動時間の比較')
+    parser.add_argument('kind', choices=['detector', 'recognizer'], help='モデルの種類')
+    parser.add_argument('config', help='Configファイルのパス')
+    parser.add_argument('checkpoints', help='checkpointファイルのパス')
+    parser.add_argument('artifact', help='アーティファクトのパス')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='起動時間の計測回数（benchmark の場合）')
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == '__main__':
+    # コマンドライン引数の取得
+    args = parse_args()
+
+    if args.command == 'compile':
+        compile_artifact(args.kind, args.config, args.checkpoints, args.artifact)
+    else:
+        benchmark_startup(args.kind, args.config, args.checkpoints, args.artifact, args.repeat)
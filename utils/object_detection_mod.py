@@ -2,16 +2,20 @@ import argparse
 import time 
 import glob
 import os
-import re
-import csv
-import operator
-from file_io import create_dest_folder, read_txt, write_csv
-from init_setting import setup_logger
+import copy
+from file_io import create_dest_folder, read_txt, read_labeled_cuts, open_label_writer, get_cut_key
+from init_setting import setup_logger, get_fast_detection_setting
+from frame_share_mod import iter_shared_cuts
 
+import cv2
+import numpy as np
 import torch
 from mmdet.apis import init_detector, inference_detector
+from onnx_detection_mod import init_onnx_detector, inference_onnx_detector
+from model_artifact_mod import load_artifact
 
 LABEL_THRESHOLD = 0.25  # ラベル付け時の閾値
+FLUSH_INTERVAL = 10     # 結果をファイルに書き出す間隔（画像数）
 
 # ログ設定
 logger = setup_logger(__name__)
@@ -34,11 +38,223 @@ def labeling_from_results(results, classes):
     """
     return [[classes[i], y[4]] for i, x in enumerate(results) if len(x) != 0 for _, y in enumerate(x) if y[4] >= LABEL_THRESHOLD]
 
-def object_detection(config_file, checkpoint_file, classes_file, img_dir):
-    """物体検出を行い、ラベル付け結果を返す関数
+def build_scaled_cfg(cfg, scale_ratio):
+    """推論時の入力サイズを縮小した Config を返す関数
+
+    Parameters
+    ----------
+    cfg : mmcv.Config
+        モデルの Config
+
+    scale_ratio : float
+        縮小スケールの倍率
+
+    Returns
+    -------
+    scaled_cfg : mmcv.Config
+        入力サイズを縮小した Config
+    """
+    scaled_cfg = copy.deepcopy(cfg)
+    for step in scaled_cfg.data.test.pipeline:
+        if step['type'] == 'MultiScaleFlipAug':
+            img_scale = step['img_scale']
+            if isinstance(img_scale, list):
+                step['img_scale'] = [(int(w * scale_ratio), int(h * scale_ratio)) for w, h in img_scale]
+            else:
+                step['img_scale'] = (int(img_scale[0] * scale_ratio), int(img_scale[1] * scale_ratio))
+
+    return scaled_cfg
+
+def inference_with_cfg(model, img, cfg):
+    """指定した Config の前処理で物体検出を行う関数
+
+    inference_detector は model.cfg の前処理を使用するため、一時的に差し替えて推論する
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        物体検出モデル
+
+    img : str or numpy.ndarray
+        画像のパス、または画像データ（BGR）
+
+    cfg : mmcv.Config
+        推論に使用する Config
+
+    Returns
+    -------
+    list
+        クラスごとの検出結果のリスト
+    """
+    original_cfg = model.cfg
+    model.cfg = cfg
+    try:
+        return inference_detector(model, img)
+    finally:
+        model.cfg = original_cfg
+
+def is_uncertain(results, uncertain_band):
+    """検出結果に閾値付近のスコアがあるかどうかを返す関数
+
+    Parameters
+    ----------
+    results : list
+        クラスごとの検出結果のリスト
+
+    uncertain_band : float
+        閾値付近とする範囲
+
+    Returns
+    -------
+    bool
+        |スコア - LABEL_THRESHOLD| < uncertain_band となる検出結果があるかどうか
+    """
+    scores = np.concatenate([result[:, 4] for result in results if len(result) != 0] or [np.empty(0)])
+
+    return bool(np.any(np.abs(scores - LABEL_THRESHOLD) < uncertain_band))
+
+def init_fast_inference(model, classes, fast_setting):
+    """縮小スケールで推論し、閾値付近のスコアがある場合のみ元のスケールで再推論する推論関数を返す関数
+
+    [高速モード]
+        on   : 縮小スケールの結果に閾値付近のスコアがある場合のみ、元のスケールで再推論した結果を返す
+        eval : 常に両方のスケールで推論し、元のスケールの結果を返す
+               高速モード（on）の結果とのラベルの一致率、速度向上率を集計する
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        物体検出モデル（MMDetection）
+
+    classes : list
+        認識クラス一覧
+
+    fast_setting : dict
+        高速モードの設定
+
+    Returns
+    -------
+    inference : function
+        推論関数（inference(model, img)）
+
+    stats : dict
+        集計結果 {'images': 画像数, 'reruns': 再推論数, 'agreements': ラベルの一致数,
+                  'fast_time': 高速モードの処理時間, 'full_time': 元のスケールの処理時間}
+    """
+    fast_cfg = build_scaled_cfg(model.cfg, fast_setting['scale_ratio'])
+    stats = {'images': 0, 'reruns': 0, 'agreements': 0, 'fast_time': 0.0, 'full_time': 0.0}
+    is_eval = fast_setting['mode'] == 'eval'
+
+    def inference(model, img):
+        # 画像の読み込みは1回だけにする
+        if isinstance(img, str):
+            img = cv2.imread(img)
+
+        start = time.perf_counter()
+        fast_result = inference_with_cfg(model, img, fast_cfg)
+        fast_time = time.perf_counter() - start
+        needs_rerun = is_uncertain(fast_result, fast_setting['uncertain_band'])
+
+        full_result = None
+        if needs_rerun or is_eval:
+            start = time.perf_counter()
+            full_result = inference_detector(model, img)
+            full_time = time.perf_counter() - start
+            stats['full_time'] += full_time
+            if needs_rerun:
+                fast_time += full_time
+
+        stats['images'] += 1
+        stats['reruns'] += needs_rerun
+        stats['fast_time'] += fast_time
+
+        result = full_result if needs_rerun else fast_result
+        if is_eval:
+            fast_labels = sorted(label for label, _ in labeling_from_results(result, classes))
+            full_labels = sorted(label for label, _ in labeling_from_results(full_result, classes))
+            stats['agreements'] += fast_labels == full_labels
+            return full_result
+
+        return result
+
+    return inference, stats
+
+def report_fast_stats(stats, fast_setting):
+    """高速モードの集計結果をログに出力する関数
+
+    Parameters
+    ----------
+    stats : dict
+        集計結果（[init_fast_inference] の結果）
+
+    fast_setting : dict
+        高速モードの設定
+    """
+    if stats['images'] == 0:
+        return
+
+    logger.debug(f'高速モード : 再推論 {stats["reruns"]} / {stats["images"]} 画像 ({stats["reruns"] / stats["images"]:.1%}), '
+                 f'平均処理時間 {stats["fast_time"] / stats["images"]:.3f}[sec/画像]')
+
+    if fast_setting['mode'] == 'eval':
+        logger.debug(f'高速モードの評価 : ラベルの一致率 {stats["agreements"] / stats["images"]:.1%}, '
+                     f'速度向上率 {stats["full_time"] / stats["fast_time"]:.2f}倍')
+
+def init_detection_model(config_file, checkpoint_file, classes, backend='mmdet', onnx_file=None, artifact_file=None):
+    """バックエンドに応じて物体検出モデルを初期化する関数
+
+    Parameters
+    ----------
+    config_file : str
+        Configファイルのパス
+
+    checkpoint_file : str
+        checkpointファイルのパス
+
+    classes : list
+        認識クラス一覧
+
+    backend : str, default 'mmdet'
+        推論のバックエンド（'mmdet' または 'onnx'）
+
+    onnx_file : str, default None
+        ONNXファイルのパス（backend が 'onnx' の場合に使用）
+
+    artifact_file : str, default None
+        事前構築したモデルのアーティファクトのパス（指定した場合、Configファイル・checkpointファイルの代わりに読み込む）
+
+    Returns
+    -------
+    model : torch.nn.Module or dict
+        物体検出モデル
+
+    inference : function
+        推論関数（inference(model, img) で inference_detector と同じ形式の結果を返す）
+    """
+    if backend == 'onnx':
+        model = init_onnx_detector(onnx_file, config_file, len(classes))
+        inference = inference_onnx_detector
+    elif backend == 'mmdet':
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'     # 使用デバイスの設定
+        if artifact_file:
+            model = load_artifact(artifact_file, device=device, kind='detector')
+        else:
+            model = init_detector(config_file, checkpoint_file, device=device)
+        inference = inference_detector
+    else:
+        raise ValueError('指定したバックエンドはありません。')
+
+    return model, inference
+
+def object_detection(config_file, checkpoint_file, classes_file, img_dir, labeled_cuts=None, backend='mmdet', onnx_file=None, shm_manifest=None,
+                     artifact_file=None, fast_setting=None):
+    """物体検出を行い、ラベル付け結果を1画像ずつ返すジェネレータ
 
     MMDetection のAPIを用いて物体検出を行う
         参考: MMDetection(https://github.com/open-mmlab/mmdetection)
+    backend に 'onnx' を指定した場合は、ONNX形式に出力したモデルを ONNX Runtime（CPU）で推論する
+
+    画像は (動画ID, カット番号) 順に処理するため、結果もその順で返る
 
     Parameters
     ----------
@@ -53,39 +269,70 @@ def object_detection(config_file, checkpoint_file, classes_file, img_dir):
     
     img_dir : str
         画像フォルダのパス
+
+    labeled_cuts : set, default None
+        ラベル付け済みのカットの集合 {(video_id, cut_no), ...}（読み飛ばす）
+
+    backend : str, default 'mmdet'
+        推論のバックエンド（'mmdet' または 'onnx'）
+
+    onnx_file : str, default None
+        ONNXファイルのパス（backend が 'onnx' の場合に使用）
+
+    shm_manifest : str, default None
+        共有メモリのマニフェストのパス（指定した場合、画像フォルダではなく共有メモリから各カットの最後のフレームを読み込む）
+
+    artifact_file : str, default None
+        事前構築したモデルのアーティファクトのパス
+
+    fast_setting : dict, default None
+        高速モードの設定（backend が 'mmdet' の場合に使用、[init_fast_inference] 参照）
    
-    Returns
+    Yields
     -------
-    label_results : list
-        画像ディレクトリ内の全画像のラベル付け結果
+    dict
+        1画像のラベル付け結果 {'video_id': video_id, 'cut_no': cut_no, 'labels': labels}
     """
-    # 使用デバイスの設定
-    device = 'cuda' if torch.cuda.is_available() else 'cpu' 
-
-    # モデルの初期化
-    model = init_detector(config_file, checkpoint_file, device=device)
+    labeled_cuts = labeled_cuts or set()
 
     # 認識クラスの取得
     classes = read_txt(classes_file)
 
-    # 推論する画像パス一覧の取得
-    image_files = glob.glob(os.path.join(img_dir, '**/*'))
+    # モデルの初期化
+    model, inference = init_detection_model(config_file, checkpoint_file, classes, backend, onnx_file, artifact_file)
+
+    # 高速モード（縮小スケールで推論し、閾値付近のみ元のスケールで再推論）
+    if fast_setting is not None and backend == 'mmdet':
+        inference, fast_stats = init_fast_inference(model, classes, fast_setting)
+
+    # 推論する画像の取得（動画ID, カット番号順）
+    if shm_manifest is not None:
+        # 共有メモリ上の各カットの最後のフレーム（カット画像と同じフレーム）
+        cut_images = ((video_id, cut_no, cut_frames[-1]) for video_id, cut_no, cut_frames in iter_shared_cuts(shm_manifest, 'object_detection'))
+    else:
+        image_files = sorted(glob.glob(os.path.join(img_dir, '**/*')), key=get_cut_key)
+        cut_images = (get_cut_key(img_path) + (img_path,) for img_path in image_files)
 
     # 物体検出（推論）
-    label_results = []  # ラベル付け結果
-    for img_path in image_files:
-        result = inference_detector(model, img_path)    # 推論結果
-        labels = labeling_from_results(result, classes) # 付与ラベル
+    for video_id, cut_no, img in cut_images:
+        # ラベル付け済みのカットは読み飛ばす
+        if (video_id, cut_no) in labeled_cuts:
+            continue
+
+        # 共有メモリのフレームはRGBのため、BGRにする（カット画像の読み込み結果と揃える）
+        if not isinstance(img, str):
+            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
 
-        video_id, file_name = img_path.replace('\\', '/').split('/')[-2:]
-        cut_no = int(re.sub(r'\D', '', file_name))
+        result = inference(model, img)                  # 推論結果
+        labels = labeling_from_results(result, classes) # 付与ラベル
         
         logger.debug(f'{video_id}, {cut_no}, {labels}')
     
-        # 結果に辞書型で格納
-        label_results.append({'video_id': video_id, 'cut_no': cut_no, 'labels': labels})
+        # 結果を辞書型で返す
+        yield {'video_id': video_id, 'cut_no': cut_no, 'labels': labels}
 
-    return label_results
+    if fast_setting is not None and backend == 'mmdet':
+        report_fast_stats(fast_stats, fast_setting)
 
 def parse_args():
     """コマンドライン引数を処理して返す関数
@@ -101,8 +348,16 @@ def parse_args():
     parser.add_argument('classes', help='認識クラス一覧ファイル(.txt)のパス')
     parser.add_argument('img_dir', help='画像フォルダのパス')
     parser.add_argument('results_path', help='結果格納ファイル(.csv)のパス')
+    parser.add_argument('--backend', choices=['mmdet', 'onnx'], default='mmdet', help='推論のバックエンド')
+    parser.add_argument('--onnx-file', help='ONNXファイルのパス（--backend onnx の場合）')
+    parser.add_argument('--artifact', help='事前構築したモデルのアーティファクトのパス（指定した場合はConfig・checkpointの代わりに使用）')
+    parser.add_argument('--shm-manifest', help='共有メモリのマニフェスト(.json)のパス（指定した場合は画像フォルダの代わりに使用）')
+    parser.add_argument('--resume', action='store_true', help='結果格納ファイルを読み込み、ラベル付け済みのカットを読み飛ばして再開する')
     args = parser.parse_args()
 
+    if args.backend == 'onnx' and args.onnx_file is None:
+        parser.error('--backend onnx の場合は --onnx-file を指定してください。')
+
     return args
 
 if __name__ == '__main__':
@@ -114,18 +369,25 @@ if __name__ == '__main__':
     # ラベル付け結果の保存先フォルダの作成
     create_dest_folder(os.path.dirname(args.results_path))
 
-    # 物体検出
-    label_results = object_detection(args.config, args.checkpoints, args.classes, args.img_dir)
+    # 再開する場合はラベル付け済みのカットを取得
+    labeled_cuts = read_labeled_cuts(args.results_path) if args.resume else set()
+    if labeled_cuts:
+        logger.debug(f'ラベル付け済みの {len(labeled_cuts)} カットを読み飛ばします。')
 
-    # 結果をソート
-    label_results = sorted(label_results, key=operator.itemgetter('video_id', 'cut_no'))
-    
-    # CSVファイルに保存
-    field_name = ['video_id', 'cut_no', 'labels']
-    with open(args.results_path, 'w', encoding='utf-8', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames = field_name)
-        writer.writeheader()
-        writer.writerows(label_results)
+    # 物体検出（1画像ごとにCSVファイルへ追記）
+    csvfile, writer = open_label_writer(args.results_path, resume=args.resume)
+    try:
+        label_results = object_detection(
+            args.config, args.checkpoints, args.classes, args.img_dir, labeled_cuts, args.backend, args.onnx_file, args.shm_manifest,
+            args.artifact, get_fast_detection_setting())
+        for i, label_result in enumerate(label_results, 1):
+            writer.writerow(label_result)
+
+            # 一定間隔でファイルに書き出す
+            if i % FLUSH_INTERVAL == 0:
+                csvfile.flush()
+    finally:
+        csvfile.close()
 
     # 処理時間の表示
     elapsed_time = time.time() - start
@@ -0,0 +1,318 @@
+"""
+ONNX Runtime（CPU）による物体検出のバックエンド
+
+MMDetection のモデルをONNX形式に出力し、ONNX Runtime で推論する
+推論結果は MMDetection の inference_detector と同じ形式（クラスごとの [x1, y1, x2, y2, score] の配列）で返す
+
+[使い方]
+    ONNX形式への出力
+        python utils/onnx_detection_mod.py export [config] [checkpoint] [onnx_file] [sample_img]
+    MMDetection とのラベル付け結果の比較（パリティチェック）
+        python utils/onnx_detection_mod.py parity [config] [checkpoint] [onnx_file] [classes] [img_dir]
+"""
+import argparse
+import glob
+import os
+import sys
+
+import cv2
+import numpy as np
+from file_io import read_txt, get_cut_key
+from init_setting import setup_logger
+
+SCORE_TOLERANCE = 0.01  # パリティチェック時のスコアの許容誤差
+OPSET_VERSION = 11      # ONNX出力時のopsetバージョン
+
+# ログ設定
+logger = setup_logger(__name__)
+
+def get_test_setting(config_file):
+    """Configファイルから推論時の前処理設定を返す関数
+
+    Parameters
+    ----------
+    config_file : str
+        Configファイルのパス
+
+    Returns
+    -------
+    test_setting : dict
+        前処理設定 {'img_scale': (w, h), 'keep_ratio': bool, 'mean': list, 'std': list, 'to_rgb': bool, 'size_divisor': int}
+    """
+    from mmcv import Config
+
+    cfg = Config.fromfile(config_file)
+
+    test_setting = {'img_scale': None, 'keep_ratio': True, 'mean': [0, 0, 0], 'std': [1, 1, 1], 'to_rgb': True, 'size_divisor': None}
+    for step in cfg.data.test.pipeline:
+        if step['type'] != 'MultiScaleFlipAug':
+            continue
+
+        # 複数スケールの場合は先頭のスケールを使用
+        img_scale = step['img_scale']
+        test_setting['img_scale'] = tuple(img_scale[0] if isinstance(img_scale, list) else img_scale)
+
+        for transform in step['transforms']:
+            if transform['type'] == 'Resize':
+                test_setting['keep_ratio'] = transform.get('keep_ratio', True)
+            elif transform['type'] == 'Normalize':
+                test_setting['mean'] = list(transform['mean'])
+                test_setting['std'] = list(transform['std'])
+                test_setting['to_rgb'] = transform.get('to_rgb', True)
+            elif transform['type'] == 'Pad':
+                test_setting['size_divisor'] = transform.get('size_divisor')
+
+    if test_setting['img_scale'] is None:
+        raise ValueError('Configファイルから推論時の入力サイズを取得できません。')
+
+    return test_setting
+
+def preprocess_image(img, test_setting):
+    """画像を MMDetection の推論時と同じ前処理にかける関数
+
+    Parameters
+    ----------
+    img : numpy.ndarray
+        画像データ（BGR）
+
+    test_setting : dict
+        前処理設定（[get_test_setting] の結果）
+
+    Returns
+    -------
+    input_tensor : numpy.ndarray
+        モデルへの入力 (1, 3, H, W)
+
+    scale_factor : numpy.ndarray
+        リサイズ倍率 [w_scale, h_scale, w_scale, h_scale]
+    """
+    height, width = img.shape[:2]
+    scale_w, scale_h = test_setting['img_scale']
+
+    # リサイズ（mmcv.imrescale / mmcv.imresize と同じ計算）
+    if test_setting['keep_ratio']:
+        ratio = min(max(scale_w, scale_h) / max(height, width), min(scale_w, scale_h) / min(height, width))
+        new_size = (int(width * ratio + 0.5), int(height * ratio + 0.5))
+    else:
+        new_size = (scale_w, scale_h)
+    resized = cv2.resize(img, new_size, interpolation=cv2.INTER_LINEAR)
+    scale_factor = np.array([new_size[0] / width, new_size[1] / height] * 2, dtype=np.float32)
+
+    # 正規化
+    resized = resized.astype(np.float32)
+    if test_setting['to_rgb']:
+        resized = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+    resized = (resized - np.array(test_setting['mean'], dtype=np.float32)) / np.array(test_setting['std'], dtype=np.float32)
+
+    # パディング（右下を0埋め）
+    size_divisor = test_setting['size_divisor']
+    if size_divisor:
+        pad_h = int(np.ceil(resized.shape[0] / size_divisor)) * size_divisor
+        pad_w = int(np.ceil(resized.shape[1] / size_divisor)) * size_divisor
+        padded = np.zeros((pad_h, pad_w, 3), dtype=np.float32)
+        padded[:resized.shape[0], :resized.shape[1]] = resized
+        resized = padded
+
+    input_tensor = np.ascontiguousarray(resized.transpose(2, 0, 1)[np.newaxis])
+
+    return input_tensor, scale_factor
+
+def init_onnx_detector(onnx_file, config_file, num_classes):
+    """ONNX Runtime の推論セッションを作成する関数
+
+    Parameters
+    ----------
+    onnx_file : str
+        ONNXファイルのパス
+
+    config_file : str
+        Configファイルのパス（前処理設定の取得に使用）
+
+    num_classes : int
+        認識クラス数
+
+    Returns
+    -------
+    model : dict
+        推論用のデータ {'session': onnxruntime.InferenceSession, 'test_setting': dict, 'num_classes': int}
+    """
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(onnx_file, providers=['CPUExecutionProvider'])
+
+    return {'session': session, 'test_setting': get_test_setting(config_file), 'num_classes': num_classes}
+
+def inference_onnx_detector(model, img):
+    """ONNX Runtime で物体検出を行い、MMDetection と同じ形式で結果を返す関数
+
+    Parameters
+    ----------
+    model : dict
+        推論用のデータ（[init_onnx_detector] の結果）
+
+    img : str or numpy.ndarray
+        画像のパス、または画像データ（BGR）
+
+    Returns
+    -------
+    results : list
+        クラスごとの検出結果のリスト [numpy.ndarray (N, 5), ...]
+    """
+    if isinstance(img, str):
+        img = cv2.imread(img)
+
+    input_tensor, scale_factor = preprocess_image(img, model['test_setting'])
+
+    session = model['session']
+    input_name = session.get_inputs()[0].name
+    dets, labels = session.run(['dets', 'labels'], {input_name: input_tensor})
+    dets, labels = dets[0], labels[0]
+
+    # 入力画像の座標系に戻す
+    dets[:, :4] /= scale_factor
+
+    return [dets[labels == i] for i in range(model['num_classes'])]
+
+def export_onnx(config_file, checkpoint_file, onnx_file, sample_img):
+    """MMDetection のモデルをONNX形式で出力する関数
+
+    MMDetection の tools/deployment/pytorch2onnx.py と同じ手順で出力する
+
+    Parameters
+    ----------
+    config_file : str
+        Configファイルのパス
+
+    checkpoint_file : str
+        checkpointファイルのパス
+
+    onnx_file : str
+        出力するONNXファイルのパス
+
+    sample_img : str
+        出力時の入力例に使用する画像のパス
+    """
+    from functools import partial
+    import torch
+    from mmdet.core.export import build_model_from_cfg, preprocess_example_input
+
+    test_setting = get_test_setting(config_file)
+    input_config = {
+        'input_shape': (1, 3, test_setting['img_scale'][1], test_setting['img_scale'][0]),
+        'input_path': sample_img,
+        'normalize_cfg': {'mean': test_setting['mean'], 'std': test_setting['std']}
+    }
+
+    model = build_model_from_cfg(config_file, checkpoint_file)
+    one_img, one_meta = preprocess_example_input(input_config)
+
+    # 推論用の forward に置き換えて出力
+    model.forward = partial(model.forward, img_metas=[[one_meta]], return_loss=False, rescale=False)
+    dynamic_axes = {
+        'input': {0: 'batch', 2: 'height', 3: 'width'},
+        'dets': {0: 'batch', 1: 'num_dets'},
+        'labels': {0: 'batch', 1: 'num_dets'}
+    }
+    torch.onnx.export(
+        model, [one_img], onnx_file, input_names=['input'], output_names=['dets', 'labels'],
+        export_params=True, keep_initializers_as_inputs=True, do_constant_folding=True,
+        opset_version=OPSET_VERSION, dynamic_axes=dynamic_axes)
+
+    logger.debug('ONNXファイルを出力しました。')
+    logger.debug('出力先 : ' + onnx_file)
+
+def check_parity(config_file, checkpoint_file, onnx_file, classes_file, img_dir, score_tolerance=SCORE_TOLERANCE):
+    """MMDetection と ONNX Runtime のラベル付け結果が一致するかを確認する関数
+
+    [labeling_from_results] で付与されるラベルが一致し、
+    各ラベルのスコアの差が許容誤差以内のとき一致とみなす
+
+    Parameters
+    ----------
+    config_file : str
+        Configファイルのパス
+
+    checkpoint_file : str
+        checkpointファイルのパス
+
+    onnx_file : str
+        ONNXファイルのパス
+
+    classes_file : str
+        認識クラス一覧ファイル(.txt)のパス
+
+    img_dir : str
+        画像フォルダのパス
+
+    score_tolerance : float, default SCORE_TOLERANCE
+        スコアの許容誤差
+
+    Returns
+    -------
+    bool
+        全画像でラベル付け結果が一致したかどうか
+    """
+    from mmdet.apis import init_detector, inference_detector
+    from object_detection_mod import labeling_from_results
+
+    classes = read_txt(classes_file)
+    torch_model = init_detector(config_file, checkpoint_file, device='cpu')
+    onnx_model = init_onnx_detector(onnx_file, config_file, len(classes))
+
+    image_files = sorted(glob.glob(os.path.join(img_dir, '**/*')), key=get_cut_key)
+
+    mismatch_cnt = 0    # 不一致の画像数
+    for img_path in image_files:
+        torch_labels = sorted(labeling_from_results(inference_detector(torch_model, img_path), classes))
+        onnx_labels = sorted(labeling_from_results(inference_onnx_detector(onnx_model, img_path), classes))
+
+        # ラベル名が一致 かつ スコアの差が許容誤差以内
+        is_same = len(torch_labels) == len(onnx_labels) and all(
+            t[0] == o[0] and abs(t[1] - o[1]) <= score_tolerance for t, o in zip(torch_labels, onnx_labels))
+
+        if not is_same:
+            mismatch_cnt += 1
+            logger.debug(f'不一致 : {img_path}, MMDetection: {torch_labels}, ONNX Runtime: {onnx_labels}')
+
+    logger.debug(f'パリティチェック : {len(image_files) - mismatch_cnt} / {len(image_files)} 画像が一致しました。')
+
+    return mismatch_cnt == 0
+
+def parse_args():
+    """コマンドライン引数を処理して返す関数
+
+    Returns
+    -------
+    args : argparse.ArgumentParser
+        解析されたコマンドライン引数
+    """
+    parser = argparse.ArgumentParser(description='物体検出モデルのONNX出力・パリティチェック')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='ONNX形式で出力する')
+    export_parser.add_argument('config', help='Configファイルのパス')
+    export_parser.add_argument('checkpoints', help='checkpointファイルのパス')
+    export_parser.add_argument('onnx_file', help='出力するONNXファイルのパス')
+    export_parser.add_argument('sample_img', help='入力例に使用する画像のパス')
+
+    parity_parser = subparsers.add_parser('parity', help='MMDetection とラベル付け結果を比較する')
+    parity_parser.add_argument('config', help='Configファイルのパス')
+    parity_parser.add_argument('checkpoints', help='checkpointファイルのパス')
+    parity_parser.add_argument('onnx_file', help='ONNXファイルのパス')
+    parity_parser.add_argument('classes', help='認識クラス一覧ファイル(.txt)のパス')
+    parity_parser.add_argument('img_dir', help='画像フォルダのパス')
+    parity_parser.add_argument('--score-tolerance', type=float, default=SCORE_TOLERANCE, help='スコアの許容誤差')
+
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == '__main__':
+    # コマンドライン引数の取得
+    args = parse_args()
+
+    if args.command == 'export':
+        export_onnx(args.config, args.checkpoints, args.onnx_file, args.sample_img)
+    else:
+        is_same = check_parity(args.config, args.checkpoints, args.onnx_file, args.classes, args.img_dir, args.score_tolerance)
+        sys.exit(0 if is_same else 1)
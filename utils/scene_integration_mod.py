@@ -1,96 +1,86 @@
-﻿import os
+﻿import argparse
+import os
 import ast
+import shutil
+import time
+import csv
+import threading
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy.sparse import csr_matrix
 import cv2
-from utils.init_setting import setup_logger
-from utils.file_io import read_csv, write_csv, create_dest_folder
-from utils.cut_segmentation_mod import read_video_data
+from utils.init_setting import Path, setup_logger, get_pipeline_setting
+from utils.file_io import read_csv, iter_csv, write_csv, append_csv, create_dest_folder
+from utils.label_vocab_mod import encode_ids, decode_ids, to_label_ids, get_label_vocab
+from utils.scene_render_mod import probe_stream, concat_cut_clips, create_edl, write_edl, EDL_HEADER
 
 INTEGRATION_THRESHOLD = 0.93    # シーンにする際の閾値
 EXTENSION = '.mp4'              # 保存するシーンの拡張子（MP4）
+MAX_TASKS_PER_CHILD = 10        # シーン保存のワーカーを作り直すまでのタスク数
+POLL_INTERVAL = 1.0             # 逐次シーン統合でラベルデータの追記を確認する間隔[sec]
 
 # ログ設定
 logger = setup_logger(__name__)
 
-def two_doc_2_vec(documents):
-    """２つの文書をベクトル化する関数
+def build_label_matrix(label_ids_list):
+    """ラベルIDの配列のリストから、ラベルの出現回数の疎行列を作成する関数
 
     Parameters
     ----------
-    documents : list
-        ２つ文書のリスト
+    label_ids_list : list
+        カットごとのラベルIDの配列のリスト
 
     Returns
     -------
-    numpy.ndarray
-        ２つの文書のベクトル
+    scipy.sparse.csr_matrix
+        ラベルの出現回数の行列（カット数 × ラベル数）
     """
-    np.set_printoptions(precision=2)
-    docs = np.array(documents)
-    vectorizer = TfidfVectorizer(use_idf=False, token_pattern=u'(?u)\\b\\w+\\b')
-    vecs = vectorizer.fit_transform(docs)
+    lengths = np.array([len(label_ids) for label_ids in label_ids_list], dtype=np.int64)
+    indptr = np.concatenate([[0], np.cumsum(lengths)])
+    indices = np.concatenate(label_ids_list) if len(label_ids_list) != 0 else np.empty(0, dtype=np.int32)
+    num_labels = int(indices.max()) + 1 if len(indices) != 0 else 0
 
-    return vecs.toarray()
+    # 同じラベルの重複は足し合わせて出現回数にする
+    label_matrix = csr_matrix((np.ones(len(indices), dtype=np.float64), indices, indptr), shape=(len(label_ids_list), num_labels))
+    label_matrix.sum_duplicates()
 
-def calc_similarity(list_1, list_2):
-    """２つのリストの類似度を算出する関数
+    return label_matrix
+
+def calc_adjacent_similarity(cut_data):
+    """隣接するカット同士のラベルの類似度（コサイン類似度）をまとめて算出する関数
+
+    類似度は小数第3位で丸める
+    動画IDが異なる場合、どちらかのラベルが無い場合は統合しないため、類似度を 0 とする
 
     Parameters
     ----------
-    list_1 : list
-        １つめのリスト
-
-    list_2 : list
-        ２つめのリスト
+    cut_data : list
+        カットデータ
 
     Returns
     -------
-    similarity : numpy.float64
-        ２つのリストの類似度
+    similarities : numpy.ndarray
+        類似度の配列（i 番目は i 番目のカットと i+1 番目のカットの類似度）
     """
-    docs = [' '.join(list_1), ' '.join(list_2)] # ２つの文書にする
-    cs_array = np.round(cosine_similarity(two_doc_2_vec(docs), two_doc_2_vec(docs)), 3) # ２つの文書から類似行列を算出
-    similarity = cs_array[0][1] # 類似行列から類似度を抽出
+    if len(cut_data) < 2:
+        return np.empty(0, dtype=np.float64)
 
-    return similarity
+    label_matrix = build_label_matrix([data[4] for data in cut_data])
 
-def judge_whether_integrate(id, next_id, labels, next_labels):
-    """ラベル同士の類似度から、統合するかどうかを判定する関数
+    # 行ごとの内積とノルムからコサイン類似度を算出
+    dots = np.asarray(label_matrix[:-1].multiply(label_matrix[1:]).sum(axis=1)).ravel()
+    norms = np.sqrt(np.asarray(label_matrix.multiply(label_matrix).sum(axis=1)).ravel())
+    denominators = norms[:-1] * norms[1:]
 
-    Parameters
-    ----------
-    id : str
-        判定用のID
+    # 同じ動画 かつ 両方のラベルデータが存在する場合のみ算出
+    video_ids = np.array([data[0] for data in cut_data])
+    is_comparable = (video_ids[:-1] == video_ids[1:]) & (denominators > 0)
 
-    next_id : str
-        次データのID
+    similarities = np.zeros(len(cut_data)-1, dtype=np.float64)
+    similarities[is_comparable] = np.round(dots[is_comparable] / denominators[is_comparable], 3)
 
-    labels : list
-        ラベルのリスト
-    
-    next_labels : lsit
-        次データのラベルリスト
-
-    Returns
-    -------
-    bool
-        比較結果（統合するかどうか）
-    """
-    # 両方のラベルデータが存在する場合
-    if labels and next_labels:  
-        # 両ラベルの類似度算出
-        similarity = calc_similarity(labels, next_labels)
-
-        # 類似度が閾値以上の場合
-        if similarity >= INTEGRATION_THRESHOLD and id == next_id:
-            return True
-        else:
-            return False
-    else:
-        return False
+    return similarities
 
 def create_cut_data(labels, cut_point_dict):
     """ラベルデータとカット点データからカットデータを作成する関数
@@ -106,7 +96,7 @@ def create_cut_data(labels, cut_point_dict):
     Returns
     -------
     cut_data : list
-        カットデータ    ['動画ID', 'カット番号', 'スタートフレーム', 'エンドフレーム', '[ラベルのリスト]']
+        カットデータ    ['動画ID', 'カット番号', 'スタートフレーム', 'エンドフレーム', 'ラベルIDの配列']
     """
     cut_data = []   # カットデータ
     for data in labels:
@@ -126,162 +116,716 @@ def create_cut_data(labels, cut_point_dict):
 
     return cut_data
 
-def create_scene_data(cut_data):
-    """カットデータからシーンデータを作成する関数
+def create_scene_data(cut_data, similarities, threshold=INTEGRATION_THRESHOLD):
+    """カットデータからシーンデータとシーン分割点を作成する関数
+
+    同じ動画内で、類似度が閾値以上の隣接カットが連続する区間（3カット以上の連続も含む）を1つのシーンに統合する
+    シーンのラベルは、シーン内の最後のカットのラベルとする
 
     Parameters
     ----------
     cut_data : list
         カットデータ
 
+    similarities : numpy.ndarray
+        隣接するカット同士の類似度（[calc_adjacent_similarity] の結果）
+
+    threshold : float, default INTEGRATION_THRESHOLD
+        シーンにする際の閾値
+
     Returns
     -------
     scene_data : list
-        シーンデータ    ['動画ID', 'シーン番号', 'スタートフレーム', 'エンドフレーム', '[ラベルのリスト]']
+        シーンデータ    ['動画ID', 'シーン番号', 'スタートフレーム', 'エンドフレーム', 'ラベルIDの配列']
+
+    scene_point_dic : dict
+        シーン分割点の辞書　{動画ID: エンドフレームの配列}
     """
-    scene_data = [] # シーンデータ 
-    for data, next_data in zip(cut_data, cut_data[1:]):
-        video_id = data[0]              # 動画ID
-        next_video_id = next_data[0]    # 次データの動画ID
-        cut_no = data[1]                # カット番号
-        cut_range = (data[2], data[3])  # カット範囲
-        label = [labels[0] if isinstance(labels, list) else labels for labels in data[4]]           # ラベル
-        next_label = [labels[0] if isinstance(labels, list) else labels for labels in next_data[4]] # 次データのラベル
-
-        # ラベルの類似度から統合するかを判定
-        isintegrate = judge_whether_integrate(video_id, next_video_id, label, next_label)
-        
-        if isintegrate:
-            results_label = next_label
-            cut_range = (data[2], next_data[3])  # カット範囲統合
-        else:
-            results_label = label
-                
-        # ラベルデータに追加
-        scene_data.append([video_id, cut_no, cut_range[0], cut_range[1], results_label])
-
-    # 最後のデータ追加
-    cut_data[-1][4] = list(map(lambda x: x[0] if isinstance(x, list) else x, cut_data[-1][4]))
-    scene_data.append(cut_data[-1])
-    
-    # 統合による削除対象
-    remove_target = [n for p, n in zip(scene_data, scene_data[1:]) if p[0] == n[0] and int(p[3]) >= int(n[2])]
-    for rt in remove_target:
-        scene_data.remove(rt)
-
-    # シーン番号の整理（削除により欠けている部分を修正）
-    scene_no_list = []
-    for i in range(len(scene_data)):
-        # 最初のインデックスの場合
-        if i == 0:
-            scene_no = 1
-        else:
-            # 前データのidと同じ場合
-            if scene_data[i][0] == scene_data[i-1][0]:
-                scene_no += 1
-            else:
-                scene_no = 1
+    if len(cut_data) == 0:
+        return [], {}
 
-        scene_no_list.append(scene_no)
-    
-    for data, scene_no in zip(scene_data, scene_no_list):
-        data[1] = scene_no
+    # シーンの区切り（動画IDが異なる、または類似度が閾値未満）
+    video_ids = np.array([data[0] for data in cut_data])
+    is_boundary = (video_ids[:-1] != video_ids[1:]) | (np.asarray(similarities) < threshold)
+    scene_ends = np.append(np.flatnonzero(is_boundary), len(cut_data)-1)  # 各シーンの最後のカット
+    scene_starts = np.insert(scene_ends[:-1] + 1, 0, 0)                     # 各シーンの最初のカット
+
+    scene_data = [] # シーンデータ
+    scene_point_dic = {}    # シーン分割点の辞書
+    for start, end in zip(scene_starts, scene_ends):
+        video_id = cut_data[start][0]   # 動画ID
+
+        # シーン番号（動画ごとに1から）
+        end_frames = scene_point_dic.setdefault(video_id, [])
+        end_frames.append(int(cut_data[end][3]))
+
+        scene_data.append([video_id, len(end_frames), cut_data[start][2], cut_data[end][3], cut_data[end][4]])
 
-    return scene_data
+    scene_point_dic = {video_id: np.array(end_frames, dtype=np.int64) for video_id, end_frames in scene_point_dic.items()}
 
-def calc_scene_point(scene_data):
-    """シーン分割点を計算する関数
+    return scene_data, scene_point_dic
+
+def render_video_scenes(video_id, scene_point, video_dir, scene_dir):
+    """1動画分のシーンを動画として保存する関数（プロセスプールの1タスク）
+
+    フレームデータは1フレームずつ読み込んで書き出すため、メモリ使用量は動画の長さに依存しない
 
     Parameters
     ----------
-    scene_data : list
-        シーンデータ
+    video_id : str
+        動画ID
+
+    scene_point : numpy.ndarray
+        シーン分割点（エンドフレームの配列）
+
+    video_dir : str
+        動画データが存在するフォルダパス
+
+    scene_dir : str
+        シーン分割結果（動画）を保存するフォルダパス
 
     Returns
     -------
-    scene_point_dic : dict
-        シーン分割点の辞書　{動画ID: エンドフレームのリスト}
+    tuple
+        (dest_path, 'encode')  保存先フォルダのパス
     """
-    current_id = scene_data[0][0]   # 現在の動画ID
-    scene_point_dic = {}            # シーン分割点の辞書
-    end_frames = []                 # エンドフレームのリスト
-    for data in scene_data:
-        video_id = data[0]  # 動画IDID
-        end = int(data[3])  # エンドフレーム
-
-        if current_id != video_id:
-            scene_point_dic[current_id] = end_frames
-            current_id = video_id
-            end_frames = []
-        
-        end_frames.append(end)
+    input_video_path = os.path.normpath(os.path.join(video_dir, video_id + EXTENSION)) # 動画ファイルの入力パス
+
+    # 保存先フォルダの作成
+    dest_path = os.path.join(scene_dir, video_id) # 各動画のシーン分割結果の保存先
+    create_dest_folder(dest_path)
+
+    cap = cv2.VideoCapture(input_video_path)
+    writer = None   # 書き込み中のシーンのライター
+    try:
+        # ビデオキャプチャーが開けていない場合、例外を返す
+        if cap.isOpened() is False:
+            raise ValueError('読み込みエラー : 動画ID ' + input_video_path + 'が上手く読み取れません。')
+
+        fps = cap.get(cv2.CAP_PROP_FPS)                         # FPS
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))          # 幅
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))        # 高さ
+        fourcc = 0x00000021    # 動画の保存形式(H264形式でエンコード)
 
-        if scene_data.index(data) == len(scene_data)-1:
-            scene_point_dic[current_id] = end_frames
-    
-    return scene_point_dic   
+        frame_no = 0    # 読み込み中のフレーム番号
+        for i, end in enumerate(scene_point):
+            save_scene_path = os.path.normpath(os.path.join(dest_path, 'scene' + str(i+1) + EXTENSION))    # 保存先
+            writer = cv2.VideoWriter(save_scene_path, fourcc, fps, (width, height))
+            while frame_no <= end:
+                ret, frame = cap.read()    # BGRのまま書き出す
+                if not ret:
+                    raise ValueError(f'読み込みエラー : 動画ID {video_id} のフレーム {frame_no} が読み取れません。')
+                writer.write(frame)
+                frame_no += 1
+            writer.release()
+            writer = None
+    finally:
+        if writer is not None:
+            writer.release()
+        cap.release()
+
+    return dest_path, 'encode'
+
+def render_video_scenes_from_cuts(video_id, scene_point, cut_point, cut_dir, video_dir, scene_dir):
+    """1動画分のシーンを、カット動画の連結で保存する関数（プロセスプールの1タスク）
+
+    シーンはカットの連続であるため、カット分割で保存済みのカット動画（cutN.mp4）を再エンコードせずに連結する
+    カット動画が無い、形式が揃っていない、ffmpeg が無い場合は、元動画から再エンコードして保存する
 
-def save_scene(video_id_list, scene_point_dic, video_dir, scene_dir):
+    Parameters
+    ----------
+    video_id : str
+        動画ID
+
+    scene_point : numpy.ndarray
+        シーン分割点（エンドフレームの配列）
+
+    cut_point : list
+        カット検出点（エンドフレームのリスト）
+
+    cut_dir : str
+        カット分割結果（動画）が存在するフォルダパス
+
+    video_dir : str
+        動画データが存在するフォルダパス
+
+    scene_dir : str
+        シーン分割結果（動画）を保存するフォルダパス
+
+    Returns
+    -------
+    tuple
+        (dest_path, mode)  mode : 'copy'（連結）または 'encode'（再エンコード）
+    """
+    cut_point = np.asarray(cut_point)
+    cut_paths = [os.path.normpath(os.path.join(cut_dir, video_id, 'cut' + str(i+1) + EXTENSION)) for i in range(len(cut_point))]
+
+    # シーンの最後のカット（シーン分割点はいずれかのカットのエンドフレーム）
+    last_cut_indices = np.searchsorted(cut_point, scene_point)
+    can_copy = (shutil.which('ffmpeg') is not None
+                and np.all(last_cut_indices < len(cut_point))
+                and np.array_equal(cut_point[np.minimum(last_cut_indices, len(cut_point)-1)], scene_point)
+                and all(os.path.exists(cut_path) for cut_path in cut_paths))
+
+    # 全カット動画の形式が揃っているか（ffprobe がある場合のみ確認）
+    if can_copy and shutil.which('ffprobe') is not None:
+        can_copy = len({probe_stream(cut_path) for cut_path in cut_paths} - {None}) == 1
+
+    if can_copy:
+        dest_path = os.path.join(scene_dir, video_id) # 各動画のシーン分割結果の保存先
+        create_dest_folder(dest_path)
+
+        first_cut = 0   # シーンの最初のカット
+        for i, last_cut in enumerate(last_cut_indices):
+            save_scene_path = os.path.normpath(os.path.join(dest_path, 'scene' + str(i+1) + EXTENSION))    # 保存先
+            if not concat_cut_clips(cut_paths[first_cut:last_cut+1], save_scene_path):
+                break
+            first_cut = last_cut + 1
+        else:
+            return dest_path, 'copy'
+
+    # 連結できない場合は再エンコード
+    return render_video_scenes(video_id, scene_point, video_dir, scene_dir)
+
+def save_scene(video_id_list, scene_point_dic, video_dir, scene_dir, max_workers=None, cut_point_dict=None, cut_dir=None):
     """動画を分割して保存する関数
 
+    動画ごとにプロセスプールで並列に保存する
+    一部の動画の保存に失敗しても、他の動画の保存は続行する
+    カット分割結果（動画）がある場合は、カット動画を再エンコードせずに連結して保存する
+
     Parameters
     ----------
     video_id_list : list
         動画IDのリスト
 
     scene_point_dic : dict
-        シーン分割点（フレーム番号）の辞書 {動画ID: エンドフレームのリスト}
+        シーン分割点（フレーム番号）の辞書 {動画ID: エンドフレームの配列}
     
     video_dir : str
         動画データが存在するフォルダパス
 
     scene_dir : str
         シーン分割結果（動画）を保存するフォルダパス
+
+    max_workers : int, default None
+        並列数（省略時は CPU コア数）
+
+    cut_point_dict : dict, default None
+        カット点データの辞書 {動画ID: カット検出点のリスト}（カット動画を連結する場合）
+
+    cut_dir : str, default None
+        カット分割結果（動画）が存在するフォルダパス（カット動画を連結する場合）
+
+    Returns
+    -------
+    failed_video_ids : list
+        保存に失敗した動画IDのリスト
     """
     # シーン保存先のフォルダを作成
     create_dest_folder(scene_dir)
 
+    failed_video_ids = []   # 保存に失敗した動画ID
+
     # シーン保存
-    for video_id in video_id_list:
-        file_name = video_id + EXTENSION    # ファイル名.拡張子
-        input_video_path = os.path.normpath(os.path.join(video_dir, file_name)) # 動画ファイルの入力パス
-        scene_point = scene_point_dic[video_id] # シーンの分割点
+    try:
+        # ワーカーを一定数のタスクごとに作り直して、メモリ使用量の増加を抑える（Python 3.11 以降）
+        executor = ProcessPoolExecutor(max_workers=max_workers, max_tasks_per_child=MAX_TASKS_PER_CHILD)
+    except TypeError:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    with executor:
+        futures = {}
+        for video_id in video_id_list:
+            # ラベルデータが無い動画はシーンが無い
+            if video_id not in scene_point_dic:
+                logger.debug(video_id + ' : シーンデータが無いため、保存しません。')
+                continue
+
+            if cut_dir is not None and video_id in cut_point_dict:
+                future = executor.submit(render_video_scenes_from_cuts, video_id, scene_point_dic[video_id],
+                                         cut_point_dict[video_id], cut_dir, video_dir, scene_dir)
+            else:
+                future = executor.submit(render_video_scenes, video_id, scene_point_dic[video_id], video_dir, scene_dir)
+            futures[future] = video_id
 
-        # 保存先フォルダの作成
-        dest_path = os.path.join(scene_dir, video_id) # 各動画のカット分割結果の保存先
-        create_dest_folder(dest_path)
-        
-        # 動画の読み込み、フレームデータと動画情報を抽出
-        frames, video_info = read_video_data(input_video_path)
+        for future in as_completed(futures):
+            video_id = futures[future]
+            try:
+                dest_path, mode = future.result()
+            except Exception as e:
+                failed_video_ids.append(video_id)
+                logger.debug(f'{video_id} のシーンの保存に失敗しました。（{e}）')
+                continue
 
-        fps, width, height = video_info # 動画情報（fps, 幅、）
-        fourcc = 0x00000021    # 動画の保存形式(H264形式でエンコード)
-        writer = [] # 書き込み用のリスト
-        begin = 0   # シーン最初のフレーム
+            logger.debug(video_id + '_scene1 ～ ' + str(len(scene_point_dic[video_id])) + 'を保存しました' + ('（カット動画を連結）' if mode == 'copy' else ''))
+            logger.debug('保存先 : ' + dest_path)
+            logger.debug('-' * 90)
 
-        frames = [cv2.cvtColor(frame, cv2.COLOR_RGB2BGR) for frame in frames]   # RGBからBGRに戻す（戻さないと色が反転したまま保存される）
+    return failed_video_ids
 
-        scene_count = len(scene_point) # シーン数
-        for i in range(scene_count):
-            save_scene_path = os.path.normpath(os.path.join(dest_path, 'scene' + str(i+1) + EXTENSION))    # 保存先
-            writer.append(cv2.VideoWriter(save_scene_path, fourcc, fps, (int(width), int(height))))
-            for j in range(begin, scene_point[i]+1):
-                writer[i].write(frames[j])
-            begin = scene_point[i]+1
+def load_cut_data(cut_point_path, label_path):
+    """カット点データとラベルデータを読み込んで、カットデータを作成する関数
+
+    Parameters
+    ----------
+    cut_point_path : str
+        カット分割結果（カット点）のファイルパス（.csv）
 
-        logger.debug(video_id + '_scene1 ～ ' + str(scene_count) + 'を保存しました')
-        logger.debug('保存先 : ' + dest_path)
-        logger.debug('-' * 90)
+    label_path : str
+        ラベルデータ（.csv）のファイルパス
 
-def scene_integration(cut_point_path, label_path, video_dir, scene_dir, scene_data_path):
+    Returns
+    -------
+    video_id_list : list
+        動画IDのリスト
+
+    cut_point_dict : dict
+        カット点データの辞書 {動画ID: カット検出点のリスト}
+
+    cut_data : list
+        カットデータ
+    """
+    # 動画IDリスト、カット点データの読み込み
+    video_id_list, cut_point_list = read_csv(cut_point_path)         # 動画IDリスト, カットデータ 
+    cut_point_list = [ast.literal_eval(data) for data in cut_point_list]  # 整形
+    
+    # ラベルデータの読み込み
+    labels = [[data[0], int(data[1]), decode_ids(data[2])] for data in read_csv(label_path, needs_skip_header=True)]
+    
+    # カット点辞書の作成
+    cut_point_dict = {video_id : cut_point for video_id, cut_point in zip(video_id_list, cut_point_list)}
+    
+    # カットデータの作成
+    cut_data = create_cut_data(labels, cut_point_dict)
+
+    return video_id_list, cut_point_dict, cut_data
+
+def write_scene_data(scene_data, scene_data_path):
+    """シーンデータを CSV に保存する関数（ラベルはラベルIDの文字列）
+
+    Parameters
+    ----------
+    scene_data : list
+        シーンデータ
+
+    scene_data_path : str
+        シーンのデータ（.csv）の保存ファイルパス
+    """
+    field_name = ['動画ID', 'シーン番号', 'スタートフレーム', 'エンドフレーム', '[ラベルのリスト]']
+    rows = [[video_id, scene_no, start, end, encode_ids(labels)] for video_id, scene_no, start, end, labels in scene_data]
+
+    # シーンが無い場合もヘッダーを書き込むため、write_csv（1行の場合は1次元配列として扱う）は使用しない
+    with open(scene_data_path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerows([field_name] + rows)
+
+def sweep_thresholds(cut_point_path, label_path, thresholds, sweep_dir):
+    """複数の閾値でシーン統合を行い、閾値ごとのシーン数・平均シーン長を出力する関数
+
+    類似度は閾値に依存しないため1回だけ算出し、シーンの動画は保存しない
+
+    [出力]
+        scene_data_[閾値].csv : 閾値ごとのシーンデータ
+        sweep_summary.csv     : 閾値ごとのシーン数、平均シーン長[フレーム]、平均カット数
+
+    Parameters
+    ----------
+    cut_point_path : str
+        カット分割結果（カット点）のファイルパス（.csv）
+
+    label_path : str
+        ラベルデータ（.csv）のファイルパス
+
+    thresholds : list
+        閾値のリスト
+
+    sweep_dir : str
+        結果の保存フォルダパス
+
+    Returns
+    -------
+    summary : list
+        閾値ごとの結果 [[閾値, シーン数, 平均シーン長, 平均カット数], ...]
+    """
+    create_dest_folder(sweep_dir)
+
+    # カットデータの作成、類似度の算出（1回だけ）
+    _, _, cut_data = load_cut_data(cut_point_path, label_path)
+    similarities = calc_adjacent_similarity(cut_data)
+
+    summary = []    # 閾値ごとの結果
+    for threshold in sorted(thresholds):
+        scene_data, _ = create_scene_data(cut_data, similarities, threshold)
+
+        scene_lengths = np.array([int(data[3]) - int(data[2]) + 1 for data in scene_data])  # シーン長[フレーム]
+        mean_length = round(float(scene_lengths.mean()), 1) if len(scene_lengths) != 0 else 0.0
+        mean_cuts = round(len(cut_data) / len(scene_data), 2) if len(scene_data) != 0 else 0.0
+        summary.append([threshold, len(scene_data), mean_length, mean_cuts])
+
+        write_scene_data(scene_data, os.path.normpath(os.path.join(sweep_dir, f'scene_data_{threshold}.csv')))
+        logger.debug(f'閾値: {threshold}, シーン数: {len(scene_data)}, 平均シーン長: {mean_length} フレーム, 平均カット数: {mean_cuts}')
+
+    write_csv([['閾値', 'シーン数', '平均シーン長', '平均カット数']] + summary, os.path.normpath(os.path.join(sweep_dir, 'sweep_summary.csv')))
+
+    return summary
+
+class OnlineSceneIntegrator:
+    def __init__(self, cut_point_path, scene_data_path, threshold=INTEGRATION_THRESHOLD, edl_path=None, video_dir=None, cut_dir=None):
+        """ラベルデータを受け取るたびにシーン統合を行うクラス
+
+        動画ごとにラベルデータを蓄積し、動画の全カットのラベルデータが揃った時点でその動画のシーンを確定して、
+        シーンデータ(.csv)（と編集リスト）に追記する
+        シーンデータに既に存在する動画は確定済みとして扱う（中断後の再開）
+
+        Attributes
+        ----------
+        cut_point_dict : dict
+            カット点データの辞書 {動画ID: カット検出点のリスト}
+
+        buffers : dict
+            シーン未確定の動画のラベルデータ {動画ID: {カット番号: ラベルIDの配列}}
+
+        finalized : set
+            シーンを確定した動画IDの集合
+        """
+        self.cut_point_path = cut_point_path
+        self.scene_data_path = scene_data_path
+        self.threshold = threshold
+        self.edl_path = edl_path
+        self.video_dir = video_dir
+        self.cut_dir = cut_dir
+
+        self.cut_point_dict = {}
+        self.cut_point_mtime = None
+        self.buffers = {}
+        self.finalized = set()
+
+        self.reload_cut_point()
+
+        # 既存のシーンデータがある場合は確定済みの動画を取得、無い場合はヘッダーを書き込む
+        if os.path.exists(scene_data_path):
+            self.finalized = {row[0] for row in iter_csv(scene_data_path, needs_skip_header=True)}
+        else:
+            write_scene_data([], scene_data_path)
+        if edl_path is not None and not os.path.exists(edl_path):
+            append_csv([EDL_HEADER], edl_path)
+
+    def reload_cut_point(self):
+        """カット点データが更新されていれば読み込み直す関数"""
+        if not os.path.exists(self.cut_point_path):
+            return
+
+        mtime = os.path.getmtime(self.cut_point_path)
+        if mtime != self.cut_point_mtime:
+            video_id_list, cut_point_list = read_csv(self.cut_point_path)
+            self.cut_point_dict = {video_id: ast.literal_eval(cut_point) for video_id, cut_point in zip(video_id_list, cut_point_list)}
+            self.cut_point_mtime = mtime
+
+    def add(self, video_id, cut_no, label_ids):
+        """1カット分のラベルデータを受け取る関数
+
+        Parameters
+        ----------
+        video_id : str
+            動画ID
+
+        cut_no : int
+            カット番号
+
+        label_ids : numpy.ndarray
+            ラベルIDの配列
+
+        Returns
+        -------
+        scene_data : list or None
+            動画の全カットが揃った場合は、確定したシーンデータ（それ以外は None）
+        """
+        if video_id in self.finalized:
+            return None
+
+        self.buffers.setdefault(video_id, {})[cut_no] = label_ids
+
+        # カット点データに無い動画は、カット点データを読み込み直す
+        if video_id not in self.cut_point_dict:
+            self.reload_cut_point()
+            if video_id not in self.cut_point_dict:
+                return None
+
+        # 最後のカットまで揃った場合は確定
+        if len(self.buffers[video_id]) >= len(self.cut_point_dict[video_id]):
+            return self.finalize(video_id)
+
+        return None
+
+    def finalize(self, video_id):
+        """動画のシーンを確定して、シーンデータに追記する関数
+
+        Parameters
+        ----------
+        video_id : str
+            動画ID
+
+        Returns
+        -------
+        scene_data : list
+            確定したシーンデータ
+        """
+        labels = [[video_id, cut_no, label_ids] for cut_no, label_ids in sorted(self.buffers.pop(video_id).items())]
+        cut_data = create_cut_data(labels, self.cut_point_dict)
+        scene_data, _ = create_scene_data(cut_data, calc_adjacent_similarity(cut_data), self.threshold)
+
+        # シーンデータ・編集リストに追記
+        append_csv([[vid, scene_no, start, end, encode_ids(label_ids)] for vid, scene_no, start, end, label_ids in scene_data], self.scene_data_path)
+        if self.edl_path is not None:
+            append_csv(create_edl(scene_data, self.cut_point_dict, self.video_dir, self.cut_dir), self.edl_path)
+
+        self.finalized.add(video_id)
+        logger.debug(f'{video_id} : {len(scene_data)} シーンを確定しました。')
+
+        return scene_data
+
+    def is_complete(self):
+        """カット点データの全動画のシーンを確定したかどうかを返す関数
+
+        Returns
+        -------
+        bool
+            全動画のシーンを確定したかどうか
+        """
+        return len(self.cut_point_dict) != 0 and set(self.cut_point_dict) <= self.finalized
+
+    def flush(self):
+        """全カットが揃っていない動画も、受け取ったカットのみでシーンを確定する関数（ラベル付けの終了後に呼び出す）"""
+        self.reload_cut_point()
+        for video_id in sorted(self.buffers):
+            if video_id in self.cut_point_dict:
+                logger.debug(f'{video_id} : {len(self.cut_point_dict[video_id]) - len(self.buffers[video_id])} カットのラベルデータがありません。')
+                self.finalize(video_id)
+
+class CsvTail:
+    def __init__(self, file_path):
+        """追記されるCSVファイルを追いかけて読み込むクラス
+
+        書き込み途中の行（改行で終わっていない行）は、書き終わるまで読み込まない
+        ファイルが作り直された（サイズが小さくなった、または削除された）場合は先頭から読み込み直す
+
+        Attributes
+        ----------
+        file_path : str
+            CSVファイルのパス
+        """
+        self.file_path = file_path
+        self.f = None
+        self.partial_line = ''  # 書き込み途中の行
+        self.is_header = True   # 次の行がヘッダーかどうか
+
+    def read_rows(self):
+        """前回から追記された行を返す関数（ヘッダーは除く）
+
+        Returns
+        -------
+        rows : list
+            追記された行のリスト
+        """
+        # ファイルが作り直された場合は開き直す
+        if self.f is not None and (not os.path.exists(self.file_path) or os.path.getsize(self.file_path) < self.f.tell()):
+            self.close()
+
+        if self.f is None:
+            if not os.path.exists(self.file_path):
+                return []
+            self.f = open(self.file_path, 'r', encoding='utf-8', newline='')
+            self.partial_line = ''
+            self.is_header = True
+
+        rows = []
+        for line in iter(self.f.readline, ''):
+            self.partial_line += line
+            if not self.partial_line.endswith('\n'):
+                break
+
+            row = next(csv.reader([self.partial_line]))
+            self.partial_line = ''
+
+            # ヘッダーを読み飛ばす
+            if self.is_header:
+                self.is_header = False
+                continue
+
+            rows.append(row)
+
+        return rows
+
+    def close(self):
+        """ファイルを閉じる関数"""
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+class LabelingFollower:
+    def __init__(self, integrator, noun_label_path, verb_label_path, vocab, reuse_map=None, deferred_videos=()):
+        """物体検出・動作認識のラベル付け結果を読み込みながら、逐次シーン統合を行うクラス
+
+        ラベル付けの実行中に、物体ラベルと動作ラベルが揃ったカットから順に [label_shaping_mod] と同じ変換（ラベルIDへの変換・結合）を行い、
+        [OnlineSceneIntegrator] に渡す（動画の全カットが揃った時点でシーンが確定する）
+
+        重複CMのカット（reuse_map）は、仮の行ではなく参照先のカットのラベルを使用する
+        reuse_map がラベル付けの後に決まる場合は、deferred_videos の動画のカットを [set_reuse_map] まで保留する
+
+        Attributes
+        ----------
+        pending : dict
+            片方のラベルのみ読み込んだカット {(動画ID, カット番号): {'noun': ラベル, 'verb': ラベル}}
+
+        shaped : dict
+            ラベルIDに変換したカット {(動画ID, カット番号): ラベルIDの配列}（重複CMの参照先として使用）
+        """
+        self.integrator = integrator
+        self.vocab = vocab
+        self.tails = {'noun': CsvTail(noun_label_path), 'verb': CsvTail(verb_label_path)}
+        self.pending = {}
+        self.shaped = {}
+        self.reuse_map = {}
+        self.dependents = {}
+        self.deferred_videos = set(deferred_videos)
+        self.deferred_rows = []
+        self.lock = threading.Lock()
+        self.error = None   # [run] を別スレッドで実行した場合の例外
+
+        if reuse_map is not None:
+            self.set_reuse_map(reuse_map)
+
+    def set_reuse_map(self, reuse_map):
+        """重複CMの再利用するカットを設定し、保留していたカットを渡す関数
+
+        Parameters
+        ----------
+        reuse_map : dict
+            再利用するカット {(動画ID, カット番号): (参照動画ID, 参照動画のカット番号)}
+        """
+        with self.lock:
+            self.reuse_map = dict(reuse_map)
+            self.dependents = {}
+            for key, ref_key in self.reuse_map.items():
+                self.dependents.setdefault(ref_key, []).append(key)
+
+            # 保留していたカット
+            self.deferred_videos = set()
+            deferred_rows, self.deferred_rows = self.deferred_rows, []
+            for key, label_ids in deferred_rows:
+                self.emit(key, label_ids)
+
+            # 参照先のラベルが揃っているカット
+            for key, ref_key in sorted(self.reuse_map.items()):
+                if ref_key in self.shaped:
+                    self.integrator.add(key[0], key[1], self.shaped[ref_key])
+
+    def emit(self, key, label_ids):
+        """ラベルIDに変換したカットをシーン統合に渡す関数"""
+        # 重複CMのカットは参照先のラベルを使用する（仮の行は使用しない）
+        if key in self.reuse_map:
+            return
+        if key[0] in self.deferred_videos:
+            self.deferred_rows.append((key, label_ids))
+            return
+
+        self.shaped[key] = label_ids
+        self.integrator.add(key[0], key[1], label_ids)
+        for dependent_key in self.dependents.get(key, []):
+            self.integrator.add(dependent_key[0], dependent_key[1], label_ids)
+
+    def shape(self, key, labels):
+        """物体ラベル・動作ラベルを結合してラベルIDに変換し、シーン統合に渡す関数"""
+        label_ids = to_label_ids(labels.get('noun') or [], self.vocab, 'noun') + to_label_ids(labels.get('verb') or [], self.vocab, 'verb')
+        self.emit(key, np.array(label_ids, dtype=np.int32))
+
+    def poll(self):
+        """ラベル付け結果に追記された行を読み込む関数
+
+        Returns
+        -------
+        row_cnt : int
+            読み込んだ行数
+        """
+        row_cnt = 0
+        with self.lock:
+            for kind, tail in self.tails.items():
+                for row in tail.read_rows():
+                    row_cnt += 1
+                    key = (row[0], int(row[1]))
+                    labels = self.pending.setdefault(key, {})
+                    labels[kind] = ast.literal_eval(row[2])
+
+                    # 物体ラベルと動作ラベルが揃ったカット
+                    if len(labels) == 2:
+                        self.shape(key, self.pending.pop(key))
+
+        return row_cnt
+
+    def run(self, stop_event=None, poll_interval=POLL_INTERVAL, idle_timeout=None):
+        """ラベル付け結果への追記を読み込み続ける関数
+
+        stop_event が設定された後、追記が無くなった時点で終了する
+        stop_event を指定しない場合は、全動画のシーンを確定した時点、または idle_timeout 秒間追記が無かった時点で終了する
+
+        Parameters
+        ----------
+        stop_event : threading.Event, default None
+            ラベル付けの終了を知らせるイベント
+
+        poll_interval : float, default POLL_INTERVAL
+            追記を確認する間隔[sec]
+
+        idle_timeout : float, default None
+            追記が無い場合に終了するまでの時間[sec]
+        """
+        last_update = time.time()   # 最後に追記を読み込んだ時刻
+        try:
+            while True:
+                is_stopping = stop_event is not None and stop_event.is_set()
+                if self.poll():
+                    last_update = time.time()
+                    continue
+
+                if is_stopping:
+                    break
+                if stop_event is None and self.integrator.is_complete():
+                    break
+                if idle_timeout is not None and time.time() - last_update > idle_timeout:
+                    logger.debug('ラベル付け結果の追記が無いため、終了します。')
+                    break
+
+                time.sleep(poll_interval)
+                self.integrator.reload_cut_point()
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            for tail in self.tails.values():
+                tail.close()
+
+    def flush(self):
+        """片方のラベルが無いカットをもう片方のみで変換し、未確定の動画のシーンを確定する関数（ラベル付けの終了後に呼び出す）"""
+        if self.error is not None:
+            raise RuntimeError('逐次シーン統合が異常終了しました。') from self.error
+
+        with self.lock:
+            for key in sorted(self.pending):
+                self.shape(key, self.pending.pop(key))
+            self.integrator.flush()
+
+        logger.debug(f'シーンを確定した動画 : {len(self.integrator.finalized)} / {len(self.integrator.cut_point_dict)}')
+
+def scene_integration(cut_point_path, label_path, video_dir, scene_dir, scene_data_path, cut_dir=None, edl_path=None, render_scenes=True):
     """シーンに統合・保存する関数
 
     [手順]
         1. データの読み込み・前処理
         2. カットデータの作成
         3. シーンデータの作成
-        4. シーンの保存
-        5. シーンデータの保存
+        4. シーンデータ・編集リストの保存
+        5. シーンの保存（動画ごとに並列、render_scenes = False の場合は省略）
 
     Parameters
     ----------
@@ -299,30 +843,80 @@ def scene_integration(cut_point_path, label_path, video_dir, scene_dir, scene_da
 
     scene_data_path : str
         シーンのデータ（.csv）の保存ファイルパス
+
+    cut_dir : str, default None
+        カット分割結果（動画）が存在するフォルダパス（指定した場合、カット動画を連結してシーンを保存する）
+
+    edl_path : str, default None
+        シーンの編集リスト(.csv)の保存ファイルパス（指定した場合のみ保存）
+
+    render_scenes : bool, default True
+        シーンの動画を保存するかどうか（False の場合は、編集リストから要求時に作成する [scene_render_mod]）
     """
-    # 動画IDリスト、カット点データの読み込み
-    video_id_list, cut_point_list = read_csv(cut_point_path)         # 動画IDリスト, カットデータ 
-    cut_point_list = [ast.literal_eval(data) for data in cut_point_list]  # 整形
-    
-    # ラベルデータの読み込み
-    labels = [[data[0], int(data[1]), ast.literal_eval(data[2])] for data in read_csv(label_path, needs_skip_header=True)]
-    
-    # カット点辞書の作成
-    cut_point_dict = {video_id : cut_point for video_id, cut_point in zip(video_id_list, cut_point_list)}
-    
     # カットデータの作成
-    cut_data = create_cut_data(labels, cut_point_dict)
-    
-    # シーンデータの作成
-    scene_data = create_scene_data(cut_data)
+    video_id_list, cut_point_dict, cut_data = load_cut_data(cut_point_path, label_path)
     
-    # シーン分割点の辞書を作成
-    scene_point_dic = calc_scene_point(scene_data)
+    # 隣接するカット同士の類似度を算出
+    similarities = calc_adjacent_similarity(cut_data)
+
+    # シーンデータ、シーン分割点の辞書の作成
+    scene_data, scene_point_dic = create_scene_data(cut_data, similarities)
+
+    # シーンデータの保存（シーンの動画の保存に失敗しても残るよう、先に保存する）
+    write_scene_data(scene_data, scene_data_path)
+
+    # 編集リストの保存
+    if edl_path is not None:
+        write_edl(scene_data, cut_point_dict, video_dir, edl_path, cut_dir)
+
+    if not render_scenes:
+        return
 
     # シーンを動画として保存
-    save_scene(video_id_list, scene_point_dic, video_dir, scene_dir)
+    failed_video_ids = save_scene(video_id_list, scene_point_dic, video_dir, scene_dir, cut_point_dict=cut_point_dict, cut_dir=cut_dir)
+    if failed_video_ids:
+        logger.debug(f'シーンの保存に失敗した動画 : {len(failed_video_ids)} 件 {failed_video_ids}')
 
-    # シーンデータの保存
-    field_name = ['動画ID', 'シーン番号', 'スタートフレーム', 'エンドフレーム', '[ラベルのリスト]']
-    scene_data.insert(0, field_name)
-    write_csv(scene_data, scene_data_path)
\ No newline at end of file
+def parse_args():
+    """コマンドライン引数を処理して返す関数
+
+    Returns
+    -------
+    args : argparse.ArgumentParser
+        解析されたコマンドライン引数
+    """
+    parser = argparse.ArgumentParser(description='シーン統合の閾値の比較・逐次シーン統合')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sweep_parser = subparsers.add_parser('sweep', help='閾値ごとのシーン数・平均シーン長を比較する（シーンの動画は保存しない）')
+    sweep_parser.add_argument('thresholds', type=float, nargs='+', help='比較する閾値（例 : 0.8 0.85 0.9 0.93 0.95）')
+    sweep_parser.add_argument('--dest-dir', help='結果の保存フォルダパス（省略時はシーンデータと同じフォルダの threshold_sweep）')
+
+    follow_parser = subparsers.add_parser('follow', help='物体検出・動作認識のラベル付け結果への追記を読み込みながら、動画ごとにシーンを確定する'
+                                                         '（重複CMの検出を行う場合は、パイプラインの scene_integration = online を使用する）')
+    follow_parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL, help='追記を確認する間隔[sec]')
+    follow_parser.add_argument('--idle-timeout', type=float, help='追記が無い場合に終了するまでの時間[sec]')
+
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == '__main__':
+    # コマンドライン引数の取得
+    args = parse_args()
+
+    # パス設定
+    path = Path()
+
+    if args.command == 'sweep':
+        sweep_dir = args.dest_dir or os.path.join(os.path.dirname(path.scene_data_path), 'threshold_sweep')
+        sweep_thresholds(path.cut_point_path, path.label_path, args.thresholds, sweep_dir)
+    else:
+        pipeline_setting = get_pipeline_setting()
+        cut_dir = path.cut_dir if pipeline_setting['save_cut_files'] else None
+        integrator = OnlineSceneIntegrator(path.cut_point_path, path.scene_data_path, edl_path=pipeline_setting['scene_edl_path'],
+                                           video_dir=path.video_dir, cut_dir=cut_dir)
+        follower = LabelingFollower(integrator, path.noun_label_path, path.verb_label_path,
+                                    get_label_vocab(path.label_data_dir, path.label_vocab_path))
+        follower.run(poll_interval=args.poll_interval, idle_timeout=args.idle_timeout)
+        follower.flush()
@@ -0,0 +1,373 @@
+"""
+シーンの動画を必要な時にだけ作成するモジュール
+
+シーン統合では、シーンデータ(.csv)と編集リスト（EDL、各シーンの元動画のフレーム範囲とカット動画の範囲）のみを保存し、
+シーンの動画は指定された (動画ID, シーン番号) が初めて要求された時に作成する
+作成した動画はキャッシュフォルダに保存し、合計サイズが上限を超えた場合は最後に参照された時刻が古いものから削除する（LRU）
+
+[使い方]
+    python -m utils.scene_render_mod [動画ID] [シーン番号] [シーン番号 ...]
+    作成（またはキャッシュから取得）したシーンの動画のパスを表示する
+"""
+import argparse
+import csv
+import os
+import shutil
+import subprocess
+
+import cv2
+import numpy as np
+from utils.init_setting import setup_logger, get_pipeline_setting
+from utils.file_io import iter_csv, create_dest_folder
+
+EXTENSION = '.mp4'  # シーンの動画の拡張子（MP4）
+EDL_HEADER = ['動画ID', 'シーン番号', 'スタートフレーム', 'エンドフレーム', '元動画', '最初のカット', '最後のカット', 'カット動画フォルダ']
+
+# ログ設定
+logger = setup_logger(__name__)
+
+def probe_stream(video_path):
+    """ffprobe で動画の映像ストリームの情報を取得する関数
+
+    Parameters
+    ----------
+    video_path : str
+        動画のパス
+
+    Returns
+    -------
+    str or None
+        映像ストリームの情報（コーデック、幅、高さ、フレームレート）、取得できない場合は None
+    """
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'stream=codec_name,width,height,r_frame_rate', '-of', 'csv=p=0', video_path]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+
+    return result.stdout.strip() if result.returncode == 0 and result.stdout.strip() else None
+
+def concat_cut_clips(cut_paths, save_scene_path):
+    """カット動画を再エンコードせずに連結して、シーンの動画として保存する関数
+
+    ffmpeg の concat demuxer でストリームをそのままコピーする
+
+    Parameters
+    ----------
+    cut_paths : list
+        連結するカット動画のパスのリスト（カット順）
+
+    save_scene_path : str
+        シーンの動画の保存先
+
+    Returns
+    -------
+    bool
+        連結できたかどうか
+    """
+    list_path = save_scene_path + '.txt'    # 連結するファイルの一覧
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for cut_path in cut_paths:
+            f.write("file '" + os.path.abspath(cut_path).replace('\\', '/').replace("'", "'\\''") + "'\n")
+
+    try:
+        cmd = ['ffmpeg', '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy', save_scene_path]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+    finally:
+        os.remove(list_path)
+
+    return result.returncode == 0 and os.path.exists(save_scene_path) and os.path.getsize(save_scene_path) > 0
+
+def create_edl(scene_data, cut_point_dict, video_dir, cut_dir=None):
+    """シーンデータから編集リスト（EDL）を作成する関数
+
+    Parameters
+    ----------
+    scene_data : list
+        シーンデータ    ['動画ID', 'シーン番号', 'スタートフレーム', 'エンドフレーム', 'ラベルIDの配列']
+
+    cut_point_dict : dict
+        カット点データの辞書 {動画ID: カット検出点のリスト}
+
+    video_dir : str
+        動画データが存在するフォルダパス
+
+    cut_dir : str, default None
+        カット分割結果（動画）が存在するフォルダパス（指定した場合、シーンに対応するカット動画の範囲も記録する）
+
+    Returns
+    -------
+    edl : list
+        編集リスト [[動画ID, シーン番号, スタートフレーム, エンドフレーム, 元動画, 最初のカット, 最後のカット, カット動画フォルダ], ...]
+    """
+    edl = []    # 編集リスト
+    for video_id, scene_no, start, end, _ in scene_data:
+        video_path = os.path.normpath(os.path.join(video_dir, video_id + EXTENSION))
+
+        # シーンに対応するカット番号（シーンの区切りはカットの区切りと一致する）
+        first_cut, last_cut = '', ''
+        if cut_dir is not None and video_id in cut_point_dict:
+            cut_point = np.asarray(cut_point_dict[video_id])
+            first_cut, last_cut = (int(i) + 1 for i in np.searchsorted(cut_point, [start, end]))
+
+        edl.append([video_id, scene_no, start, end, video_path, first_cut, last_cut, cut_dir or ''])
+
+    return edl
+
+def write_edl(scene_data, cut_point_dict, video_dir, edl_path, cut_dir=None):
+    """編集リスト（EDL）を作成して CSV に保存する関数
+
+    Parameters
+    ----------
+    scene_data : list
+        シーンデータ
+
+    cut_point_dict : dict
+        カット点データの辞書 {動画ID: カット検出点のリスト}
+
+    video_dir : str
+        動画データが存在するフォルダパス
+
+    edl_path : str
+        編集リスト(.csv)の保存ファイルパス
+
+    cut_dir : str, default None
+        カット分割結果（動画）が存在するフォルダパス
+    """
+    with open(edl_path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerows([EDL_HEADER] + create_edl(scene_data, cut_point_dict, video_dir, cut_dir))
+
+def read_edl(edl_path):
+    """編集リスト（EDL）を読み込む関数
+
+    Parameters
+    ----------
+    edl_path : str
+        編集リスト(.csv)のファイルパス
+
+    Returns
+    -------
+    edl_dict : dict
+        編集リストの辞書 {(動画ID, シーン番号): {'start': int, 'end': int, 'video_path': str, 'cut_paths': list}}
+    """
+    edl_dict = {}
+    for video_id, scene_no, start, end, video_path, first_cut, last_cut, cut_dir in iter_csv(edl_path, needs_skip_header=True):
+        cut_paths = []  # シーンに対応するカット動画のパス
+        if first_cut and last_cut:
+            cut_paths = [os.path.normpath(os.path.join(cut_dir, video_id, 'cut' + str(cut_no) + EXTENSION))
+                         for cut_no in range(int(first_cut), int(last_cut)+1)]
+
+        edl_dict[(video_id, int(scene_no))] = {'start': int(start), 'end': int(end), 'video_path': video_path, 'cut_paths': cut_paths}
+
+    return edl_dict
+
+def render_scene(entry, save_scene_path):
+    """編集リストの1シーン分を動画として保存する関数
+
+    カット動画がある場合は再エンコードせずに連結し、無い場合は元動画のフレーム範囲を再エンコードする
+
+    Parameters
+    ----------
+    entry : dict
+        編集リストの1シーン分（[read_edl] の結果の値）
+
+    save_scene_path : str
+        シーンの動画の保存先
+
+    Returns
+    -------
+    mode : str
+        'copy'（連結）または 'encode'（再エンコード）
+    """
+    cut_paths = entry['cut_paths']
+    if (cut_paths and shutil.which('ffmpeg') is not None and all(os.path.exists(cut_path) for cut_path in cut_paths)
+            and concat_cut_clips(cut_paths, save_scene_path)):
+        return 'copy'
+
+    cap = cv2.VideoCapture(entry['video_path'])
+    writer = None
+    try:
+        # ビデオキャプチャーが開けていない場合、例外を返す
+        if cap.isOpened() is False:
+            raise ValueError('読み込みエラー : 動画 ' + entry['video_path'] + 'が上手く読み取れません。')
+
+        fps = cap.get(cv2.CAP_PROP_FPS)                         # FPS
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))          # 幅
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))        # 高さ
+        fourcc = 0x00000021    # 動画の保存形式(H264形式でエンコード)
+
+        # スタートフレームまではデコードせずに読み飛ばす（シークはフレーム位置がずれる場合があるため使用しない）
+        for _ in range(entry['start']):
+            cap.grab()
+
+        writer = cv2.VideoWriter(save_scene_path, fourcc, fps, (width, height))
+        for frame_no in range(entry['start'], entry['end']+1):
+            ret, frame = cap.read()
+            if not ret:
+                raise ValueError(f'読み込みエラー : {entry["video_path"]} のフレーム {frame_no} が読み取れません。')
+            writer.write(frame)
+    finally:
+        if writer is not None:
+            writer.release()
+        cap.release()
+
+    return 'encode'
+
+class SceneCache:
+    def __init__(self, edl_path, cache_dir, max_bytes):
+        """シーンの動画を必要な時にだけ作成し、サイズ上限付きで保持するキャッシュ（LRU）
+
+        最後に参照された時刻はファイルの更新時刻で管理するため、プロセスをまたいでも保持される
+        ファイル名に編集リストのフレーム範囲を含めるため、シーン統合をやり直してシーンの範囲が変わった場合は作成し直す
+
+        Attributes
+        ----------
+        edl : dict
+            編集リストの辞書（[read_edl] の結果）
+
+        cache_dir : str
+            キャッシュフォルダのパス
+
+        max_bytes : int
+            キャッシュの合計サイズの上限[byte]
+        """
+        self.edl = read_edl(edl_path)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        create_dest_folder(cache_dir)
+
+    def get_scene_path(self, video_id, scene_no):
+        """キャッシュするシーンの動画のパスを返す関数
+
+        Parameters
+        ----------
+        video_id : str
+            動画ID
+
+        scene_no : int
+            シーン番号
+
+        Returns
+        -------
+        str
+            シーンの動画のパス（[動画ID]/scene[シーン番号]_[スタートフレーム]-[エンドフレーム].mp4）
+        """
+        entry = self.edl[(video_id, scene_no)]
+        file_name = f'scene{scene_no}_{entry["start"]}-{entry["end"]}' + EXTENSION
+
+        return os.path.normpath(os.path.join(self.cache_dir, video_id, file_name))
+
+    def remove_stale(self, scene_path, scene_no):
+        """同じシーン番号で範囲が異なる（古い編集リストで作成した）シーンの動画を削除する関数
+
+        Parameters
+        ----------
+        scene_path : str
+            現在の編集リストのシーンの動画のパス
+
+        scene_no : int
+            シーン番号
+        """
+        scene_dir = os.path.dirname(scene_path)
+        prefix = f'scene{scene_no}_'
+        for file_name in os.listdir(scene_dir):
+            file_path = os.path.normpath(os.path.join(scene_dir, file_name))
+            if file_name.startswith(prefix) and file_name.endswith(EXTENSION) and file_path != scene_path:
+                os.remove(file_path)
+                logger.debug('範囲が変わったシーンの動画を削除しました : ' + file_path)
+
+    def get(self, video_id, scene_no):
+        """シーンの動画のパスを返す関数（キャッシュに無い場合は作成する）
+
+        Parameters
+        ----------
+        video_id : str
+            動画ID
+
+        scene_no : int
+            シーン番号
+
+        Returns
+        -------
+        scene_path : str
+            シーンの動画のパス
+        """
+        if (video_id, scene_no) not in self.edl:
+            raise ValueError(f'指定したシーンはありません。（{video_id}, シーン{scene_no}）')
+
+        scene_path = self.get_scene_path(video_id, scene_no)
+
+        # キャッシュにある場合は参照時刻を更新
+        if os.path.exists(scene_path):
+            os.utime(scene_path)
+            return scene_path
+
+        # キャッシュに無い場合は作成
+        create_dest_folder(os.path.dirname(scene_path))
+        self.remove_stale(scene_path, scene_no)
+        try:
+            mode = render_scene(self.edl[(video_id, scene_no)], scene_path)
+        except Exception:
+            # 作成途中のファイルは残さない
+            if os.path.exists(scene_path):
+                os.remove(scene_path)
+            raise
+        logger.debug(f'{video_id}_scene{scene_no} を作成しました。（{"カット動画を連結" if mode == "copy" else "再エンコード"}）')
+
+        self.evict(keep_path=scene_path)
+
+        return scene_path
+
+    def evict(self, keep_path=None):
+        """合計サイズが上限以下になるまで、最後に参照された時刻が古いシーンの動画から削除する関数
+
+        Parameters
+        ----------
+        keep_path : str, default None
+            削除しないシーンの動画のパス（作成直後の動画）
+        """
+        files = []  # (参照時刻, サイズ, パス)
+        for root, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if file_name.endswith(EXTENSION):
+                    file_path = os.path.normpath(os.path.join(root, file_name))
+                    stat = os.stat(file_path)
+                    files.append((stat.st_mtime, stat.st_size, file_path))
+
+        total_bytes = sum(size for _, size, _ in files)
+        for _, size, file_path in sorted(files):
+            if total_bytes <= self.max_bytes:
+                break
+            if file_path == keep_path:
+                continue
+
+            os.remove(file_path)
+            total_bytes -= size
+            logger.debug('キャッシュから削除しました : ' + file_path)
+
+def parse_args():
+    """コマンドライン引数を処理して返す関数
+
+    Returns
+    -------
+    args : argparse.ArgumentParser
+        解析されたコマンドライン引数
+    """
+    parser = argparse.ArgumentParser(description='シーンの動画の作成（キャッシュ付き）')
+    parser.add_argument('video_id', help='動画ID')
+    parser.add_argument('scene_nos', type=int, nargs='+', help='シーン番号')
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == '__main__':
+    # コマンドライン引数の取得
+    args = parse_args()
+
+    # パイプラインの動作設定（編集リスト・キャッシュの設定）
+    pipeline_setting = get_pipeline_setting()
+
+    cache = SceneCache(pipeline_setting['scene_edl_path'], pipeline_setting['scene_cache_dir'],
+                       pipeline_setting['scene_cache_size_mb'] * 1024 * 1024)
+    for scene_no in args.scene_nos:
+        print(cache.get(args.video_id, scene_no))
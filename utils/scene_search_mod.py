@@ -0,0 +1,481 @@
+"""
+ラベルの集合が類似しているシーンをコーパス全体から検索するモジュール（MinHash / LSH）
+
+各シーンのラベルの集合（ラベルIDの集合）を MinHash で固定長の署名に変換し、
+署名を BANDS 個のバンド（1バンドあたり ROWS 行）に分けたハッシュテーブルに登録する
+ハッシュテーブルには同じラベルの集合を1回だけ登録し、集合ごとにシーンを保持する（よく現れる集合で候補が膨らまないようにするため）
+検索時は、いずれかのバンドが一致した集合のみを候補とし、候補の集合 × ラベルの疎行列で Jaccard 係数を一括で算出して順位付けする
+全シーンとの総当たりの比較が不要なため、シーン数が数十万件でも数ミリ秒で検索できる
+
+[使い方]
+    インデックスの作成（シーンデータから）
+        python -m utils.scene_search_mod build
+    類似シーンの検索
+        python -m utils.scene_search_mod query [動画ID] [シーン番号] [--top-k K] [--videos-from CMデータ(.csv)]
+"""
+import argparse
+import os
+from itertools import chain
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from utils.init_setting import Path, setup_logger
+from utils.file_io import iter_csv
+from utils.label_vocab_mod import decode_ids
+
+NUM_PERM = 128          # MinHash の署名の長さ（ハッシュ関数の数）
+BANDS = 32              # LSH のバンド数
+ROWS = NUM_PERM // BANDS    # 1バンドあたりの行数
+PRIME = (1 << 31) - 1   # ハッシュ関数の法（メルセンヌ素数）
+SEED = 0                # ハッシュ関数の乱数シード
+TOP_K = 10              # 検索結果の件数
+
+# ログ設定
+logger = setup_logger(__name__)
+
+class SceneIndex:
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS, seed=SEED):
+        """シーンのラベルの集合の MinHash / LSH インデックス
+
+        Attributes
+        ----------
+        keys : list
+            登録したシーンのキー [(動画ID, シーン番号), ...]
+
+        label_sets : list
+            登録したシーンのラベルの集合（ラベルIDの frozenset）
+
+        frame_ranges : list
+            登録したシーンのフレーム範囲 (スタートフレーム, エンドフレーム)（不明な場合は None）
+
+        signatures : list
+            登録したシーンの MinHash の署名（numpy.ndarray (num_perm,)）
+
+        set_index : dict
+            ラベルの集合ごとの番号 {ラベルの集合: 集合の番号}
+
+        set_labels : list
+            集合の番号ごとのラベルの集合
+
+        set_members : list
+            集合の番号ごとのシーンのインデックスのリスト
+
+        buckets : list
+            バンドごとのハッシュテーブル [{バンドの署名: [集合の番号, ...]}, ...]
+
+        search_arrays : dict or None
+            検索用の配列（[prepare] 参照、シーンを追加すると作り直す）
+        """
+        if num_perm % bands != 0:
+            raise ValueError('署名の長さはバンド数で割り切れる必要があります。')
+
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.seed = seed
+
+        # ハッシュ関数 h(x) = (a * x + b) mod PRIME のパラメータ
+        rng = np.random.default_rng(seed)
+        self.hash_a = rng.integers(1, PRIME, size=num_perm, dtype=np.int64)
+        self.hash_b = rng.integers(0, PRIME, size=num_perm, dtype=np.int64)
+
+        self.keys = []
+        self.key_index = {}
+        self.label_sets = []
+        self.frame_ranges = []
+        self.signatures = []
+        self.set_index = {}
+        self.set_labels = []
+        self.set_members = []
+        self.buckets = [{} for _ in range(bands)]
+        self.search_arrays = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def signature(self, label_ids):
+        """ラベルIDの集合から MinHash の署名を算出する関数
+
+        Parameters
+        ----------
+        label_ids : numpy.ndarray
+            ラベルIDの配列（重複は無視する）
+
+        Returns
+        -------
+        numpy.ndarray
+            MinHash の署名 (num_perm,)
+        """
+        label_ids = np.unique(np.asarray(label_ids, dtype=np.int64))
+        hashes = (self.hash_a[:, np.newaxis] * label_ids[np.newaxis, :] + self.hash_b[:, np.newaxis]) % PRIME
+
+        return hashes.min(axis=1).astype(np.uint32)
+
+    def band_keys(self, signature):
+        """署名をバンドごとのハッシュテーブルのキーに変換する関数
+
+        Parameters
+        ----------
+        signature : numpy.ndarray
+            MinHash の署名
+
+        Returns
+        -------
+        list
+            バンドごとのキー（bytes）
+        """
+        return [signature[i*self.rows:(i+1)*self.rows].tobytes() for i in range(self.bands)]
+
+    def insert(self, key, label_ids, signature=None, frame_range=None):
+        """シーンをインデックスに追加する関数
+
+        ラベルが無いシーンは類似度を定義できないため、登録しない
+
+        Parameters
+        ----------
+        key : tuple
+            シーンのキー (動画ID, シーン番号)
+
+        label_ids : numpy.ndarray
+            ラベルIDの配列
+
+        signature : numpy.ndarray, default None
+            MinHash の署名（算出済みの場合）
+
+        frame_range : tuple, default None
+            シーンのフレーム範囲 (スタートフレーム, エンドフレーム)
+
+        Returns
+        -------
+        bool
+            登録したかどうか
+        """
+        if len(label_ids) == 0 or key in self.key_index:
+            return False
+
+        label_set = frozenset(int(label_id) for label_id in label_ids)
+        set_no = self.set_index.get(label_set)
+
+        # 初めて現れたラベルの集合は、ハッシュテーブルに登録
+        if set_no is None:
+            if signature is None:
+                signature = self.signature(label_ids)
+
+            set_no = len(self.set_labels)
+            self.set_index[label_set] = set_no
+            self.set_labels.append(label_set)
+            self.set_members.append([])
+            for bucket, band_key in zip(self.buckets, self.band_keys(signature)):
+                bucket.setdefault(band_key, []).append(set_no)
+
+        # 同じラベルの集合の署名は同じため、登録済みの署名を使用
+        elif signature is None:
+            signature = self.signatures[self.set_members[set_no][0]]
+
+        index = len(self.keys)
+        self.keys.append(key)
+        self.key_index[key] = index
+        self.label_sets.append(self.set_labels[set_no])
+        self.frame_ranges.append(frame_range)
+        self.signatures.append(signature)
+        self.set_members[set_no].append(index)
+        self.search_arrays = None
+
+        return True
+
+    def is_unchanged(self, key, label_ids, frame_range):
+        """登録済みのシーンが、指定したラベル・フレーム範囲と同じかどうかを返す関数
+
+        Parameters
+        ----------
+        key : tuple
+            シーンのキー (動画ID, シーン番号)
+
+        label_ids : numpy.ndarray
+            ラベルIDの配列
+
+        frame_range : tuple
+            シーンのフレーム範囲 (スタートフレーム, エンドフレーム)
+
+        Returns
+        -------
+        bool
+            同じかどうか（未登録の場合は False）
+        """
+        index = self.key_index.get(key)
+
+        return (index is not None and self.frame_ranges[index] == frame_range
+                and self.label_sets[index] == frozenset(int(label_id) for label_id in label_ids))
+
+    def prepare(self):
+        """検索用の配列を作成する関数（シーンを追加した後の最初の検索時に呼び出される）
+
+        Returns
+        -------
+        search_arrays : dict
+            検索用の配列
+            {'matrix': 集合 × ラベルの有無の疎行列, 'sizes': 集合ごとのラベル数, 'ranks': シーンのキーの昇順の順位,
+             'members': 集合順に連結したシーンのインデックス（集合内はキーの昇順）, 'member_offsets': 集合ごとの members の開始位置,
+             'video_codes': シーンごとの動画の番号, 'video_index': {動画ID: 動画の番号}}
+        """
+        if self.search_arrays is not None:
+            return self.search_arrays
+
+        # 集合 × ラベルの有無の疎行列
+        sizes = np.array([len(label_set) for label_set in self.set_labels], dtype=np.int64)
+        label_ids = np.fromiter(chain.from_iterable(sorted(label_set) for label_set in self.set_labels), dtype=np.int64, count=int(sizes.sum()))
+        matrix = csr_matrix((np.ones(len(label_ids), dtype=np.int64), label_ids, np.concatenate([[0], np.cumsum(sizes)])),
+                            shape=(len(self.set_labels), int(label_ids.max(initial=-1)) + 1))
+
+        # シーンのキーの昇順の順位（同じ Jaccard 係数のシーンはキーの昇順に並べる）
+        sorted_index = np.array(sorted(range(len(self.keys)), key=self.keys.__getitem__), dtype=np.int64)  # 順位 → シーンのインデックス
+        ranks = np.empty(len(self.keys), dtype=np.int64)
+        ranks[sorted_index] = np.arange(len(self.keys))
+        members = np.fromiter(chain.from_iterable(self.set_members), dtype=np.int64, count=len(self.keys))
+        member_offsets = np.concatenate([[0], np.cumsum([len(set_members) for set_members in self.set_members])]).astype(np.int64)
+        set_nos = np.repeat(np.arange(len(self.set_members)), np.diff(member_offsets))
+        members = members[np.lexsort((ranks[members], set_nos))]
+
+        # シーンごとの動画の番号（検索対象の動画の絞り込みに使用）
+        video_index = {}
+        video_codes = np.array([video_index.setdefault(key[0], len(video_index)) for key in self.keys], dtype=np.int64)
+
+        self.search_arrays = {'matrix': matrix, 'sizes': sizes, 'ranks': ranks, 'members': members, 'member_offsets': member_offsets,
+                              'video_codes': video_codes, 'video_index': video_index}
+
+        return self.search_arrays
+
+    def query(self, label_ids, top_k=TOP_K, exclude_key=None, video_ids=None):
+        """ラベルの集合が類似しているシーンを検索する関数
+
+        Parameters
+        ----------
+        label_ids : numpy.ndarray
+            検索するラベルIDの配列
+
+        top_k : int, default TOP_K
+            検索結果の件数
+
+        exclude_key : tuple, default None
+            検索結果から除くシーンのキー（検索元のシーン）
+
+        video_ids : set, default None
+            検索対象の動画IDの集合（None の場合は全動画）
+
+        Returns
+        -------
+        list
+            類似シーン [((動画ID, シーン番号), Jaccard 係数), ...]（Jaccard 係数の降順）
+        """
+        if len(label_ids) == 0:
+            return []
+
+        # いずれかのバンドが一致したラベルの集合を候補とする
+        candidates = set()
+        for bucket, band_key in zip(self.buckets, self.band_keys(self.signature(label_ids))):
+            candidates.update(bucket.get(band_key, ()))
+        if not candidates:
+            return []
+
+        search_arrays = self.prepare()
+        candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+
+        # 候補の集合の Jaccard 係数を一括で算出（共通するラベル数は、集合 × ラベルの行列と検索するラベルの有無の積）
+        label_set = np.unique(np.asarray(label_ids, dtype=np.int64))
+        query_vector = np.zeros(search_arrays['matrix'].shape[1], dtype=np.int64)
+        query_vector[label_set[label_set < len(query_vector)]] = 1
+        common = search_arrays['matrix'][candidates] @ query_vector
+        union = len(label_set) + search_arrays['sizes'][candidates] - common
+
+        # 係数は (共通するラベル数, 和集合のラベル数) の組ごとに1回だけ算出して丸める
+        base = int(union.max()) + 1
+        pairs, inverse = np.unique(common * base + union, return_inverse=True)
+        similarities = np.array([round(pair // base / (pair % base), 3) for pair in pairs.tolist()])[inverse.ravel()]
+
+        # 検索対象のシーン（除くシーン、対象の動画）
+        exclude_index = self.key_index.get(exclude_key, -1)
+        if video_ids is not None:
+            video_mask = np.zeros(len(search_arrays['video_index']), dtype=bool)
+            video_mask[[search_arrays['video_index'][video_id] for video_id in video_ids if video_id in search_arrays['video_index']]] = True
+
+        # Jaccard 係数の降順に、同じ係数の集合のシーンをキーの昇順で top_k 件まで取り出す
+        results = []
+        order = np.argsort(-similarities, kind='stable')
+        sorted_similarities = -similarities[order]  # 昇順（係数の符号を反転）
+        pos = 0
+        while pos < len(order) and (top_k is None or len(results) < top_k):
+            similarity = similarities[order[pos]]
+            end = int(np.searchsorted(sorted_similarities, -similarity, side='right'))
+
+            # 同じ係数の集合のシーンをまとめて取り出す
+            set_nos = candidates[order[pos:end]]
+            begins, lengths = search_arrays['member_offsets'][set_nos], np.diff(search_arrays['member_offsets'])[set_nos]
+            positions = np.arange(lengths.sum()) + np.repeat(begins - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+            members = search_arrays['members'][positions]
+            members = members[members != exclude_index]
+            if video_ids is not None:
+                members = members[video_mask[search_arrays['video_codes'][members]]]
+
+            need = len(members) if top_k is None else top_k - len(results)
+            members = members[np.argsort(search_arrays['ranks'][members], kind='stable')][:need]
+            results += [(self.keys[index], float(similarity)) for index in members.tolist()]
+            pos = end
+
+        return results
+
+    def query_scene(self, video_id, scene_no, top_k=TOP_K, video_ids=None):
+        """登録済みのシーンと類似しているシーンを検索する関数
+
+        Parameters
+        ----------
+        video_id : str
+            動画ID
+
+        scene_no : int
+            シーン番号
+
+        top_k : int, default TOP_K
+            検索結果の件数
+
+        video_ids : set, default None
+            検索対象の動画IDの集合（None の場合は全動画）
+
+        Returns
+        -------
+        list
+            類似シーン [((動画ID, シーン番号), Jaccard 係数), ...]
+        """
+        key = (video_id, scene_no)
+        if key not in self.key_index:
+            raise ValueError(f'指定したシーンはインデックスにありません。（{video_id}, シーン{scene_no}）')
+
+        label_ids = np.array(sorted(self.label_sets[self.key_index[key]]), dtype=np.int32)
+
+        return self.query(label_ids, top_k, exclude_key=key, video_ids=video_ids)
+
+    def save(self, index_path):
+        """インデックスを保存する関数（.npz）
+
+        Parameters
+        ----------
+        index_path : str
+            インデックスの保存ファイルパス
+        """
+        lengths = np.array([len(label_set) for label_set in self.label_sets], dtype=np.int64)
+        frame_ranges = [frame_range or (-1, -1) for frame_range in self.frame_ranges]   # 不明な範囲は -1
+        np.savez_compressed(
+            index_path,
+            params=np.array([self.num_perm, self.bands, self.seed], dtype=np.int64),
+            video_ids=np.array([key[0] for key in self.keys], dtype=str),
+            scene_nos=np.array([key[1] for key in self.keys], dtype=np.int64),
+            frame_ranges=np.array(frame_ranges, dtype=np.int64).reshape(len(self.keys), 2),
+            signatures=np.array(self.signatures, dtype=np.uint32).reshape(len(self.keys), self.num_perm),
+            label_ids=np.array([label_id for label_set in self.label_sets for label_id in sorted(label_set)], dtype=np.int32),
+            label_offsets=np.concatenate([[0], np.cumsum(lengths)]))
+
+    @classmethod
+    def load(cls, index_path):
+        """保存したインデックスを読み込む関数
+
+        Parameters
+        ----------
+        index_path : str
+            インデックスのファイルパス
+
+        Returns
+        -------
+        SceneIndex
+            インデックス
+        """
+        with np.load(index_path) as data:
+            num_perm, bands, seed = (int(param) for param in data['params'])
+            index = cls(num_perm, bands, seed)
+
+            label_ids, label_offsets = data['label_ids'], data['label_offsets']
+            frame_ranges = data['frame_ranges'] if 'frame_ranges' in data.files else np.full((len(data['video_ids']), 2), -1)
+            for i, (video_id, scene_no, signature) in enumerate(zip(data['video_ids'], data['scene_nos'], data['signatures'])):
+                frame_range = (int(frame_ranges[i][0]), int(frame_ranges[i][1])) if frame_ranges[i][0] >= 0 else None
+                index.insert((str(video_id), int(scene_no)), label_ids[label_offsets[i]:label_offsets[i+1]], signature, frame_range)
+
+        return index
+
+def build_scene_index(scene_data_path, index=None):
+    """シーンデータ(.csv)からインデックスを作成する関数
+
+    Parameters
+    ----------
+    scene_data_path : str
+        シーンのデータ（.csv）のファイルパス
+
+    index : SceneIndex, default None
+        既存のインデックス（None の場合は新規に作成）
+        ラベル・フレーム範囲が同じシーンは署名を再利用し、変更されたシーンは作り直す（シーンデータに無いシーンは含めない）
+
+    Returns
+    -------
+    new_index : SceneIndex
+        インデックス
+    """
+    new_index = SceneIndex(index.num_perm, index.bands, index.seed) if index is not None else SceneIndex()
+
+    reused_cnt = 0  # 署名を再利用したシーン数
+    for video_id, scene_no, start, end, labels in iter_csv(scene_data_path, needs_skip_header=True):
+        key, label_ids, frame_range = (video_id, int(scene_no)), decode_ids(labels), (int(start), int(end))
+
+        signature = None
+        if index is not None and index.is_unchanged(key, label_ids, frame_range):
+            signature = index.signatures[index.key_index[key]]
+            reused_cnt += 1
+        new_index.insert(key, label_ids, signature, frame_range)
+
+    if index is not None:
+        logger.debug(f'署名を再利用 : {reused_cnt} / {len(new_index)} シーン（削除・変更 : {len(index) - reused_cnt} シーン）')
+
+    return new_index
+
+def parse_args():
+    """コマンドライン引数を処理して返す関数
+
+    Returns
+    -------
+    args : argparse.ArgumentParser
+        解析されたコマンドライン引数
+    """
+    parser = argparse.ArgumentParser(description='類似シーンの検索')
+    parser.add_argument('--index', help='インデックスのファイルパス（省略時はシーンデータと同じフォルダの scene_index.npz）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='シーンデータからインデックスを作成する（既存のインデックスがある場合は、変更の無いシーンの署名を再利用）')
+    build_parser.add_argument('--rebuild', action='store_true', help='既存のインデックスを使わずに作り直す')
+
+    query_parser = subparsers.add_parser('query', help='類似シーンを検索する')
+    query_parser.add_argument('video_id', help='動画ID')
+    query_parser.add_argument('scene_no', type=int, help='シーン番号')
+    query_parser.add_argument('--top-k', type=int, default=TOP_K, help='検索結果の件数')
+    query_parser.add_argument('--videos-from', help='検索対象を絞り込むCMデータ(.csv)のパス（映像コードの列を使用）')
+
+    args = parser.parse_args()
+
+    return args
+
+if __name__ == '__main__':
+    # コマンドライン引数の取得
+    args = parse_args()
+
+    # パス設定
+    path = Path()
+    index_path = args.index or os.path.join(os.path.dirname(path.scene_data_path), 'scene_index.npz')
+
+    if args.command == 'build':
+        index = SceneIndex.load(index_path) if os.path.exists(index_path) and not args.rebuild else None
+        index = build_scene_index(path.scene_data_path, index)
+        index.save(index_path)
+
+        logger.debug(f'インデックスを保存しました。（{len(index)} シーン）')
+        logger.debug('保存先 : ' + index_path)
+    else:
+        index = SceneIndex.load(index_path)
+        video_ids = {row[0] for row in iter_csv(args.videos_from, usecols=['映像コード'])} if args.videos_from else None
+
+        for (video_id, scene_no), similarity in index.query_scene(args.video_id, args.scene_no, args.top_k, video_ids):
+            print(f'{video_id},{scene_no},{similarity}')